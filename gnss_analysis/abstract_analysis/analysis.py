@@ -10,20 +10,42 @@
 # WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
 
 class Analysis(object):
+  """
+  A computation SITL runs on each datum (or once on all the data, for
+  summaries), which may depend on the results of its parents.
+
+  Map analyses may declare the shape and dtype of their results, so that
+  they're stored in preallocated arrays rather than as objects (see
+  map_columns). A dimension of None may vary from datum to datum, and
+  None results are stored as missing.
+
+  Parameters
+  ----------
+  map_shape : tuple, optional
+    The shape of each result, if it's always an array (or scalar).
+  map_dtype : dtype, optional
+    The type of the results, if map_shape is declared. (default float64)
+  """
   def __init__(self, key, parents=set(), keep_as_map=False, keep_as_fold=False,
-                     fold_init=None, is_summary=False):
+                     fold_init=None, is_summary=False,
+                     map_shape=None, map_dtype=None):
     self.parents = parents
     self.key = key
     self.keep_as_map = keep_as_map
     self.keep_as_fold = keep_as_fold
     self.is_summary = is_summary
     self.fold_init = fold_init
+    self.map_shape = map_shape
+    self.map_dtype = map_dtype
     self.check_valid()
 
   def merge_storage(self, other):
     self.keep_as_map = self.keep_as_map or other.keep_as_map
     self.keep_as_fold = self.keep_as_fold or other.keep_as_fold
     self.is_summary = self.is_summary or other.is_summary
+    if self.map_shape is None:
+      self.map_shape = other.map_shape
+      self.map_dtype = other.map_dtype
 
   def compute(self, data, current_analyses, prev_fold, parameters):
     pass
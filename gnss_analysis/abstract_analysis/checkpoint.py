@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Ian Horn <ian@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+"""Checkpoints of SITL runs, to resume them after they're interrupted.
+
+A checkpoint holds everything SITL.compute has accumulated after some
+number of epochs: the epoch cursor and keys, the previous fold, the map
+columns and, if the SITL can save it, the state of the filter. What grows
+with the epochs (the keys and the map columns) is appended to a segment
+file, one segment of the epochs since the previous checkpoint at a time,
+so that each checkpoint costs the same however long the run. The rest is
+pickled to the checkpoint file, replaced atomically, along with the size
+of the segment file it covers, so that a run killed while writing either
+leaves the previous checkpoint intact.
+
+"""
+
+import cPickle as pickle
+import os
+import tempfile
+import time
+
+DEFAULT_EVERY = 1000
+
+SEGMENTS_SUFFIX = '.segments'
+
+# Bumped when the layout of checkpoints changes, so old ones aren't used.
+CHECKPOINT_VERSION = 2
+
+
+class CheckpointError(Exception):
+  """Raised when a checkpoint doesn't belong to the run resuming it."""
+  pass
+
+
+class Checkpointer(object):
+  """Saves and loads the checkpoints of a SITL run.
+
+  Parameters
+  ----------
+  path : str
+    File of the checkpoint. Its segments are in path + SEGMENTS_SUFFIX.
+  every : int, optional
+    Epochs between checkpoints (default DEFAULT_EVERY)
+  seconds : float, optional
+    If given, also checkpoint when this many seconds have passed since
+    the last checkpoint.
+
+  """
+
+  def __init__(self, path, every=DEFAULT_EVERY, seconds=None):
+    self.path = path
+    self.every = every
+    self.seconds = seconds
+    self.segments_path = path + SEGMENTS_SUFFIX
+    self.segments_size = 0
+    self.last_cursor = 0
+    self.last_time = time.time()
+
+  def due(self, cursor):
+    """Returns whether to checkpoint after cursor epochs."""
+    if self.every and cursor - self.last_cursor >= self.every:
+      return True
+    return self.seconds is not None \
+      and time.time() - self.last_time >= self.seconds
+
+  def save(self, state, segment=None):
+    """Writes a checkpoint, a dict with at least a 'cursor', replacing the
+    previous one, and appends segment, what's new since the previous
+    one, to its segments.
+
+    """
+    size = self._append(segment)
+    state = dict(state, version=CHECKPOINT_VERSION, segments_size=size)
+    directory = os.path.dirname(os.path.abspath(self.path))
+    fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=directory)
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+      os.rename(tmp, self.path)
+    except:
+      os.remove(tmp)
+      raise
+    self.segments_size = size
+    self.last_cursor = state['cursor']
+    self.last_time = time.time()
+
+  def _append(self, segment):
+    """Appends a segment after those of the last checkpoint, dropping any
+    written since, and returns the size of the segments.
+
+    """
+    mode = 'r+b' if os.path.exists(self.segments_path) else 'wb'
+    with open(self.segments_path, mode) as f:
+      f.truncate(self.segments_size)
+      f.seek(self.segments_size)
+      if segment is not None:
+        pickle.dump(segment, f, pickle.HIGHEST_PROTOCOL)
+      f.flush()
+      os.fsync(f.fileno())
+      return f.tell()
+
+  def _read_segments(self, size):
+    segments = []
+    with open(self.segments_path, 'rb') as f:
+      while f.tell() < size:
+        segments.append(pickle.load(f))
+    return segments
+
+  def load(self):
+    """Returns the last checkpoint, or None if there's none, or it's of
+    an older layout. Its 'segments' are the segments saved with it and
+    every earlier checkpoint, in order.
+
+    """
+    try:
+      f = open(self.path, 'rb')
+    except IOError:
+      return None
+    with f:
+      state = pickle.load(f)
+    if state.get('version') != CHECKPOINT_VERSION:
+      return None
+    try:
+      state['segments'] = self._read_segments(state['segments_size'])
+    except (IOError, EOFError):
+      # The segments are missing or cut short.
+      return None
+    self.segments_size = state['segments_size']
+    self.last_cursor = state['cursor']
+    self.last_time = time.time()
+    return state
+
+  def clear(self):
+    """Deletes the checkpoint, if any."""
+    for path in [self.path, self.segments_path]:
+      try:
+        os.remove(path)
+      except OSError:
+        pass
+    self.segments_size = 0
+    self.last_cursor = 0
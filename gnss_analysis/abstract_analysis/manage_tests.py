@@ -9,10 +9,130 @@
 # EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
 # WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
 
-import pandas as pd
+from gnss_analysis.abstract_analysis.checkpoint import CheckpointError
+from gnss_analysis.abstract_analysis.map_columns import DEFAULT_CAPACITY, \
+  mk_column
+import numpy as np
+import warnings
+
+class AnalysisCycleError(Exception):
+  """Raised when analyses depend on each other in a cycle."""
+  pass
+
+
+class ExecutionPlan(object):
+  """
+  The analyses needed by a set of reports, in the order to compute them.
+
+  A plan doesn't change once compiled, and holds no per-run state, so one
+  plan can be shared by any number of SITL runs over different data.
+
+  Parameters
+  ----------
+  reports : iterable of Report
+    The reports to compute. Only the analyses they depend on, directly or
+    through other analyses, are part of the plan.
+
+  Attributes
+  ----------
+  steps : tuple of (Analysis, bool, bool)
+    The non-summary analyses in dependency order, each with whether its
+    results are kept as a map and as a fold.
+  summaries : tuple of Analysis
+    The summary analyses in dependency order.
+  reports : tuple of Report
+  map_keys : tuple of str
+    Keys of the analyses kept as maps.
+  map_specs : dict
+    The declared (map_shape, map_dtype) of each analysis kept as a map.
+  fold_keys : tuple of str
+    Keys of the analyses kept as folds.
+  """
+  def __init__(self, reports):
+    analyses = {}
+    storage = {}
+    specs = {}
+    edges = {}
+    seen = set()
+    pending = [a for report in reports for a in report.parents]
+    while pending:
+      analysis = pending.pop()
+      if id(analysis) in seen:
+        continue
+      seen.add(id(analysis))
+      # Analyses with the same key are the same analysis, stored in every
+      # way any of them asks for (as in Analysis.merge_storage).
+      key = analysis.key
+      flags = (analysis.keep_as_map, analysis.keep_as_fold,
+               analysis.is_summary)
+      if key in analyses:
+        storage[key] = tuple(x or y for x, y in zip(storage[key], flags))
+      else:
+        analyses[key] = analysis
+        storage[key] = flags
+      if specs.get(key, (None,))[0] is None:
+        specs[key] = (analysis.map_shape, analysis.map_dtype)
+      edges.setdefault(key, set())
+      for parent in analysis.parents:
+        edges.setdefault(parent.key, set()).add(key)
+        pending.append(parent)
+    order = topological_order(sorted(analyses), edges)
+    self.steps = tuple((analyses[key],) + storage[key][:2]
+                       for key in order if not storage[key][2])
+    self.summaries = tuple(analyses[key] for key in order if storage[key][2])
+    self.reports = tuple(reports)
+    self.map_keys = tuple(a.key for a, keep_map, _ in self.steps if keep_map)
+    self.map_specs = dict((key, specs[key]) for key in self.map_keys)
+    self.fold_keys = tuple(a.key for a, _, keep_fold in self.steps
+                           if keep_fold)
+
+  def fold_inits(self):
+    """Returns the initial fold values."""
+    return dict((a.key, a.fold_init)
+                for a, _, keep_fold in self.steps if keep_fold)
+
+  def map_columns(self, capacity=DEFAULT_CAPACITY):
+    """Returns empty columns (see map_columns) for the map results."""
+    return dict((key, mk_column(shape, dtype, capacity))
+                for key, (shape, dtype) in self.map_specs.iteritems())
+
 
 class SITL(object):
-  def __init__(self, update_function, data, parameters=None):
+  """
+  Runs an update function and analyses over each datum of data.
+
+  Parameters
+  ----------
+  update_function : callable
+    Called with each epoch's datum (or context) and the parameters.
+  data : iterable
+    The data, iterated over as in compute.
+  parameters : object, optional
+    An object used to parametrize the SITL runs
+  context_function : callable, optional
+    If given, it's called once per epoch on the datum, and what it returns
+    is passed to the update function and the analyses in place of the
+    datum, so that data derived from the datum (such as its SingleDiffs,
+    see utils.EpochContext) is computed once and shared between them.
+  plan : ExecutionPlan, optional
+    A compiled plan to run, instead of compiling one from the reports
+    added. Useful to compile once for many runs.
+  checkpoint : Checkpointer, optional
+    If given, compute saves its progress every so often, and resumes
+    from the last checkpoint if there is one. The checkpoint is deleted
+    once compute finishes.
+  save_state : callable, optional
+    Returns a picklable copy of the state kept by the update function
+    (such as the filter's), to save with each checkpoint.
+  restore_state : callable, optional
+    Called with a state returned by save_state to restore it when
+    resuming. Without it, the update function alone is rerun over the
+    epochs before the checkpoint, and its state is checked against the
+    saved one.
+  """
+  def __init__(self, update_function, data, parameters=None,
+               context_function=None, plan=None, checkpoint=None,
+               save_state=None, restore_state=None):
     self.analyses = dict()
     self.non_summary_analyses = []
     self.summary_analyses = []
@@ -22,6 +142,11 @@ class SITL(object):
     self.parameters = parameters
     self.all_maps = None
     self.update_function = update_function
+    self.context_function = context_function
+    self.plan = plan
+    self.checkpoint = checkpoint
+    self.save_state = save_state
+    self.restore_state = restore_state
 
   def add_reports(self, reports):
     for report in reports:
@@ -29,84 +154,182 @@ class SITL(object):
 
   def add_report(self, report):
     self.reports.add(report)
+    self.plan = None
     for analysis in report.parents:
       self.add_analysis(analysis)
 
   def add_analysis(self, analysis):
+    self.plan = None
     if analysis.key in self.analyses.keys():
+      # Its parents are already added, or being added further up a cycle
+      # that compile reports.
       self.analyses[analysis.key].merge_storage(analysis)
-    else:
-      self.analyses[analysis.key] = analysis
+      return
+    self.analyses[analysis.key] = analysis
     for parent in analysis.parents:
       self.add_analysis(parent)
       self.analysis_edges.add( (parent.key, analysis.key) )
 
-  def compute(self):
-    self.sort_analyses()
-    prev_fold = fold_inits(self.non_summary_analyses)
-    maps = dict()
+  def compile(self):
+    """
+    Returns the ExecutionPlan of the reports added, compiling it the first
+    time it's needed after reports or analyses are added.
+    """
+    if self.plan is None:
+      self.plan = ExecutionPlan(self.reports)
+    return self.plan
+
+  def compute(self, data=None, parameters=None):
+    """
+    Runs the plan over data, returning a dict of report key to report.
+    With a checkpoint, it resumes from the last one, if any.
 
-    if type(self.data) == pd.Panel:
-      itr = self.data.iteritems()
+    Parameters
+    ----------
+    data : iterable, optional
+      The data to run over, instead of the data the SITL was made with.
+    parameters : object, optional
+      Parameters to run with, instead of the SITL's.
+    """
+    plan = self.compile()
+    data = self.data if data is None else data
+    parameters = self.parameters if parameters is None else parameters
+    columns = plan.map_columns(_capacity(data))
+    saved, prev_fold, index = self._resume(plan, columns)
+    n_saved = len(index)
+
+    # Panels, and streams like data_io.SdiffStream, are iterated over as
+    # (key, datum) pairs. A stream is consumed here, so summaries and
+    # reports get it already exhausted.
+    if hasattr(data, 'iteritems'):
+      itr = data.iteritems()
     else:
-      itr = enumerate(self.data)
-    for i, datum in itr:
-      #initialize
-      current_analyses = dict()
-      current_fold = dict()
-      current_map = dict()
-
-      #update
-      self.update_function(datum, self.parameters)
-
-      # compute everything and put it away for other computations
-      for analysis in self.non_summary_analyses:
-        comp = analysis.compute(datum, current_analyses, prev_fold, self.parameters)
-        key = analysis.key
-        if analysis.keep_as_map:
-          current_map[key] = comp
-        if analysis.keep_as_fold:
-          current_fold[key] = comp
-        current_analyses[analysis.key] = comp
-
-      #store analyses for later
-      prev_fold = current_fold
-      maps[i] = current_map
-    analyses = pandafy(maps)
-    for analysis in self.summary_analyses:
-      analyses[analysis.key] = analysis.compute(self.data, analyses, prev_fold, self.parameters)
+      itr = enumerate(data)
+    n_seen = 0
+    for n, (i, datum) in enumerate(itr):
+      n_seen = n + 1
+      if n < n_saved:
+        self._catch_up(n, i, datum, index, saved, parameters)
+        continue
+      prev_fold = self._step(plan, datum, prev_fold, columns, parameters)
+      index.append(i)
+      if self.checkpoint is not None and self.checkpoint.due(len(index)):
+        self._save_checkpoint(plan, index, prev_fold, columns)
+    if n_seen < n_saved:
+      raise CheckpointError("Checkpoint %s is of %d epochs, but the data has "
+                            "%d." % (self.checkpoint.path, n_saved, n_seen))
+    self.all_maps = columns
+    analyses = dict((key, column.to_series(index))
+                    for key, column in columns.iteritems())
+    for analysis in plan.summaries:
+      analyses[analysis.key] = analysis.compute(data, analyses, prev_fold, parameters)
     reports = dict()
-    for report in self.reports:
-      reports[report.key] = report.report(self.data, analyses, prev_fold, self.parameters)
+    for report in plan.reports:
+      reports[report.key] = report.report(data, analyses, prev_fold, parameters)
+    if self.checkpoint is not None:
+      self.checkpoint.clear()
     return reports
 
-  def sort_analyses(self):
-    #TODO detect and report cycles
-    nodes = self.analyses.keys()
-    edges = self.analysis_edges
-    s = nodes_without_incoming_edges(nodes, edges)
-    self.non_summary_analyses = []
-    self.summary_analyses = []
-    while not is_empty(s):
-      node_from = s.pop()
-      analysis = self.analyses[node_from]
-      if analysis.is_summary:
-        self.summary_analyses.append(analysis)
-      else:
-        self.non_summary_analyses.append(analysis)
-      nodes_to = [edge[1] for edge in edges if edge[0] == node_from]
-      for node_to in nodes_to:
-        edges.remove((node_from, node_to))
-        if not has_incoming_edges(edges, node_to):
-          s.append(node_to)
+  def _step(self, plan, datum, prev_fold, columns, parameters):
+    """
+    Runs the update function and the analyses over an epoch's datum,
+    appending the map results to columns. Returns the epoch's fold.
+    """
+    #initialize
+    current_analyses = dict()
+    current_fold = dict()
+    if self.context_function is not None:
+      datum = self.context_function(datum)
+
+    #update
+    self.update_function(datum, parameters)
+
+    # compute everything and put it away for other computations
+    for analysis, keep_as_map, keep_as_fold in plan.steps:
+      comp = analysis.compute(datum, current_analyses, prev_fold, parameters)
+      key = analysis.key
+      if keep_as_map:
+        columns[key].append(comp)
+      if keep_as_fold:
+        current_fold[key] = comp
+      current_analyses[key] = comp
+    return current_fold
 
-def pandafy(maps):
-  df = pd.DataFrame(maps).T
-  d = dict()
-  for key in df.keys():
-    d[key] = df[key]
-  return d
+  def _resume(self, plan, columns):
+    """
+    Loads the last checkpoint, if any, into columns. Returns the
+    checkpoint (None if there's none), the fold and the keys of the
+    epochs to go on from.
+    """
+    saved = None
+    if self.checkpoint is not None:
+      saved = self.checkpoint.load()
+    if saved is None:
+      return None, plan.fold_inits(), []
+    if saved['plan'] != (plan.map_keys, plan.fold_keys):
+      raise CheckpointError("Checkpoint %s is of different analyses."
+                            % self.checkpoint.path)
+    index = []
+    for segment in saved['segments']:
+      index.extend(segment['index'])
+      for key, column in columns.iteritems():
+        column.extend(segment['columns'][key])
+    if self.restore_state is not None:
+      self.restore_state(saved['state'])
+    return saved, saved['prev_fold'], index
 
+  def _catch_up(self, n, i, datum, index, saved, parameters):
+    """
+    Handles the n-th epoch, with key i, when it was computed before the
+    checkpoint. Its analyses are in the checkpoint, so only the update
+    function's state needs catching up with, unless it was restored.
+    """
+    if i != index[n]:
+      raise CheckpointError("Epoch %d is %r, but %r in checkpoint %s."
+                            % (n, i, index[n], self.checkpoint.path))
+    if self.restore_state is not None:
+      return
+    if self.context_function is not None:
+      datum = self.context_function(datum)
+    self.update_function(datum, parameters)
+    if n == len(index) - 1:
+      self._check_state(saved['state'])
+
+  def _save_checkpoint(self, plan, index, prev_fold, columns):
+    """
+    Checkpoints the run after the epochs of index, saving only the keys
+    and map results of those since the last checkpoint.
+    """
+    start = self.checkpoint.last_cursor
+    segment = {'index': index[start:],
+               'columns': dict((key, column.segment(start))
+                               for key, column in columns.iteritems())}
+    self.checkpoint.save({
+      'plan': (plan.map_keys, plan.fold_keys),
+      'cursor': len(index),
+      'prev_fold': prev_fold,
+      'state': None if self.save_state is None else self.save_state()},
+      segment)
+
+  def _check_state(self, saved_state):
+    """Warns if the state caught up with isn't the checkpointed one."""
+    if self.save_state is None or saved_state is None:
+      return
+    if not same_state(self.save_state(), saved_state):
+      warnings.warn("Rerunning the update function up to checkpoint %s "
+                    "didn't reproduce its state." % self.checkpoint.path)
+
+  def sort_analyses(self):
+    plan = self.compile()
+    self.non_summary_analyses = [a for a, _, _ in plan.steps]
+    self.summary_analyses = list(plan.summaries)
+
+def _capacity(data):
+  """Returns the number of epochs to allocate map columns for."""
+  try:
+    return len(data)
+  except TypeError:
+    return DEFAULT_CAPACITY
 
 def fold_inits(non_summary_analyses):
   folds = dict()
@@ -115,15 +338,51 @@ def fold_inits(non_summary_analyses):
       folds[analysis.key] = analysis.fold_init
   return folds
 
-def nodes_without_incoming_edges(nodes, edges):
-  # NOTE can't just go through the edge list because some nodes have no edges
-  return [node for node in nodes if not has_incoming_edges(edges, node)]
+def same_state(a, b):
+  """
+  Returns whether two states, nested dicts, lists and tuples of arrays
+  and scalars, are equal, taking NaNs as equal to each other.
+  """
+  if isinstance(a, dict):
+    return isinstance(b, dict) and sorted(a) == sorted(b) \
+      and all(same_state(a[k], b[k]) for k in a)
+  if isinstance(a, (list, tuple)):
+    return isinstance(b, (list, tuple)) and len(a) == len(b) \
+      and all(same_state(x, y) for x, y in zip(a, b))
+  a, b = np.asarray(a), np.asarray(b)
+  return a.shape == b.shape and ((a == b) | ((a != a) & (b != b))).all()
+
+def topological_order(nodes, edges):
+  """
+  Returns the nodes ordered so that each comes after every node with an
+  edge to it, breaking ties by the order of nodes.
 
-def has_incoming_edges(edges, node):
-  for edge in edges:
-    if edge[1] == node:
-      return True
-  return False
+  Parameters
+  ----------
+  nodes : list
+  edges : dict
+    Map from each node to the set of nodes its edges go to.
 
-def is_empty(has_len):
-  return len(has_len) == 0
+  Raises
+  ------
+  AnalysisCycleError
+    If the edges have a cycle.
+  """
+  n_incoming = dict((node, 0) for node in nodes)
+  for node in nodes:
+    for node_to in edges[node]:
+      n_incoming[node_to] += 1
+  ready = [node for node in reversed(nodes) if n_incoming[node] == 0]
+  order = []
+  while ready:
+    node = ready.pop()
+    order.append(node)
+    for node_to in sorted(edges[node], reverse=True):
+      n_incoming[node_to] -= 1
+      if n_incoming[node_to] == 0:
+        ready.append(node_to)
+  if len(order) < len(nodes):
+    cyclic = sorted(node for node in nodes if n_incoming[node] > 0)
+    raise AnalysisCycleError("Analyses depend on each other in a cycle: %s"
+                             % ', '.join(map(str, cyclic)))
+  return order
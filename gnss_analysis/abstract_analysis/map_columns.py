@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Ian Horn <ian@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+"""Columnar storage of the per-epoch results of map analyses.
+
+An analysis that declares the shape and dtype of its results (see
+Analysis's map_shape and map_dtype) has them written into a preallocated
+NumPy array as SITL runs, rather than kept as one Python object per
+epoch. Dimensions declared as None may vary from epoch to epoch, and
+results with any are kept flattened into one array of values, with the
+offset and shape of each epoch's result. Results of analyses that don't
+declare a shape are kept in a list.
+
+Every column can hand out the results from some epoch on as a segment,
+and be extended by one, so that checkpoints only save what's new.
+
+"""
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_CAPACITY = 1024
+
+
+def _grow(a, n):
+  """Returns a with its first axis at least n long, doubling it if not.
+
+  """
+  if len(a) >= n:
+    return a
+  b = np.empty((max(n, 2 * len(a)),) + a.shape[1:], dtype=a.dtype)
+  b[:len(a)] = a
+  return b
+
+
+def _missing(dtype):
+  return np.nan if np.dtype(dtype).kind in 'fc' else 0
+
+
+class ObjectColumn(object):
+  """Results of any type, one object per epoch.
+
+  """
+
+  def __init__(self):
+    self.objects = []
+
+  def __len__(self):
+    return len(self.objects)
+
+  def append(self, value):
+    self.objects.append(value)
+
+  def segment(self, start):
+    """Returns the results from epoch start on."""
+    return self.objects[start:]
+
+  def extend(self, segment):
+    """Appends the results of a segment."""
+    self.objects.extend(segment)
+
+  def to_series(self, index):
+    return pd.Series(self.objects, index=index, dtype=object)
+
+
+class DenseColumn(object):
+  """Results of a fixed shape and dtype, as an (epochs,) + shape array.
+  Epochs whose result is None are marked as missing.
+
+  Parameters
+  ----------
+  shape : tuple
+    Shape of each result
+  dtype : dtype
+    Type of the results
+  capacity : int, optional
+    Number of epochs to allocate for. The column grows as needed.
+
+  """
+
+  def __init__(self, shape, dtype, capacity=DEFAULT_CAPACITY):
+    self.shape = tuple(shape)
+    self.n = 0
+    self.data = np.empty((capacity,) + self.shape, dtype=dtype)
+    self.present = np.empty(capacity, dtype=bool)
+
+  def __len__(self):
+    return self.n
+
+  def append(self, value):
+    n = self.n + 1
+    self.data = _grow(self.data, n)
+    self.present = _grow(self.present, n)
+    if value is None:
+      self.data[self.n] = _missing(self.data.dtype)
+      self.present[self.n] = False
+    else:
+      self.data[self.n] = value
+      self.present[self.n] = True
+    self.n = n
+
+  def segment(self, start):
+    """Returns the results from epoch start on, as copies of their rows
+    of data and present.
+
+    """
+    return self.data[start:self.n].copy(), self.present[start:self.n].copy()
+
+  def extend(self, segment):
+    """Appends the results of a segment."""
+    data, present = segment
+    n = self.n + len(present)
+    self.data = _grow(self.data, n)
+    self.present = _grow(self.present, n)
+    self.data[self.n:n] = data
+    self.present[self.n:n] = present
+    self.n = n
+
+  @property
+  def values(self):
+    """The (epochs,) + shape array of results, as a view."""
+    return self.data[:self.n]
+
+  def to_series(self, index):
+    """Returns the results as a Series. Scalar results are a Series of the
+    column's dtype with NaNs for missing ones, upcast to float if it
+    can't hold NaN and some are missing; others are a Series of views of
+    their rows, with None for missing ones.
+
+    """
+    values = self.values
+    present = self.present[:self.n]
+    if not self.shape:
+      if not present.all() and values.dtype.kind not in 'fc':
+        values = values.astype(np.float64)
+        values[~present] = np.nan
+      return pd.Series(values, index=index)
+    rows = np.empty(self.n, dtype=object)
+    for i in np.flatnonzero(present):
+      rows[i] = values[i]
+    return pd.Series(rows, index=index, dtype=object)
+
+
+class RaggedColumn(object):
+  """Results whose shape varies from epoch to epoch, as one array of
+  their flattened values with the offset and shape of each epoch's.
+
+  Parameters
+  ----------
+  ndim : int
+    Number of dimensions of each result
+  dtype : dtype
+    Type of the results
+  capacity : int, optional
+    Number of epochs to allocate for. The column grows as needed.
+
+  """
+
+  def __init__(self, ndim, dtype, capacity=DEFAULT_CAPACITY):
+    self.ndim = ndim
+    self.n = 0
+    self.flat = np.empty(capacity, dtype=dtype)
+    self.offsets = np.zeros(capacity + 1, dtype=np.int64)
+    self.shapes = np.zeros((capacity, ndim), dtype=np.int64)
+    self.present = np.empty(capacity, dtype=bool)
+
+  def __len__(self):
+    return self.n
+
+  def append(self, value):
+    i = self.n
+    self.n += 1
+    self.offsets = _grow(self.offsets, self.n + 1)
+    self.shapes = _grow(self.shapes, self.n)
+    self.present = _grow(self.present, self.n)
+    start = self.offsets[i]
+    if value is None:
+      self.shapes[i] = 0
+      self.present[i] = False
+      self.offsets[self.n] = start
+      return
+    value = np.asarray(value, dtype=self.flat.dtype)
+    if value.ndim != self.ndim:
+      raise ValueError("Result of %d dimensions in a column of %d."
+                       % (value.ndim, self.ndim))
+    end = start + value.size
+    self.flat = _grow(self.flat, end)
+    self.flat[start:end] = value.ravel()
+    self.shapes[i] = value.shape
+    self.present[i] = True
+    self.offsets[self.n] = end
+
+  def segment(self, start):
+    """Returns the results from epoch start on, as copies of their
+    flattened values, offsets (from the first of them), shapes and
+    present.
+
+    """
+    offsets = self.offsets[start:self.n + 1]
+    return (self.flat[offsets[0]:offsets[-1]].copy(), offsets - offsets[0],
+            self.shapes[start:self.n].copy(),
+            self.present[start:self.n].copy())
+
+  def extend(self, segment):
+    """Appends the results of a segment."""
+    flat, offsets, shapes, present = segment
+    i = self.n
+    n = i + len(present)
+    start = self.offsets[i]
+    self.flat = _grow(self.flat, start + len(flat))
+    self.offsets = _grow(self.offsets, n + 1)
+    self.shapes = _grow(self.shapes, n)
+    self.present = _grow(self.present, n)
+    self.flat[start:start + len(flat)] = flat
+    self.offsets[i:n + 1] = start + offsets
+    self.shapes[i:n] = shapes
+    self.present[i:n] = present
+    self.n = n
+
+  @property
+  def values(self):
+    """The flattened values of all the results, as a view."""
+    return self.flat[:self.offsets[self.n]]
+
+  def row(self, i):
+    """Returns the result of the i-th epoch, as a view, or None if it's
+    missing.
+
+    """
+    if not self.present[i]:
+      return None
+    return self.flat[self.offsets[i]:self.offsets[i + 1]] \
+      .reshape(self.shapes[i])
+
+  def to_series(self, index):
+    """Returns the results as a Series of views, with None for missing
+    ones.
+
+    """
+    rows = np.empty(self.n, dtype=object)
+    for i in range(self.n):
+      rows[i] = self.row(i)
+    return pd.Series(rows, index=index, dtype=object)
+
+
+def mk_column(shape=None, dtype=None, capacity=DEFAULT_CAPACITY):
+  """Returns an empty column for results of a declared shape (None if
+  undeclared) and dtype (default float64).
+
+  """
+  if shape is None:
+    return ObjectColumn()
+  dtype = np.float64 if dtype is None else dtype
+  if any(d is None for d in shape):
+    return RaggedColumn(len(shape), dtype, capacity)
+  return DenseColumn(shape, dtype, capacity)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Bhaskar Mookerji <mookerji@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+"""Array-backed accumulators for high-rate, panel-like records2table
+tables (observations and tracking states).
+
+Instead of one dict per record, each record is stored as a row of
+growable typed arrays: an item index (e.g., epoch), a minor index
+(e.g., satellite) and one float64 column per field. Panels and long
+DataFrames are built from these in a single vectorized step.
+
+"""
+
+from gnss_analysis.table_io import PANEL_INDEX_NAMES
+import numpy as np
+import pandas as pd
+
+INITIAL_CAPACITY = 1024
+
+
+class KeyIndex(object):
+  """Assigns consecutive integer indices to hashable keys.
+
+  """
+
+  def __init__(self):
+    self.index = {}
+    self.keys = []
+
+  def get(self, key):
+    i = self.index.get(key)
+    if i is None:
+      i = len(self.keys)
+      self.index[key] = i
+      self.keys.append(key)
+    return i
+
+  def sort_ranks(self):
+    """Returns (sorted_keys, ranks), where ranks[i] is the position of the
+    i-th key in sorted_keys.
+
+    """
+    order = sorted(range(len(self.keys)), key=self.keys.__getitem__)
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = np.arange(len(order))
+    return [self.keys[i] for i in order], ranks
+
+  def __len__(self):
+    return len(self.keys)
+
+
+class PanelAccumulator(object):
+  """Accumulates numeric records of a table that is stored as a Panel with
+  items, fields and minor axis, e.g. {epoch: {prn: {field: value}}}.
+
+  Fields are added as they're first seen, and records that don't have a
+  field are NaN for it. If a record is appended twice for the same
+  (item, minor), the last one wins, as with the dicts it replaces.
+
+  Parameters
+  ----------
+  fields : list, optional
+    Fields known in advance.
+
+  """
+
+  def __init__(self, fields=()):
+    self.fields = []
+    self.clear()
+    for field in fields:
+      self._add_field(field)
+
+  def clear(self):
+    self.items = KeyIndex()
+    self.minors = KeyIndex()
+    self.n = 0
+    self.capacity = INITIAL_CAPACITY
+    self.item_idx = np.empty(self.capacity, dtype=np.int32)
+    self.minor_idx = np.empty(self.capacity, dtype=np.int32)
+    self.columns = dict((field, self._new_column())
+                        for field in getattr(self, 'columns', {}))
+
+  def _new_column(self):
+    col = np.empty(self.capacity, dtype=np.float64)
+    col[:self.n] = np.nan
+    return col
+
+  def _add_field(self, field):
+    self.fields.append(field)
+    self.columns[field] = self._new_column()
+
+  def _grow(self):
+    self.capacity *= 2
+    self.item_idx = np.resize(self.item_idx, self.capacity)
+    self.minor_idx = np.resize(self.minor_idx, self.capacity)
+    for field, col in self.columns.iteritems():
+      self.columns[field] = np.resize(col, self.capacity)
+
+  def append(self, item, minor, record):
+    """Appends a record (a dict of numeric fields) for (item, minor).
+
+    """
+    if self.n == self.capacity:
+      self._grow()
+    n = self.n
+    self.item_idx[n] = self.items.get(item)
+    self.minor_idx[n] = self.minors.get(minor)
+    for field, col in self.columns.iteritems():
+      col[n] = record.get(field, np.nan)
+    for field in record:
+      if field not in self.columns:
+        self._add_field(field)
+        self.columns[field][n] = record[field]
+    self.n += 1
+
+  def append_row(self, item, minor, values):
+    """Appends a record for (item, minor) given as a sequence of values,
+    one for each of self.fields, in order. This skips building a dict for
+    every record when the fields are known in advance.
+
+    """
+    if self.n == self.capacity:
+      self._grow()
+    n = self.n
+    self.item_idx[n] = self.items.get(item)
+    self.minor_idx[n] = self.minors.get(minor)
+    for field, value in zip(self.fields, values):
+      self.columns[field][n] = value
+    self.n += 1
+
+  def __len__(self):
+    return self.n
+
+  def _rows(self):
+    """Returns the sorted item keys, minor keys, and per-row item ranks,
+    minor ranks and row numbers, keeping only the last row for each
+    (item, minor).
+
+    """
+    item_keys, item_ranks = self.items.sort_ranks()
+    minor_keys, minor_ranks = self.minors.sort_ranks()
+    ii = item_ranks[self.item_idx[:self.n]]
+    mi = minor_ranks[self.minor_idx[:self.n]]
+    code = ii * max(len(minor_keys), 1) + mi
+    # np.unique returns the first occurrence, so search the reversed codes
+    # to find the last one.
+    _, rev = np.unique(code[::-1], return_index=True)
+    rows = self.n - 1 - rev
+    return item_keys, minor_keys, ii[rows], mi[rows], rows
+
+  def to_panel(self):
+    """Builds the Panel (items, fields, minor axis) of all records.
+
+    """
+    if self.n == 0:
+      return pd.Panel()
+    fields = sorted(self.columns)
+    item_keys, minor_keys, ii, mi, rows = self._rows()
+    data = np.empty((len(item_keys), len(fields), len(minor_keys)))
+    data.fill(np.nan)
+    for j, field in enumerate(fields):
+      data[ii, j, mi] = self.columns[field][rows]
+    return pd.Panel(data, items=item_keys, major_axis=fields,
+                    minor_axis=minor_keys)
+
+  def to_long_frame(self):
+    """Builds a DataFrame with one row per record, indexed by
+    (item, minor), as used by table_io for streamed tables.
+
+    """
+    if self.n == 0:
+      return pd.DataFrame()
+    item_keys, minor_keys, ii, mi, rows = self._rows()
+    index = pd.MultiIndex.from_arrays([np.asarray(item_keys, dtype=object)[ii],
+                                       np.asarray(minor_keys, dtype=object)[mi]],
+                                      names=PANEL_INDEX_NAMES)
+    fields = sorted(self.columns)
+    return pd.DataFrame(dict((f, self.columns[f][rows]) for f in fields),
+                        index=index, columns=fields)
+
+  def drain(self, keep_latest_item=False):
+    """Returns the long DataFrame of the accumulated records and removes
+    them, optionally keeping the records of the latest (largest) item.
+
+    """
+    if self.n == 0 or not keep_latest_item:
+      df = self.to_long_frame()
+      self.clear()
+      return df
+    latest = max(self.items.keys)
+    keep = self.item_idx[:self.n] == self.items.index[latest]
+    kept = [(self.minors.keys[self.minor_idx[i]],
+             dict((f, c[i]) for f, c in self.columns.iteritems()))
+            for i in np.flatnonzero(keep)]
+    self._keep_rows(~keep)
+    df = self.to_long_frame()
+    self.clear()
+    for minor, record in kept:
+      self.append(latest, minor, record)
+    return df
+
+  def _keep_rows(self, mask):
+    rows = np.flatnonzero(mask)
+    m = len(rows)
+    self.item_idx[:m] = self.item_idx[rows]
+    self.minor_idx[:m] = self.minor_idx[rows]
+    for col in self.columns.itervalues():
+      col[:m] = col[rows]
+    self.n = m
@@ -14,6 +14,36 @@ import pandas as pd
 import numpy as np
 
 
+def append_row(store, key, row, reports):
+  """Writes the reports of a run as a row of the aggregate table in an
+  HDFStore, adding columns for any new reports.
+
+  Parameters
+  ----------
+  store : HDFStore
+    The store of the aggregate table
+  key : str
+    The key of the aggregate table
+  row : str
+    The row to write, replacing it if it's already there
+  reports : dict
+    The reports of the run, by report key
+
+  """
+  if ('/' + key) in store.keys():
+    out_df = store[key]
+  else:
+    out_df = pd.DataFrame()
+
+  new_cols = [col for col in reports.keys() if col not in out_df.columns]
+  for new_col in new_cols:
+    out_df[new_col] = pd.Series(np.nan * np.empty_like(out_df.index),
+                                index=out_df.index)
+  out_df.loc[row] = pd.Series(reports)
+
+  store[key] = out_df
+
+
 def main():
   import argparse
   parser = argparse.ArgumentParser(description='RTK Filter SITL tests.')
@@ -45,18 +75,7 @@ def main():
   reports = single_run(hdf5_filename_in, baseline, baseline_is_NED=args.NED)
 
   out_store = pd.HDFStore(hdf5_filename_out)
-  if ('/' + out_key) in out_store.keys():
-    out_df = out_store[out_key]
-  else:
-    out_df = pd.DataFrame()
-
-  new_cols = [col for col in reports.keys() if col not in out_df.columns]
-  for new_col in new_cols:
-    out_df[new_col] = pd.Series(np.nan * np.empty_like(out_df.index),
-                                index=out_df.index)
-  out_df.loc[row] = pd.Series(reports)
-
-  out_store[out_key] = out_df
+  append_row(out_store, out_key, row, reports)
   out_store.close()
 
 if __name__ == "__main__":
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Ian Horn <ian@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+"""Runs the SITL analysis over many datasets in a process pool.
+
+The libswiftnav filter state (swiftnav.dgnss_management) is global to a
+process, so each run needs a process of its own, rather than a thread.
+Runs are listed in a manifest, and the reports of each run are written
+as a row of the aggregate table of agg_run as soon as it finishes.
+
+Each run is isolated in a worker of a worker_pool.WorkerPool, so a run
+that crashes libswiftnav, runs out of memory or time doesn't take the
+batch down with it. Such a run is retried, and if it fails again, its
+row records the failure (see worker_pool.RunFailure.as_dict) in place of
+the reports. With a checkpoint directory, a run that's interrupted, by a
+timeout or by the batch itself being stopped, resumes from its last
+checkpoint when it's run again.
+
+A manifest is a CSV file with a header line and a row per run, with the
+columns:
+
+  file  : the HDF5 file of the run
+  x,y,z : the known baseline
+  ned   : whether the baseline is in NED (optional, default false)
+  row   : the row of the run in the aggregate table (optional, default
+          file)
+
+"""
+
+from gnss_analysis.agg_run import append_row
+from gnss_analysis.runner import full_reports, reports as default_reports, \
+  run as single_run
+from gnss_analysis.worker_pool import WorkerPool
+import hashlib
+import multiprocessing
+import numpy as np
+import os
+import pandas as pd
+import time
+import warnings
+
+MANIFEST_COLUMNS = ['file', 'x', 'y', 'z']
+
+_TRUE = set(['1', 'true', 't', 'yes', 'y'])
+
+
+def read_manifest(filename):
+  """Reads a batch manifest (see the module docstring).
+
+  Returns
+  -------
+  list of dict
+    The runs, each with the keys 'file', 'baseline' (array), 'ned'
+    (bool) and 'row'
+
+  """
+  df = pd.read_csv(filename, skipinitialspace=True, comment='#', dtype=str)
+  missing = [c for c in MANIFEST_COLUMNS if c not in df.columns]
+  if missing:
+    raise Exception("Manifest %s is missing columns: %s"
+                    % (filename, ', '.join(missing)))
+  entries = []
+  for _, r in df.iterrows():
+    ned = r.get('ned', None)
+    row = r.get('row', None)
+    entries.append({
+      'file': r['file'],
+      'baseline': np.array([float(r['x']), float(r['y']), float(r['z'])]),
+      'ned': isinstance(ned, basestring) and ned.strip().lower() in _TRUE,
+      'row': row if isinstance(row, basestring) else r['file']})
+  return entries
+
+
+def checkpoint_path(checkpoint_dir, row):
+  """Returns the checkpoint file of a run in checkpoint_dir."""
+  return os.path.join(checkpoint_dir, hashlib.sha1(row).hexdigest() + '.ckpt')
+
+
+def _run_job(entry, stream, full, checkpoint):
+  """Worker job for batch_run. Returns the reports of a run and the
+  seconds it took.
+
+  """
+  start = time.time()
+  reports = single_run(entry['file'], entry['baseline'],
+                       reports=full_reports if full else default_reports,
+                       baseline_is_NED=entry['ned'], stream=stream,
+                       checkpoint=checkpoint)
+  return reports, time.time() - start
+
+
+def batch_run(entries, outfile, key='table', workers=None, stream=False,
+              full=False, timeout=None, max_bytes=None, retries=1,
+              checkpoint_dir=None):
+  """Runs the SITL analysis of each entry of a manifest, and writes the
+  reports of each into the aggregate table as it finishes.
+
+  A run that fails is reported and its row records the failure, so that
+  it doesn't abort the rest of the batch.
+
+  Parameters
+  ----------
+  entries : list of dict
+    Runs, as from read_manifest
+  outfile : str
+    HDF5 file of the aggregate table
+  key : str, optional
+    Key of the aggregate table (default 'table')
+  workers : int, optional
+    Number of runs at a time, each in its own process. If None, use one
+    per CPU.
+  stream : bool, optional
+    Compute each run's sdiffs while its filter runs (see runner.run)
+  full : bool, optional
+    Compute runner.full_reports, rather than runner.reports
+  timeout : float, optional
+    Seconds a run may take before it's killed (default no limit)
+  max_bytes : int, optional
+    Cap on the memory of each worker (default no cap)
+  retries : int, optional
+    Times to rerun a run that crashed or timed out (default 1)
+  checkpoint_dir : str, optional
+    Directory to checkpoint runs to (see checkpoint_path), so that they
+    resume where they were interrupted (default no checkpoints)
+
+  Returns
+  -------
+  list of (str, RunFailure)
+    The row and failure of each failed run
+
+  """
+  if checkpoint_dir is not None and not os.path.isdir(checkpoint_dir):
+    os.makedirs(checkpoint_dir)
+  jobs = [(entry, stream, full,
+           None if checkpoint_dir is None
+           else checkpoint_path(checkpoint_dir, entry['row']))
+          for entry in entries]
+  failures = []
+  out_store = pd.HDFStore(outfile)
+  # Each process runs one filter at a time, so there's no point in more
+  # processes than runs.
+  pool = WorkerPool(min(workers or multiprocessing.cpu_count(), len(jobs)),
+                    timeout=timeout, max_bytes=max_bytes, retries=retries)
+  try:
+    results = pool.imap_unordered(_run_job, jobs)
+    for n, (i, result, failure) in enumerate(results, 1):
+      row = entries[i]['row']
+      if failure is None:
+        reports, elapsed = result
+        print "[%d/%d] Ran %s in %.1f sec." % (n, len(jobs), row, elapsed)
+        append_row(out_store, key, row, reports)
+      else:
+        print "[%d/%d] Failed to run %s (%s, %d attempts):" \
+          % (n, len(jobs), row, failure.kind, failure.attempts)
+        print failure.detail
+        warnings.warn("Failed to run %s." % row)
+        append_row(out_store, key, row, failure.as_dict())
+        failures.append((row, failure))
+      out_store.flush()
+  finally:
+    pool.close()
+    out_store.close()
+  return failures
+
+
+def main():
+  import argparse
+  parser = argparse.ArgumentParser(
+    description='RTK Filter SITL tests over many datasets.')
+  parser.add_argument('manifest',
+                      help='CSV manifest of the runs (file,x,y,z[,ned][,row]).')
+  parser.add_argument('outfile', help='Specify the HDF5 file to output into.')
+  parser.add_argument('-k', '--key', default='table',
+                      help='The key for the output table to insert into.')
+  parser.add_argument('-w', '--workers', type=int, default=None,
+                      help='Number of runs at a time (default one per CPU).')
+  parser.add_argument('--stream', action='store_true',
+                      help='Compute sdiffs while the filter runs.')
+  parser.add_argument('--full', action='store_true',
+                      help='Compute every report, including the IAR and '
+                      'baseline reports that can crash libswiftnav.')
+  parser.add_argument('--timeout', type=float, default=None,
+                      help='Seconds a run may take before it is killed.')
+  parser.add_argument('--max_memory', type=int, default=None,
+                      help='Cap on the memory of each worker, in MB.')
+  parser.add_argument('--retries', type=int, default=1,
+                      help='Times to rerun a run that crashed or timed out.')
+  parser.add_argument('--checkpoint_dir', default=None,
+                      help='Directory to checkpoint runs to, so that they '
+                      'resume where they were interrupted.')
+  args = parser.parse_args()
+  max_bytes = None if args.max_memory is None else args.max_memory << 20
+  failures = batch_run(read_manifest(args.manifest), args.outfile,
+                       key=args.key, workers=args.workers, stream=args.stream,
+                       full=args.full, timeout=args.timeout,
+                       max_bytes=max_bytes, retries=args.retries,
+                       checkpoint_dir=args.checkpoint_dir)
+  if failures:
+    print "%d runs failed." % len(failures)
+
+if __name__ == "__main__":
+  main()
@@ -44,6 +44,19 @@ dgnss_filter_state = FILTER_FLOAT
 # RTK SHIT
 MIN_SATS = 4
 
+# DGNSS filter settings (libswiftnav's dgnss_settings_t), in the order
+# dgnss_set_settings takes them, and their libswiftnav defaults.
+DGNSS_SETTINGS = ['phase_var_test', 'code_var_test', 'phase_var_kf',
+                  'code_var_kf', 'amb_drift_var', 'amb_init_var',
+                  'new_int_var']
+DGNSS_SETTINGS_DEFAULTS = {'phase_var_test': 9e-4 * 16,
+                           'code_var_test': 100 * 400,
+                           'phase_var_kf': 9e-4 * 16,
+                           'code_var_kf': 100 * 400,
+                           'amb_drift_var': 1e-8,
+                           'amb_init_var': 1e8,
+                           'new_int_var': 1e10}
+
 # Use Ephemeris from the last four hours
 EPHEMERIS_TOL = 3600 * 4
 
@@ -9,8 +9,21 @@
 # EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
 # WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
 
+from gnss_analysis.constants import GPS_C
+from gnss_analysis.derived_cache import DEFAULT_MAX_BYTES, DerivedCache, \
+  cache_key, code_version, table_hash
+from gnss_analysis.ephemeris_index import EphemerisIndex
+from gnss_analysis.obs_cube import ObsCube, as_cube, read_cube, write_cube
+from gnss_analysis.sat_state import calc_sat_states, gps_times
+from gnss_analysis.spp import DOP_NAMES, solve_spp
+from gnss_analysis.table_io import read_table
+from collections import deque
+from itertools import islice
+import gnss_analysis.constants as constants
+import gnss_analysis.spp as spp
 import pandas as pd
 import numpy as np
+import sys
 from pynex.dd_tools import sds_with_lock_counts
 from swiftnav.ephemeris import *
 from swiftnav.single_diff import SingleDiff
@@ -19,6 +32,10 @@ from swiftnav.pvt import calc_PVT
 from swiftnav.track import NavigationMeasurement
 
 
+# Number of epochs iter_sdiffs_and_pos computes at a time.
+DEFAULT_STREAM_WINDOW = 600
+
+
 def get_fst_ephs(ephs):
   """Get a DataFrame containing the first non-NaN ephemerises for each
   sat.
@@ -37,15 +54,20 @@ def get_fst_ephs(ephs):
 
   """
   #TODO respect invalid/unhealthy ephemerises
-  sats_to_be_found = set(ephs.minor_axis)
-  fst_ephs = dict()
-  for t in ephs.items:
-    df = ephs.ix[t]
-    for sat in sats_to_be_found:
-      col = df[sat]
-      if not np.isnan(col['af0']):
-        fst_ephs[sat] = col
-  return pd.DataFrame(fst_ephs)
+  valid = _valid_ephs(ephs)
+  fst = valid.argmax(axis=0)
+  return pd.DataFrame(dict((sat, ephs.ix[ephs.items[fst[s]], :, sat])
+                           for s, sat in enumerate(ephs.minor_axis)
+                           if valid[:, s].any()))
+
+
+def _valid_ephs(ephs):
+  """Returns a boolean array of shape (len(ephs.items),
+  len(ephs.minor_axis)), which is True where af0 is not NaN.
+
+  """
+  af0 = list(ephs.major_axis).index('af0')
+  return ~np.isnan(ephs.values[:, af0, :].astype(np.float64))
 
 
 def fill_in_ephs(ephs, fst_ephs):
@@ -67,17 +89,18 @@ def fill_in_ephs(ephs, fst_ephs):
 
   """
   #TODO respect invalid/unhealthy ephemerises
-  new_ephs = ephs
-  prev_eph = fst_ephs
-  for itm in ephs.iteritems():
-    t = itm[0]
-    df = itm[1]
-    for sat in df.axes[1]:
-      if np.isnan(df[sat]['af0']):
-        df[sat] = prev_eph[sat]
-    prev_eph = df
-    new_ephs[t] = df
-  return new_ephs
+  valid = _valid_ephs(ephs)
+  # Forward fill the row of the latest ephemeris of each sat.
+  rows = np.where(valid, np.arange(len(ephs.items))[:, None], -1)
+  rows = np.maximum.accumulate(rows, axis=0)
+  values = ephs.values.copy()
+  for s, sat in enumerate(ephs.minor_axis):
+    filled = rows[:, s] >= 0
+    values[filled, :, s] = values[rows[filled, s], :, s]
+    if sat in fst_ephs:
+      values[~filled, :, s] = fst_ephs[sat].reindex(ephs.major_axis).values
+  return pd.Panel(values, items=ephs.items, major_axis=ephs.major_axis,
+                  minor_axis=ephs.minor_axis)
 
 
 def get_timed_ephs(filled_ephs, t):
@@ -96,11 +119,40 @@ def get_timed_ephs(filled_ephs, t):
     The most last ephemerises before t in filled_ephs.
 
   """
-  ephs_before = filled_ephs[filled_ephs.items < t]
-  if len(ephs_before.items) > 0:
-    return ephs_before.ix[-1]
-  else:
-    return filled_ephs.ix[0]
+  i = filled_ephs.items.searchsorted(t, side='left') - 1
+  return filled_ephs.ix[max(i, 0)]
+
+
+def calc_timed_sat_states(eph_index, times, sats):
+  """Computes the states of satellites at each of a sequence of times,
+  from the most recent ephemeris before each time.
+
+  Parameters
+  ----------
+  eph_index : EphemerisIndex
+    The ephemerises to compute sat pos/vel from
+  times : sequence of datetime
+    The times to compute states at
+  sats : list
+    The satellites to compute states of
+
+  Returns
+  -------
+  array
+    Satellite positions, of shape (len(times), len(sats), 3)
+  array
+    Satellite velocities, of shape (len(times), len(sats), 3)
+  array
+    Satellite clock errors, of shape (len(times), len(sats))
+
+    The states of satellites without an ephemeris within EPHEMERIS_TOL of a
+    time are NaN.
+
+  """
+  eph = eph_index.ephs_at(times, sats)
+  wn, tow = gps_times(times)
+  pos, vel, clock_err, _ = calc_sat_states(eph, wn[:, None], tow[:, None])
+  return pos, vel, clock_err
 
 
 def construct_pyobj_eph(eph):
@@ -186,7 +238,7 @@ def mk_sdiff_series(sat_pos, sat_vel, sd_obs, prn):
                           'snr', 'prn'])
 
 
-def mk_sdiffs_and_abs_pos(ephs, rover_obs, base_obs):
+def mk_sdiffs_and_abs_pos(ephs, rover_obs, base_obs, vectorized=True):
   """Computes everything needed for a timeseries of sdiff_t, dropping
   sats as appropriate (e.g. lock counts), as well as absolute
   positions
@@ -195,31 +247,327 @@ def mk_sdiffs_and_abs_pos(ephs, rover_obs, base_obs):
   ----------
   ephs : Panel
     The ephemerises to compute sat pos/vel from
-  rover_obs : Panel
+  rover_obs : ObsCube or Panel
     The rover receiver's observations
-  base_obs : Panel
+  base_obs : ObsCube or Panel
     The base receiver's observations
+  vectorized : bool, optional
+    Compute all satellite states at once with calc_timed_sat_states,
+    screen sdiffs over the whole epoch x satellite grid with
+    screen_sdiffs, and solve for all single point positions at once with
+    spp_frame, rather than going epoch by epoch and satellite by
+    satellite. (default True)
 
   Returns
   -------
-  Panel
+  ObsCube
     All the fields needed to construct sdiff_t's.
   DataFrame
-    The rover receiver's single point position.
+    The rover receiver's single point position. When vectorized, it also
+    has the by-products of spp_frame (clock bias, DOPs and residuals).
   DataFrame
-    The base receiver's single point position.
+    The base receiver's single point position, as for the rover.
 
   """
   ephs = ephs.ix[:, [el for el in ephs.major_axis if el != 'payload'], :]
-  obs = sds_with_lock_counts(rover_obs, base_obs)
-  j = obs.transpose(1, 0, 2).join(
-      rover_obs.transpose(1, 0, 2), rsuffix='_rover_obs').join(
-      base_obs.transpose(1, 0, 2), rsuffix='_base_obs').transpose(1, 0, 2)
+  rover_obs = as_cube(rover_obs)
+  base_obs = as_cube(base_obs)
+  if vectorized:
+    return _mk_sdiffs_and_abs_pos(EphemerisIndex(ephs), rover_obs, base_obs)
   fst_ephs = get_fst_ephs(ephs)
   ephs = fill_in_ephs(ephs, fst_ephs)
-  j = j.ix[:, :, [sat for sat in fst_ephs.axes[1]]]
-  if not set(j.minor_axis).issubset(set(fst_ephs.axes[1])):
+  j = _join_obs(rover_obs, base_obs, list(fst_ephs.axes[1]))
+  return _mk_sdiffs_and_abs_pos_loop(ephs, j.to_panel())
+
+
+def _join_obs(rover_obs, base_obs, eph_sats):
+  """Returns an ObsCube of the single differenced observations and lock
+  counts, and the rover's and base's own observations (with the suffixes
+  '_rover_obs' and '_base_obs'), of the sats with ephemerises.
+
+  """
+  # sds_with_lock_counts works on Panels.
+  obs = as_cube(sds_with_lock_counts(rover_obs.to_panel(),
+                                     base_obs.to_panel()))
+  j = obs.join(rover_obs, '_rover_obs').join(base_obs, '_base_obs')
+  j = j.reindex(sats=eph_sats)
+  if not set(j.sats).issubset(set(eph_sats)):
     raise Exception("Not all sats with observations have ephemerises.")
+  return j
+
+
+def _mk_sdiffs_and_abs_pos(eph_index, rover_obs, base_obs):
+  """The vectorized implementation of mk_sdiffs_and_abs_pos.
+
+  """
+  j = _join_obs(rover_obs, base_obs, eph_index.sats)
+  times = j.epochs
+  sats = list(j.sats)
+  sat_pos, sat_vel, clock_err = calc_timed_sat_states(eph_index, times, sats)
+  grid = j.field
+  accept, dop_loc, dop_rem = screen_sdiffs(times,
+                                           grid('lock1'), grid('lock2'),
+                                           grid('L_rover_obs'),
+                                           grid('L_base_obs'),
+                                           ~np.isnan(clock_err))
+  sdiffs = mk_sdiffs_cube(times, sats, grid('P'), grid('L'), grid('cn0'),
+                           sat_pos, sat_vel, accept)
+  ecef_loc = spp_frame(times, grid('P_rover_obs') + clock_err * GPS_C,
+                       sat_pos, ~np.isnan(dop_loc))
+  ecef_rem = spp_frame(times, grid('P_base_obs') + clock_err * GPS_C,
+                       sat_pos, ~np.isnan(dop_rem))
+  return sdiffs, ecef_loc, ecef_rem
+
+
+def iter_sdiffs_and_pos(ephs, rover_obs, base_obs,
+                        window=DEFAULT_STREAM_WINDOW):
+  """Computes the same sdiffs and single point positions as
+  mk_sdiffs_and_abs_pos, a window of epochs at a time, and yields them
+  epoch by epoch.
+
+  Each window is computed along with the last epoch computed before it,
+  so that lock count changes and carrier phase Dopplers across windows
+  are the same as if all epochs had been computed at once.
+
+  Parameters
+  ----------
+  ephs : Panel
+    The ephemerises to compute sat pos/vel from
+  rover_obs : ObsCube or Panel
+    The rover receiver's observations
+  base_obs : ObsCube or Panel
+    The base receiver's observations
+  window : int, optional
+    Number of epochs to compute at a time (default DEFAULT_STREAM_WINDOW)
+
+  Yields
+  ------
+  datetime
+    The time of the epoch
+  DataFrame
+    The fields needed to construct the epoch's sdiff_t's (the epoch's
+    frame of the ObsCube of mk_sdiffs_and_abs_pos), for its accepted sats
+  Series
+    The rover receiver's single point position (a row of the rover's
+    DataFrame of mk_sdiffs_and_abs_pos)
+  Series
+    The base receiver's single point position
+
+  """
+  ephs = ephs.ix[:, [el for el in ephs.major_axis if el != 'payload'], :]
+  eph_index = EphemerisIndex(ephs)
+  rover_obs = as_cube(rover_obs)
+  base_obs = as_cube(base_obs)
+  times = rover_obs.epochs.union(base_obs.epochs)
+  prev_t = None
+  for start in range(0, len(times), window):
+    first = times[start] if prev_t is None else prev_t
+    last = times[min(start + window, len(times)) - 1]
+    sdiffs, ecef_loc, ecef_rem = \
+      _mk_sdiffs_and_abs_pos(eph_index,
+                             rover_obs.between(first, last),
+                             base_obs.between(first, last))
+    for t, df in sdiffs.iteritems():
+      if prev_t is not None and t <= prev_t:
+        continue
+      yield t, df.dropna(axis=1, how='all'), ecef_loc.ix[t], ecef_rem.ix[t]
+    if len(sdiffs) > 0:
+      prev_t = sdiffs.epochs[-1]
+
+
+class SdiffStream(object):
+  """An iterator over the epochs of iter_sdiffs_and_pos, which can be
+  consumed by SITL in place of an ObsCube of sdiffs.
+
+  Parameters
+  ----------
+  ephs : Panel
+    The ephemerises to compute sat pos/vel from
+  rover_obs : ObsCube or Panel
+    The rover receiver's observations
+  base_obs : ObsCube or Panel
+    The base receiver's observations
+  window : int, optional
+    Number of epochs to compute at a time (default DEFAULT_STREAM_WINDOW)
+
+  """
+
+  def __init__(self, ephs, rover_obs, base_obs, window=DEFAULT_STREAM_WINDOW):
+    self.window = window
+    self._epochs = iter_sdiffs_and_pos(ephs, rover_obs, base_obs, window)
+    self._buffer = deque()
+
+  def __iter__(self):
+    return self
+
+  def next(self):
+    """Returns the next (t, sdiffs, rover position, base position).
+
+    """
+    if self._buffer:
+      return self._buffer.popleft()
+    return next(self._epochs)
+
+  def peek(self, n):
+    """Returns up to the next n epochs, without consuming them.
+
+    """
+    for epoch in islice(self._epochs, max(n - len(self._buffer), 0)):
+      self._buffer.append(epoch)
+    return list(islice(self._buffer, n))
+
+  def positions(self, n):
+    """Returns the rover's and base's single point positions over up to
+    the next n epochs, as DataFrames, without consuming them.
+
+    """
+    epochs = self.peek(n)
+    index = [t for t, _, _, _ in epochs]
+    return (pd.DataFrame([loc for _, _, loc, _ in epochs], index=index),
+            pd.DataFrame([rem for _, _, _, rem in epochs], index=index))
+
+  def iteritems(self):
+    """Yields (t, sdiffs) for each remaining epoch, like
+    ObsCube.iteritems.
+
+    """
+    for t, df, _, _ in self:
+      yield t, df
+
+
+def spp_frame(times, pseudoranges, sat_pos, mask):
+  """Solves for the single point positions of a receiver at all epochs
+  at once with solve_spp.
+
+  Parameters
+  ----------
+  times : sequence of datetime
+    Epochs
+  pseudoranges : array
+    Satellite clock corrected pseudoranges, of shape
+    (len(times), number of sats)
+  sat_pos : array
+    Satellite positions, of shape (len(times), number of sats, 3)
+  mask : array
+    Which measurements to use, of the same shape as pseudoranges
+
+  Returns
+  -------
+  DataFrame
+    Indexed by time, with the position ('x', 'y', 'z'), the clock bias
+    ('clock_bias', m), the DOPs (see DOP_NAMES), the number of
+    measurements used ('n_used') and their RMS pseudorange residual
+    ('residual_rms', m). Epochs without a solution are NaN.
+
+  """
+  pos, clock_bias, dops, residuals = solve_spp(pseudoranges, sat_pos, mask)
+  n_used = (~np.isnan(residuals)).sum(axis=1)
+  with np.errstate(invalid='ignore'):
+    rms = np.sqrt(np.nansum(residuals ** 2, axis=1) / n_used)
+  cols = ['x', 'y', 'z', 'clock_bias'] + DOP_NAMES + ['n_used',
+                                                       'residual_rms']
+  values = np.column_stack([pos, clock_bias]
+                           + [dops[d] for d in DOP_NAMES] + [n_used, rms])
+  return pd.DataFrame(values, index=times, columns=cols)
+
+
+def screen_sdiffs(times, lock1, lock2, carr_loc, carr_rem, has_eph):
+  """Screens single differences for lock count changes, and derives
+  carrier phase Dopplers, over an epoch x satellite grid.
+
+  A sat's sdiff is accepted at an epoch if both lock counts are known and
+  neither has changed since the previous epoch (if it had one there). A
+  sat's Doppler at an epoch is its carrier phase difference from the
+  previous epoch over the time between them. Sats without a usable
+  ephemeris are neither accepted nor given Dopplers.
+
+  Parameters
+  ----------
+  times : sequence of datetime
+    Epochs
+  lock1, lock2 : array
+    Rover and base lock counts, of shape (len(times), number of sats)
+  carr_loc, carr_rem : array
+    Rover and base carrier phases, of the same shape
+  has_eph : array
+    Whether each sat has a usable ephemeris, of the same shape
+
+  Returns
+  -------
+  array
+    Boolean acceptance mask
+  array
+    Rover carrier phase Dopplers, NaN where unknown
+  array
+    Base carrier phase Dopplers, NaN where unknown
+
+  """
+  prev = lambda a: np.concatenate([np.full((1,) + a.shape[1:], np.nan),
+                                   a])[:len(a)]
+  with np.errstate(invalid='ignore'):
+    prev_lock1, prev_lock2 = prev(lock1), prev(lock2)
+    has_info = ~(np.isnan(lock1) | np.isnan(lock2))
+    lock1_good = np.isnan(prev_lock1) | (lock1 == prev_lock1)
+    lock2_good = np.isnan(prev_lock2) | (lock2 == prev_lock2)
+    accept = has_eph & has_info & lock1_good & lock2_good
+  # Seconds since the previous epoch, NaN for the first.
+  secs = pd.DatetimeIndex(list(times)).values.astype('datetime64[ns]')
+  secs = secs.astype(np.int64) / 1e9
+  dt = (secs - prev(secs))[:, None]
+  dop = lambda carr: np.where(has_eph, (carr - prev(carr)) / dt, np.nan)
+  return accept, dop(carr_loc), dop(carr_rem)
+
+
+SDIFF_FIELDS = ['P', 'L', 'D1',
+                'sat_pos_x', 'sat_pos_y', 'sat_pos_z',
+                'sat_vel_x', 'sat_vel_y', 'sat_vel_z',
+                'snr', 'prn']
+
+
+def mk_sdiffs_cube(times, sats, P, L, cn0, sat_pos, sat_vel, accept):
+  """Makes the ObsCube of fields needed for sdiff_t's (see
+  mk_sdiff_series) from epoch x satellite grids.
+
+  Parameters
+  ----------
+  times : sequence of datetime
+    Epochs
+  sats : list
+    Satellites
+  P, L, cn0 : array
+    Single differenced pseudoranges, carrier phases and signal strengths,
+    of shape (len(times), len(sats))
+  sat_pos, sat_vel : array
+    Satellite positions and velocities, of shape (len(times), len(sats), 3)
+  accept : array
+    Which sdiffs to keep, of shape (len(times), len(sats))
+
+  Returns
+  -------
+  ObsCube
+    With fields SDIFF_FIELDS, for the sats with at least one accepted
+    sdiff. Sdiffs which aren't accepted, and Doppler, are NaN.
+
+  """
+  kept = accept.any(axis=0)
+  cube = ObsCube.empty(times, [sat for sat, k in zip(sats, kept) if k],
+                       SDIFF_FIELDS)
+  data = cube.data
+  data[0] = P[:, kept]
+  data[1] = L[:, kept]
+  data[3:6] = sat_pos[:, kept].transpose(2, 0, 1)
+  data[6:9] = sat_vel[:, kept].transpose(2, 0, 1)
+  data[9] = cn0[:, kept]
+  data[10] = np.asarray(sats, dtype=np.float64)[kept]
+  data[:, ~accept[:, kept]] = np.nan
+  return cube
+
+
+def _mk_sdiffs_and_abs_pos_loop(ephs, j):
+  """The per-epoch, per-sat implementation of mk_sdiffs_and_abs_pos,
+  calling libswiftnav for each satellite state, for reference.
+
+  """
   prev_lock1s = dict()
   prev_lock2s = dict()
   prev_carr_loc = dict()
@@ -293,7 +641,8 @@ def mk_sdiffs_and_abs_pos(ephs, rover_obs, base_obs):
                                          dops_rem, sat_poss, sat_vels, t),
                             index=['x', 'y', 'z'])
 
-  return pd.Panel(sdiffs), pd.DataFrame(ecef_loc).T, pd.DataFrame(ecef_rem).T
+  return ObsCube.from_panel(pd.Panel(sdiffs), SDIFF_FIELDS), \
+    pd.DataFrame(ecef_loc).T, pd.DataFrame(ecef_rem).T
 
 
 def compute_ecef(pseudoranges, dops, sat_poss, sat_vels, t):
@@ -338,7 +687,91 @@ def compute_ecef(pseudoranges, dops, sat_poss, sat_vels, t):
   return calc_PVT(nms).pos_ecef
 
 
-# Overwrite will overwrite if sdiffs are not in the table anyway
+def _sdiffs_and_pos_inputs(s, key_eph, key_rover, key_base,
+                           key_base_integrity, key_rover_integrity):
+  """Reads the ephemerides and the complete observations of the rover and
+  base from a store.
+
+  """
+  bi = read_table(s, key_base_integrity)
+  base_obs_good = bi.ix['counts']+1 == np.left_shift(1, bi.ix['total'])
+  ri = read_table(s, key_rover_integrity)
+  rover_obs_good = ri.ix['counts']+1 == np.left_shift(1, ri.ix['total'])
+  return (read_table(s, key_eph),
+          read_cube(s, key_rover).select_epochs(rover_obs_good),
+          read_cube(s, key_base).select_epochs(base_obs_good))
+
+
+def sdiffs_code_version():
+  """Returns a hash of the source of the code that computes sdiffs and
+  single point positions.
+
+  """
+  # The constants and ObsCube modules have no functions to look up, but
+  # change the results just as much.
+  return code_version([sys.modules[f.__module__]
+                       for f in [mk_sdiffs_and_abs_pos, sds_with_lock_counts,
+                                 EphemerisIndex, calc_sat_states, solve_spp,
+                                 ObsCube]]
+                      + [constants])
+
+
+def sdiffs_parameters():
+  """Returns the current values of the thresholds the sdiffs and single
+  point positions depend on, as (name, value) pairs.
+
+  """
+  return (('EPHEMERIS_TOL', constants.EPHEMERIS_TOL),
+          ('MIN_SATS', constants.MIN_SATS),
+          ('GPS_C', constants.GPS_C),
+          ('SPP_MAX_ITERS', spp.SPP_MAX_ITERS),
+          ('SPP_TOL', spp.SPP_TOL))
+
+
+def sdiffs_cache_key(inputs, keys, names):
+  """Returns the DerivedCache key of the sdiffs and single point
+  positions computed from input tables read from the store's keys, and
+  stored as names: a hash of the code computing them, its thresholds
+  (see sdiffs_parameters), the keys and names, and the tables' contents.
+
+  """
+  return cache_key('sdiffs_and_pos', sdiffs_code_version(),
+                   sdiffs_parameters(), tuple(keys), tuple(names),
+                   tuple(table_hash(t) for t in inputs))
+
+
+def stream_sdiffs_and_pos(data_filename,
+                          window=DEFAULT_STREAM_WINDOW,
+                          key_eph='ephemerides',
+                          key_rover='rover_obs',
+                          key_base='base_obs',
+                          key_base_integrity='base_obs_integrity',
+                          key_rover_integrity='rover_obs_integrity'):
+  """
+  Streams the sdiffs and single point positions derived from an HDF5
+  file, computing them a window of epochs at a time, rather than loading
+  them all at once like load_sdiffs_and_pos.
+
+  Parameters
+  ----------
+  data_filename : str
+    The filename of the HDF5 store with all the data.
+  window : int, optional
+    Number of epochs to compute at a time (default DEFAULT_STREAM_WINDOW)
+
+  The store's keys are as for load_sdiffs_and_pos.
+
+  Returns
+  -------
+  SdiffStream
+    The epochs of sdiffs and single point positions.
+  """
+  with pd.HDFStore(data_filename, mode='r') as s:
+    inputs = _sdiffs_and_pos_inputs(s, key_eph, key_rover, key_base,
+                                    key_base_integrity, key_rover_integrity)
+  return SdiffStream(*inputs, window=window)
+
+
 def load_sdiffs_and_pos(data_filename,
                         key_eph='ephemerides',
                         key_rover='rover_obs',
@@ -348,11 +781,21 @@ def load_sdiffs_and_pos(data_filename,
                         key_rover_integrity='rover_obs_integrity',
                         key_base_ecef='base_spp',
                         key_sdiff='sdiffs',
-                        overwrite=False):
+                        overwrite=False,
+                        cache_dir=None,
+                        max_cache_bytes=DEFAULT_MAX_BYTES):
   """
-  Loads sdiffs and single point positions from an HDF5 file,
+  Loads sdiffs and single point positions derived from an HDF5 file,
   computing them if needed.
 
+  By default, they're kept in the data file itself, and only recomputed
+  if missing or if overwrite. With a cache_dir (such as
+  DEFAULT_CACHE_DIR), they're kept in a DerivedCache there instead, under
+  a key of the hashes of the input tables, the code computing them, its
+  thresholds and the store's keys (see sdiffs_cache_key), so that they're
+  only recomputed when any of those change, and the data file is only
+  read.
+
   Parameters
   ----------
   data_filename : str
@@ -372,31 +815,44 @@ def load_sdiffs_and_pos(data_filename,
   overwrite : bool, optional
     Whether to ignore existing sdiffs in key_sdiff and write new ones
     regardless. (default False)
+  cache_dir : str, optional
+    Directory of the cache, or None to store the results in the data
+    file. (default None)
+  max_cache_bytes : int, optional
+    Size bound of the cache. (default DEFAULT_MAX_BYTES)
 
   Returns
   -------
-  Panel
-    A Panel with everything needed to compute sdiff_t.
+  ObsCube
+    Everything needed to compute sdiff_t.
   DataFrame
-    A timeseries of the single point positions of the rover receiver.
+    A timeseries of the single point positions of the rover receiver,
+    with the DOPs and residuals of spp_frame if computed here.
   DataFrame
-    A timeseries of the single point positions of the base receiver.
+    A timeseries of the single point positions of the base receiver,
+    likewise.
   """
-  s = pd.HDFStore(data_filename)
-  if overwrite or not ('/' + key_sdiff) in s.keys() \
-               or not ('/' + key_rover_ecef) in s.keys() \
-               or not ('/' + key_base_ecef) in s.keys():
-    bi = s[key_base_integrity]
-    base_obs_good = bi.ix['counts']+1 == np.left_shift(1, bi.ix['total'])
-    ri = s[key_rover_integrity]
-    rover_obs_good = ri.ix['counts']+1 == np.left_shift(1, ri.ix['total'])
-    s[key_sdiff], s[key_rover_ecef], s[key_base_ecef] = \
-      mk_sdiffs_and_abs_pos(s[key_eph],
-                            s[key_rover].ix[rover_obs_good],
-                            s[key_base].ix[base_obs_good])
-    # If a DataFrame of SingleDiffs is desired, use .apply(construct_pyobj_sdiff, axis=1).T
-  sd = s[key_sdiff]
-  rover_ecef = s[key_rover_ecef]
-  base_ecef = s[key_base_ecef]
-  s.close()
-  return sd, rover_ecef, base_ecef
+  keys = (key_eph, key_rover, key_base, key_base_integrity,
+          key_rover_integrity)
+  names = [key_sdiff, key_rover_ecef, key_base_ecef]
+  if cache_dir is None:
+    s = pd.HDFStore(data_filename)
+    if overwrite or not all(('/' + name) in s.keys() for name in names):
+      sd, s[key_rover_ecef], s[key_base_ecef] = \
+        mk_sdiffs_and_abs_pos(*_sdiffs_and_pos_inputs(s, *keys))
+      write_cube(s, key_sdiff, sd)
+      # If a DataFrame of SingleDiffs is desired, use .apply(construct_pyobj_sdiff, axis=1).T
+    sd = read_cube(s, key_sdiff)
+    rover_ecef = s[key_rover_ecef]
+    base_ecef = s[key_base_ecef]
+    s.close()
+    return sd, rover_ecef, base_ecef
+  with pd.HDFStore(data_filename, mode='r') as s:
+    inputs = _sdiffs_and_pos_inputs(s, *keys)
+  cache = DerivedCache(cache_dir, max_cache_bytes)
+  key = sdiffs_cache_key(inputs, keys, names)
+  tables = None if overwrite else cache.get(key, names)
+  if tables is None:
+    tables = mk_sdiffs_and_abs_pos(*inputs)
+    cache.put(key, dict(zip(names, tables)))
+  return tuple(tables)
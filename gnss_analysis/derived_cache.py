@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Ian Horn <ian@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+"""Content addressed cache of tables derived from HDF5 logs.
+
+Each entry is an HDF5 file in the cache directory, named by the SHA-1 of
+everything it was derived from: the contents of the input tables, the
+source of the code that derived it, and its parameters. An entry is
+never updated, so it can't go stale; when any of its inputs change, the
+derived tables are looked up under a different key. Entries are touched
+when they're used, and the least recently used ones are deleted when the
+cache grows past its size bound.
+
+"""
+
+from gnss_analysis.obs_cube import ObsCube, read_cube, write_cube
+from gnss_analysis.table_io import LAYOUT_ATTR, PANEL_LAYOUT
+import hashlib
+import numpy as np
+import os
+import pandas as pd
+import tempfile
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.gnss_analysis',
+                                 'cache')
+DEFAULT_MAX_BYTES = 4 << 30
+
+ENTRY_EXT = '.hdf5'
+
+
+def _update_array(h, a):
+  a = np.asarray(a)
+  h.update(str(a.dtype) + str(a.shape))
+  if a.dtype == object:
+    h.update(repr(a.ravel().tolist()))
+  else:
+    h.update(np.ascontiguousarray(a).view(np.uint8))
+
+
+def table_hash(obj):
+  """Returns the hex SHA-1 of the labels and values of a Series,
+  DataFrame, Panel or ObsCube.
+
+  """
+  h = hashlib.sha1(type(obj).__name__)
+  for axis in obj.axes:
+    _update_array(h, axis.values)
+  _update_array(h, obj.values)
+  return h.hexdigest()
+
+
+def code_version(modules):
+  """Returns the hex SHA-1 of the source files of modules.
+
+  """
+  h = hashlib.sha1()
+  for module in modules:
+    filename = os.path.splitext(module.__file__)[0] + '.py'
+    h.update(module.__name__)
+    with open(filename, 'rb') as f:
+      h.update(f.read())
+  return h.hexdigest()
+
+
+def cache_key(*parts):
+  """Returns the cache key of an entry derived from parts (hashes,
+  versions and parameters, all of which must have stable reprs).
+
+  """
+  return hashlib.sha1(repr(parts)).hexdigest()
+
+
+def _read(store, name):
+  storer = store.get_storer(name)
+  if getattr(storer.attrs, LAYOUT_ATTR, None) == PANEL_LAYOUT:
+    return read_cube(store, name)
+  return store[name]
+
+
+class DerivedCache(object):
+  """A directory of derived tables, bounded in size.
+
+  Parameters
+  ----------
+  cache_dir : str, optional
+    Directory of the entries, created if needed.
+    (default DEFAULT_CACHE_DIR)
+  max_bytes : int, optional
+    Size above which least recently used entries are evicted.
+    (default DEFAULT_MAX_BYTES)
+
+  """
+
+  def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+    self.cache_dir = cache_dir
+    self.max_bytes = max_bytes
+    if not os.path.isdir(cache_dir):
+      os.makedirs(cache_dir)
+
+  def path(self, key):
+    return os.path.join(self.cache_dir, key + ENTRY_EXT)
+
+  def get(self, key, names):
+    """Returns the tables of an entry as a list in the order of names, or
+    None if there's no such entry.
+
+    """
+    path = self.path(key)
+    try:
+      # The modification time is the last use, for LRU eviction.
+      os.utime(path, None)
+    except OSError:
+      return None
+    with pd.HDFStore(path, mode='r') as store:
+      return [_read(store, name) for name in names]
+
+  def put(self, key, tables):
+    """Stores a dict of tables under key, replacing any existing entry,
+    then evicts entries if the cache is too large.
+
+    """
+    fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+    os.close(fd)
+    try:
+      with pd.HDFStore(tmp, mode='w') as store:
+        for name, table in tables.iteritems():
+          if isinstance(table, ObsCube):
+            write_cube(store, name, table)
+          else:
+            store[name] = table
+      os.rename(tmp, self.path(key))
+    except:
+      os.remove(tmp)
+      raise
+    self.evict(keep=key)
+
+  def entries(self):
+    """Returns (mtime, size, path) of each entry, least recently used
+    first.
+
+    """
+    entries = []
+    for name in os.listdir(self.cache_dir):
+      path = os.path.join(self.cache_dir, name)
+      if not name.endswith(ENTRY_EXT) or not os.path.isfile(path):
+        continue
+      st = os.stat(path)
+      entries.append((st.st_mtime, st.st_size, path))
+    return sorted(entries)
+
+  def size(self):
+    return sum(size for _, size, _ in self.entries())
+
+  def evict(self, keep=None):
+    """Deletes least recently used entries, other than keep, until the
+    cache is no larger than max_bytes.
+
+    """
+    entries = self.entries()
+    total = sum(size for _, size, _ in entries)
+    keep = None if keep is None else self.path(keep)
+    for _, size, path in entries:
+      if total <= self.max_bytes:
+        break
+      if path == keep:
+        continue
+      try:
+        os.remove(path)
+      except OSError:
+        # Already evicted by another process.
+        pass
+      total -= size
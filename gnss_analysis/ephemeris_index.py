@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Ian Horn <ian@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+"""Time-sorted index of the ephemerides of each satellite.
+
+An ephemerides Panel (items are times, major axis is fields and minor
+axis is satellites) holds NaNs wherever a satellite had no ephemeris
+at a time. EphemerisIndex keeps, for each satellite, just the times and
+fields of its ephemerides, so that the ephemeris in effect at any time
+is found by binary search. An ephemeris is only used within
+EPHEMERIS_TOL seconds of its reference time (toe).
+
+"""
+
+from gnss_analysis.constants import EPHEMERIS_TOL
+from gnss_analysis.sat_state import EPH_FIELDS, WEEK_SECS, gps_times
+import numpy as np
+import pandas as pd
+
+_AF0 = EPH_FIELDS.index('af0')
+_TOE_WN = EPH_FIELDS.index('toe_wn')
+_TOE_TOW = EPH_FIELDS.index('toe_tow')
+
+
+def _datetimes(times):
+  return pd.DatetimeIndex(list(times)).values
+
+
+class EphemerisIndex(object):
+  """Ephemerides of each satellite, sorted by time.
+
+  As with get_timed_ephs, the ephemeris in effect at time t is the last
+  one before t, or the first one if t is before all of them.
+
+  Parameters
+  ----------
+  ephs : Panel
+    Ephemerides, possibly with missing (NaN) ones
+  tol : float, optional
+    Seconds from its toe for which an ephemeris may be used
+    (default EPHEMERIS_TOL)
+
+  """
+
+  def __init__(self, ephs, tol=EPHEMERIS_TOL):
+    self.tol = tol
+    times = _datetimes(ephs.items)
+    order = np.argsort(times, kind='mergesort')
+    values = ephs.ix[:, EPH_FIELDS, :].values.astype(np.float64)[order]
+    times = times[order]
+    valid = ~np.isnan(values[:, _AF0, :])
+    self.sats = []
+    self.times = {}
+    self.ephs = {}
+    for s, sat in enumerate(ephs.minor_axis):
+      rows = np.flatnonzero(valid[:, s])
+      if len(rows) == 0:
+        continue
+      self.sats.append(sat)
+      self.times[sat] = times[rows]
+      self.ephs[sat] = values[rows, :, s]
+
+  def intervals(self, sat):
+    """Returns the validity interval of each ephemeris of a satellite, as
+    a DataFrame of GPS seconds ('start', 'end') indexed by its time. An
+    ephemeris is used from its time until the next one's, but never
+    outside of its toe +/- tol.
+
+    """
+    toe = self.ephs[sat][:, _TOE_WN] * WEEK_SECS + self.ephs[sat][:, _TOE_TOW]
+    wn, tow = gps_times(pd.DatetimeIndex(self.times[sat]).to_pydatetime())
+    start = np.maximum(wn * WEEK_SECS + tow, toe - self.tol)
+    start[0] = toe[0] - self.tol
+    end = np.minimum(np.append(start[1:], np.inf), toe + self.tol)
+    return pd.DataFrame({'start': start, 'end': end},
+                        index=pd.DatetimeIndex(self.times[sat]),
+                        columns=['start', 'end'])
+
+  def _rows(self, sat, times, gps_secs):
+    i = np.searchsorted(self.times[sat], times, side='left') - 1
+    i = np.maximum(i, 0)
+    ephs = self.ephs[sat][i]
+    toe = ephs[:, _TOE_WN] * WEEK_SECS + ephs[:, _TOE_TOW]
+    return ephs, np.abs(gps_secs - toe) <= self.tol
+
+  def lookup(self, t, sat):
+    """Returns the ephemeris fields (see EPH_FIELDS) of a satellite in
+    effect at time t as a Series, or None if it has no ephemeris within
+    tol of t.
+
+    """
+    if sat not in self.ephs:
+      return None
+    wn, tow = gps_times([t])
+    ephs, ok = self._rows(sat, _datetimes([t]), wn * WEEK_SECS + tow)
+    if not ok[0]:
+      return None
+    return pd.Series(ephs[0], index=EPH_FIELDS)
+
+  def ephs_at(self, times, sats):
+    """Returns the ephemerides of satellites in effect at each of a
+    sequence of times.
+
+    Parameters
+    ----------
+    times : sequence of datetime
+      Times to look up
+    sats : list
+      Satellites to look up
+
+    Returns
+    -------
+    dict
+      Arrays of shape (len(times), len(sats)) for each of EPH_FIELDS,
+      which are NaN where a satellite has no ephemeris within tol.
+
+    """
+    wn, tow = gps_times(times)
+    gps_secs = wn * WEEK_SECS + tow
+    times = _datetimes(times)
+    grid = np.empty((len(times), len(EPH_FIELDS), len(sats)))
+    grid.fill(np.nan)
+    for k, sat in enumerate(sats):
+      if sat not in self.ephs:
+        continue
+      ephs, ok = self._rows(sat, times, gps_secs)
+      grid[ok, :, k] = ephs[ok]
+    return dict((f, grid[:, i, :]) for i, f in enumerate(EPH_FIELDS))
@@ -15,17 +15,24 @@ have explicit GPS times.
 
 """
 
+from gnss_analysis.ingest_manifest import IngestManifest, source_entry
+from gnss_analysis.obs_cube import as_cube
 from gnss_analysis.stats_utils import truthify
+from gnss_analysis.table_io import read_table
 from gnss_analysis.tools.records2table import hdf5_write
 from pandas.tslib import Timestamp, Timedelta
 import datetime
 import fnmatch
 import gnss_analysis.locations as loc
+import itertools
 import matplotlib.pyplot as plt
+import multiprocessing
 import os
 import numpy as np
 import pandas as pd
 import sys
+import time
+import traceback
 import warnings
 
 USEC_TO_SEC = 1e-6
@@ -96,9 +103,10 @@ def get_gps_time_col(store, tabs, gpst_col='approx_gps_time', verbose=False):
     Verbose outoput
 
   """
-  idx = store.rover_spp.T.host_offset.reset_index()
+  rover_spp = read_table(store, 'rover_spp').T
+  idx = rover_spp.host_offset.reset_index()
   model = interpolate_gpst_model(idx)
-  init_date = store.rover_spp.T.index[0]
+  init_date = rover_spp.index[0]
   f = lambda t1: apply_gps_time(t1*MSEC_TO_SEC, init_date, model)
   for tab in tabs:
     # Because this is largely a research tool and the tables are
@@ -108,19 +116,21 @@ def get_gps_time_col(store, tabs, gpst_col='approx_gps_time', verbose=False):
       print "Interpolating approx_gps_time for %s." % tab
     if tab not in store:
       warnings.warn("%s not found in Pandas table" % tab, UserWarning)
-    if store[tab].empty:
+      continue
+    table = read_table(store, tab)
+    if table.empty:
       if verbose:
         print "%s is empty." % tab
       continue
-    elif isinstance(store[tab], pd.DataFrame):
-      dft = store[tab].T
-      dft[gpst_col] = store[tab].T.host_offset.apply(f)
+    elif isinstance(table, pd.DataFrame):
+      dft = table.T
+      dft[gpst_col] = table.T.host_offset.apply(f)
       store[tab] = dft.T
-    elif isinstance(store[tab], pd.Panel):
+    elif isinstance(table, pd.Panel):
       y = {}
-      for prn in store[tab].items:
-        y[prn] = store[tab][prn, 'host_offset', :].dropna().apply(f)
-      ans = store[tab].transpose(1, 0, 2)
+      for prn in table.items:
+        y[prn] = table[prn, 'host_offset', :].dropna().apply(f)
+      ans = table.transpose(1, 0, 2)
       ans['approx_gps_time'] = pd.DataFrame(y).T
       store[tab] = ans.transpose(1, 0, 2)
 
@@ -143,9 +153,11 @@ def reindex_tables(store, tabs, gpst_col='approx_gps_time', verbose=False):
       print "Reindexing with approx_gps_time for %s." % tab
     if tab not in store:
       warnings.warn("%s not found in Pandas table" % tab, UserWarning)
-    elif isinstance(store[tab], pd.DataFrame):
-      store[tab] = store[tab].T.set_index(gpst_col).T
-    elif isinstance(store[tab], pd.Panel):
+      continue
+    table = read_table(store, tab)
+    if isinstance(table, pd.DataFrame):
+      store[tab] = table.T.set_index(gpst_col).T
+    elif isinstance(table, pd.Panel):
       assert NotImplementedError
 
 #####################################################################
@@ -191,8 +203,8 @@ def get_sdiff(obs_type, rover_obs,  base_obs):
   Parameters
   ----------
   obs_type : observation key, either 'P' (pseudorange) or 'L' (carrier phase)
-  rover_obs : Panel of Rover observations
-  base_obs : Panel of Base observations
+  rover_obs : ObsCube or Panel of Rover observations
+  base_obs : ObsCube or Panel of Base observations
 
   Returns
   -------
@@ -200,8 +212,9 @@ def get_sdiff(obs_type, rover_obs,  base_obs):
 
   """
   assert obs_type in ['P', 'L'], "Invalid obs_type: %s" % obs_type
-  sdiff = rover_obs[:, obs_type, :] - base_obs[:, obs_type, :]
-  return sdiff.dropna(how='all', axis=[0, 1]).T
+  sdiff = as_cube(rover_obs).frame(obs_type) \
+          - as_cube(base_obs).frame(obs_type)
+  return sdiff.dropna(how='all').dropna(how='all', axis=1)
 
 
 def get_ref_sat(sdiff):
@@ -227,7 +240,7 @@ def get_observed_refsats(obs):
 
   Parameters
   ----------
-  obs : Pandas Panel of GPS observations.
+  obs : ObsCube or Pandas Panel of GPS observations.
 
   Returns
   -------
@@ -235,7 +248,7 @@ def get_observed_refsats(obs):
 
   """
   vals = {}
-  for sat, col in obs[:, 'P', :].T.diff().iteritems():
+  for sat, col in as_cube(obs).frame('P').diff().iteritems():
     c = col.dropna()[col.dropna() == 0]
     if not c.empty:
       vals[c.first_valid_index()] = sat
@@ -356,7 +369,7 @@ def mark_iar(t):
 
 
 def mark_obs_gaps(t, threshold=1.):
-  l = find_largest_gaps(t.rover_obs[:, 'cn0', :].T.index)
+  l = find_largest_gaps(as_cube(t.rover_obs).epochs)
   return l[l > threshold]
 
 
@@ -479,7 +492,7 @@ def mark_ephemeris_diffs(ephemerides):
 
 
 def mark_lock_cnt_diff(obs):
-  df = obs[:, 'lock', :].T.diff()
+  df = as_cube(obs).frame('lock').diff()
   s = np.sqrt(np.square(df).sum(axis=1))
   return s[s > 0]
 
@@ -618,8 +631,8 @@ class Plotter(object):
     """
     """
     # Define start and end of time series around GPS observation SNR
-    self.base_cn0 = self.hitl_log.base_obs[:, 'cn0', :].T/4.
-    self.rover_cn0 = self.hitl_log.rover_obs[:, 'cn0', :].T/4.
+    self.base_cn0 = as_cube(self.hitl_log.base_obs).frame('cn0')/4.
+    self.rover_cn0 = as_cube(self.hitl_log.rover_obs).frame('cn0')/4.
     self.index = self.rover_cn0.index
     self.i = self.index[0]
     self.j = self.index[-1]
@@ -782,30 +795,132 @@ STATIC_TEST_S3_BUCKET = 'jenkins-backups-yz0bhivofjsjaieaebquxp'
 # S3 bucket for satdrop test from roof antenna on Summer 2015.
 SATDROP_S3_BUCKET = 'jenkins-backups-hitl-dynamics-phodpebmybrivnvfvt'
 
+# Tables to decorate with interpolated GPS times after conversion.
+GPS_TIME_TABS = ['rover_iar_state', 'rover_logs', 'rover_tracking',
+                 'rover_acq', 'rover_thread_state', 'rover_uart_state',
+                 'rover_ephemerides', 'base_ephemerides']
+
+
+def convert_raw_log(json_filename, verbose=False):
+  """Converts a JSON log to HDF5 and interpolates GPS times for its
+  tables.
+
+  Parameters
+  ----------
+  json_filename : str
+    JSON log filename
+  verbose : bool
+    Verbose output
+
+  Returns
+  ----------
+  str, HDF5 output filename
+
+  """
+  nf = hdf5_write(json_filename, json_filename + '.hdf5', verbose)
+  with pd.HDFStore(nf) as store:
+    if not store.rover_spp.empty:
+      get_gps_time_col(store, GPS_TIME_TABS, verbose=verbose)
+      reindex_tables(store,
+                     ['rover_iar_state', 'rover_logs'],
+                     verbose=verbose)
+  return nf
+
+
+def _convert_raw_log_job(args):
+  """Process pool job for convert_raw_log. Returns (json_filename,
+  manifest entry, elapsed seconds, traceback), where the entry is None
+  and traceback is set if the conversion failed.
+
+  """
+  json_filename, verbose = args
+  start = time.time()
+  try:
+    entry = source_entry(json_filename, json_filename + '.hdf5')
+    convert_raw_log(json_filename, verbose)
+    return json_filename, entry, time.time() - start, None
+  except Exception:
+    return json_filename, None, time.time() - start, traceback.format_exc()
+
+
+def find_raw_logs(path):
+  """Finds serial*.json logs under path.
+
+  """
+  logs = []
+  for root, dirnames, filenames in os.walk(path):
+    for filename in fnmatch.filter(filenames, 'serial*.json'):
+      logs.append(root + "/" + filename)
+  return sorted(logs)
+
+
 def process_raw_log(date,
                     bucket_name=STATIC_TEST_S3_BUCKET,
                     local_dest=DEFAULT_SWIFT_TMP_DIR,
-                    verbose=False):
+                    verbose=False,
+                    workers=1,
+                    force=False):
+  """Converts every JSON log of a dated build to HDF5.
+
+  A log that fails to convert is reported and skipped, so that it doesn't
+  abort the rest of the batch. Converted logs are recorded in an
+  IngestManifest in the build directory, and logs that haven't changed
+  since they were last converted are skipped.
+
+  Parameters
+  ----------
+  date : str
+    Build date
+  workers : int, optional
+    Number of logs to convert in parallel, each in its own process.
+    Defaults to 1 (in this process). If None, use one per CPU.
+  force : bool, optional
+    Reconvert every log, whether or not it has changed.
+
+  Returns
+  ----------
+  list, sorted HDF5 filenames of the converted logs, including the ones
+  that were already up to date
+
+  """
   base_prefix = '/builds/'
   path = local_dest + bucket_name + base_prefix + "/" + date
+  logs = find_raw_logs(path)
+  manifest = IngestManifest(path)
   new_files = []
-  gps_time_tabs = ['rover_iar_state', 'rover_logs', 'rover_tracking',
-                   'rover_acq', 'rover_thread_state', 'rover_uart_state',
-                   'rover_ephemerides', 'base_ephemerides']
-  for root, dirnames, filenames in os.walk(path):
-    for filename in fnmatch.filter(filenames, 'serial*.json'):
-      if verbose:
-        print "Processing %s to hdf5" % filename
-      nf = hdf5_write(root + "/" + filename,
-                      root + "/" + filename + '.hdf5',
-                      verbose)
-      with pd.HDFStore(nf) as store:
-        if not store.rover_spp.empty:
-          get_gps_time_col(store, gps_time_tabs, verbose=verbose)
-          reindex_tables(store,
-                         ['rover_iar_state', 'rover_logs'],
-                         verbose=verbose)
-      new_files.append(nf)
+  jobs = []
+  for log in logs:
+    if not force and manifest.is_current(log):
+      new_files.append(manifest.output(log))
+    else:
+      jobs.append((log, verbose))
+  if verbose and new_files:
+    print "Skipping %d unchanged logs." % len(new_files)
+  if workers == 1 or len(jobs) <= 1:
+    pool = None
+    results = itertools.imap(_convert_raw_log_job, jobs)
+  else:
+    pool = multiprocessing.Pool(workers)
+    results = pool.imap_unordered(_convert_raw_log_job, jobs)
+  try:
+    for n, (log, entry, elapsed, error) in enumerate(results, 1):
+      if error is None:
+        print "[%d/%d] Processed %s to hdf5 in %.1f sec." \
+          % (n, len(jobs), log, elapsed)
+        manifest.record(log, entry)
+        new_files.append(entry['output'])
+      else:
+        print "[%d/%d] Failed to process %s:" % (n, len(jobs), log)
+        print error
+        warnings.warn("Failed to process %s to hdf5." % log)
+  finally:
+    if pool is not None:
+      pool.close()
+      pool.join()
+    # Also save the new mtimes of logs that were touched but unchanged, so
+    # they aren't hashed again next time.
+    if manifest.changed:
+      manifest.save()
   return sorted(new_files)
 
 
@@ -849,6 +964,7 @@ def find_date(date, path=DEFAULT_SWIFT_TMP_DIR):
   return sorted(new_files)
 
 
-def get(log_date, verbose=False):
+def get(log_date, verbose=False, workers=1, force=False):
   get_from_s3(log_date, verbose)
-  return process_raw_log(log_date, verbose)
+  return process_raw_log(log_date, verbose=verbose, workers=workers,
+                         force=force)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Bhaskar Mookerji <mookerji@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+"""Manifest of converted HITL logs, so that a batch conversion can skip
+logs whose HDF5 output is already up to date.
+
+The manifest is a JSON file kept in the directory it describes. For each
+source log (by path relative to that directory) it records the size,
+modification time and SHA-1 of the log when it was converted, the HDF5
+output, and the records2table INGEST_VERSION that wrote it. A log is
+reconverted if it's new, if its contents have changed, if its output is
+missing, or if the ingest version has changed since.
+
+"""
+
+from gnss_analysis.tools.records2table import INGEST_VERSION
+import hashlib
+import json
+import os
+
+MANIFEST_FILENAME = 'ingest_manifest.json'
+
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def file_hash(filename):
+  """Returns the hex SHA-1 of a file's contents.
+
+  """
+  h = hashlib.sha1()
+  with open(filename, 'rb') as f:
+    for block in iter(lambda: f.read(HASH_BLOCK_SIZE), ''):
+      h.update(block)
+  return h.hexdigest()
+
+
+def source_entry(source, output):
+  """Returns the manifest entry for a source log converted to output.
+
+  """
+  st = os.stat(source)
+  return {'size': st.st_size,
+          'mtime': st.st_mtime,
+          'sha1': file_hash(source),
+          'output': output,
+          'version': INGEST_VERSION}
+
+
+class IngestManifest(object):
+  """Manifest of the logs converted under a directory.
+
+  Parameters
+  ----------
+  path : str
+    Directory of the source logs. The manifest is stored in it as
+    MANIFEST_FILENAME.
+
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self.filename = os.path.join(path, MANIFEST_FILENAME)
+    self.entries = {}
+    # Whether the entries differ from the saved manifest.
+    self.changed = False
+    if os.path.isfile(self.filename):
+      with open(self.filename, 'r') as f:
+        self.entries = json.load(f)
+
+  def _key(self, source):
+    return os.path.relpath(source, self.path)
+
+  def output(self, source):
+    """Returns the HDF5 output recorded for source, if any.
+
+    """
+    return self.entries.get(self._key(source), {}).get('output')
+
+  def is_current(self, source):
+    """Returns whether source has been converted by this ingest version,
+    and hasn't changed since. Unchanged size and mtime are trusted
+    without hashing; otherwise, the contents are hashed, so that a log
+    that was only touched or copied isn't reconverted.
+
+    """
+    entry = self.entries.get(self._key(source))
+    if entry is None or entry.get('version') != INGEST_VERSION:
+      return False
+    if not os.path.isfile(entry.get('output') or ''):
+      return False
+    st = os.stat(source)
+    if st.st_size != entry['size']:
+      return False
+    if st.st_mtime == entry['mtime']:
+      return True
+    if file_hash(source) != entry['sha1']:
+      return False
+    entry['mtime'] = st.st_mtime
+    self.changed = True
+    return True
+
+  def record(self, source, entry):
+    """Records a source_entry for source.
+
+    """
+    self.entries[self._key(source)] = entry
+    self.changed = True
+
+  def save(self):
+    """Writes the manifest, replacing the previous one atomically.
+
+    """
+    tmp = self.filename + '.tmp'
+    with open(tmp, 'w') as f:
+      json.dump(self.entries, f, indent=2, sort_keys=True)
+    os.rename(tmp, self.filename)
+    self.changed = False
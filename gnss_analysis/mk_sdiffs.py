@@ -1,10 +1,20 @@
 
 
+import itertools
+import multiprocessing
 import pandas as pd
 import numpy as np
 from swiftnav.ephemeris import *
 from swiftnav.single_diff import SingleDiff
 from swiftnav.gpstime import *
+from gnss_analysis.sat_state import EPH_FIELDS, calc_sat_states, gps_times
+
+SDIFF_COLUMNS = ['C1', 'L1', 'D1', 'sat_pos_x', 'sat_pos_y', 'sat_pos_z',
+                 'sat_vel_x', 'sat_vel_y', 'sat_vel_z', 'min_snr', 'prn']
+
+# Ephemeris table columns of the calc_sat_states fields named differently.
+EPH_COLUMNS = {'c_rs': 'crs', 'c_rc': 'crc', 'c_uc': 'cuc', 'c_us': 'cus',
+               'c_ic': 'cic', 'c_is': 'cis'}
 
 def construct_pyobj_eph(eph):
     return Ephemeris(
@@ -33,14 +43,11 @@ def separate_ephs(ephs):
         sep_ephs[prn] = frame
     return sep_ephs
 
-def merge_into_sdiffs(ephs, sd):
+def merge_into_sdiffs_loop(ephs, sd):
     """
-    Taking ephemerides and observation data, this will merge them
-    together into a panel whose index is a sat, major axis is time,
-    and minor axis is everything needed for an sdiff struct.
-
-    It's super slow, so I left it all in pandas format, so we can
-    save it out in hdf5 and get it back all nicely processed.
+    The row by row implementation of merge_into_sdiffs, with a
+    libswiftnav Ephemeris and calc_sat_pos call per observation. It's
+    kept as the reference to check merge_into_sdiffs against.
     """
     sep_ephs = separate_ephs(ephs)
     sats = sd.items
@@ -76,6 +83,112 @@ def merge_into_sdiffs(ephs, sd):
     return pd.Panel(sdiff_dict)
 
 
+def separate_eph_arrays(ephs):
+    """
+    Return a dictionary of prn to (times, fields), where times are the
+    sorted times of the unique ephemerides of the sat, and fields is a
+    dictionary of calc_sat_states field (see EPH_FIELDS) to the array of
+    its values, in the same order.
+    """
+    ephs = ephs.drop_duplicates()
+    times = ephs.index.values
+    prns = ephs['prn'].values
+    sep_ephs = {}
+    for prn in ephs['prn'].unique():
+        rows = np.flatnonzero(prns == prn)
+        rows = rows[np.argsort(times[rows], kind='mergesort')]
+        fields = dict((f, ephs[EPH_COLUMNS.get(f, f)].values[rows].astype(np.float64))
+                      for f in EPH_FIELDS)
+        sep_ephs[int(prn)+1] = (times[rows], fields) #+1 as in separate_ephs
+    return sep_ephs
+
+def merge_sats(job):
+    """
+    Make the sdiff DataFrames of a group of sats, for merge_into_sdiffs.
+    job is (obs, sep_ephs, wn, tow): a dictionary of sat to its
+    observation DataFrame, all indexed by the same times, the
+    separate_eph_arrays of those sats, and the GPS weeks and times of
+    week of the observation times. The states of every observation of
+    every sat are computed in one calc_sat_states call.
+
+    Returns a list of (sat, DataFrame).
+    """
+    obs, sep_ephs, wn, tow = job
+    sats = sorted(obs)
+    oks, ephs = [], []
+    for sat in sats:
+        x = obs[sat]
+        ok = np.ones(len(x), dtype=bool)
+        for col in ['C1', 'L1', 'S1_1', 'S1_2']:
+            ok &= ~np.isnan(x[col].values.astype(np.float64))
+        eph_times, eph = sep_ephs[int(sat[1:])]
+        # The last ephemeris at or before each observation, or the first
+        # one if there's none.
+        i = np.searchsorted(eph_times, x.index.values[ok], side='right') - 1
+        i = np.maximum(i, 0)
+        oks.append(ok)
+        ephs.append(dict((f, v[i]) for f, v in eph.iteritems()))
+    if sats:
+        eph = dict((f, np.concatenate([e[f] for e in ephs])) for f in EPH_FIELDS)
+        ok = np.concatenate(oks)
+        pos, vel, _, _ = calc_sat_states(eph, np.tile(wn, len(sats))[ok],
+                                         np.tile(tow, len(sats))[ok])
+    sdiffs = []
+    start = 0
+    for sat, ok in zip(sats, oks):
+        x = obs[sat]
+        end = start + ok.sum()
+        df = pd.DataFrame(index=x.index[ok], columns=SDIFF_COLUMNS, dtype=np.float64)
+        df['C1'] = x['C1'].values[ok]
+        df['L1'] = x['L1'].values[ok]
+        df['min_snr'] = np.minimum(x['S1_1'].values[ok], x['S1_2'].values[ok])
+        for k, axis in enumerate('xyz'):
+            df['sat_pos_' + axis] = pos[start:end, k]
+            df['sat_vel_' + axis] = vel[start:end, k]
+        df['prn'] = float(int(sat[1:]))
+        sdiffs.append((sat, df))
+        start = end
+    return sdiffs
+
+def merge_into_sdiffs(ephs, sd, workers=1):
+    """
+    Taking ephemerides and observation data, this will merge them
+    together into a panel whose index is a sat, major axis is time,
+    and minor axis is everything needed for an sdiff struct.
+
+    Each observation is matched to its sat's last ephemeris at or before
+    it (an as-of join, by binary search), and the satellite states are
+    computed for all the observations at once. Sats are split into
+    groups processed in parallel by workers processes; if workers is
+    None, use one per CPU.
+
+    It's left in pandas format, so we can save it out in hdf5 and get it
+    back all nicely processed.
+    """
+    sep_ephs = separate_eph_arrays(ephs)
+    sats = list(sd.items)
+    wn, tow = gps_times(sd.major_axis)
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    groups = [sats[k::workers] for k in range(workers) if sats[k::workers]]
+    jobs = [(dict((sat, sd[sat]) for sat in group),
+             dict((int(sat[1:]), sep_ephs[int(sat[1:])]) for sat in group),
+             wn, tow)
+            for group in groups]
+    if len(jobs) <= 1:
+        pool = None
+        results = itertools.imap(merge_sats, jobs)
+    else:
+        pool = multiprocessing.Pool(len(jobs))
+        results = pool.imap(merge_sats, jobs)
+    try:
+        sdiff_dict = dict(itertools.chain.from_iterable(results))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return pd.Panel(sdiff_dict)
+
 def main():
     import sys
     import argparse
@@ -89,6 +202,9 @@ def main():
                         help="the marker name of the base station")
     parser.add_argument("rover_name", default=False,
                         help="the marker name of the rover")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="number of processes to split the sats among "
+                             "(0 for one per CPU)")
     args = parser.parse_args()
 
     eph_file = pd.HDFStore(args.ephemeris)
@@ -98,7 +214,8 @@ def main():
     sd_table = h5['sd_%s_%s' % (args.rover_name, args.base_name)]
 
     output_table_name = 'sdiff_%s_%s' % (args.rover_name, args.base_name)
-    h5[output_table_name] = merge_into_sdiffs(eph, sd_table)
+    h5[output_table_name] = merge_into_sdiffs(eph, sd_table,
+                                              workers=args.workers or None)
     
     h5.close()
 
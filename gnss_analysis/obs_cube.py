@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Ian Horn <ian@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+"""Dense, labeled epochs x satellites x fields arrays of observations.
+
+An ObsCube holds the same data as the Panels of observations (items are
+epochs, major axis is fields and minor axis is satellites), in a single
+float64 array with the fields outermost. Each field is then a contiguous
+epochs x satellites array, and selecting a field, or a range of epochs,
+is a view rather than a copy. Cubes are read from, and written to, the
+records2table HDF5 stores, in either the fixed (Panel) or the streamed
+(long table) format.
+
+"""
+
+from gnss_analysis.table_io import LAYOUT_ATTR, PANEL_INDEX_NAMES, \
+  PANEL_LAYOUT
+import numpy as np
+import pandas as pd
+
+
+class ObsCube(object):
+  """Observations indexed by epoch, satellite and field.
+
+  Parameters
+  ----------
+  data : array
+    Values, of shape (len(fields), len(epochs), len(sats))
+  epochs : sequence
+    Epoch labels, sorted
+  sats : sequence
+    Satellite labels
+  fields : sequence
+    Field names
+
+  """
+
+  def __init__(self, data, epochs, sats, fields):
+    self.data = np.asarray(data, dtype=np.float64)
+    self.epochs = pd.Index(epochs)
+    self.sats = pd.Index(sats)
+    self.fields = pd.Index(fields)
+    if self.data.shape != (len(self.fields), len(self.epochs),
+                           len(self.sats)):
+      raise ValueError("Data of shape %s doesn't match the axes."
+                       % (self.data.shape,))
+    self._field_pos = dict((f, i) for i, f in enumerate(self.fields))
+
+  @classmethod
+  def empty(cls, epochs, sats, fields):
+    """Returns an all-NaN cube.
+
+    """
+    data = np.empty((len(fields), len(epochs), len(sats)))
+    data.fill(np.nan)
+    return cls(data, epochs, sats, fields)
+
+  @classmethod
+  def from_panel(cls, panel, fields=None):
+    """Returns the cube of a Panel (items are epochs, major axis is fields
+    and minor axis is satellites), optionally of only some of its fields.
+
+    """
+    if fields is not None:
+      panel = panel.ix[:, list(fields), :]
+    data = np.ascontiguousarray(panel.values.transpose(1, 0, 2),
+                                dtype=np.float64)
+    return cls(data, panel.items, panel.minor_axis, panel.major_axis)
+
+  @classmethod
+  def from_long_frame(cls, df):
+    """Returns the cube of a long DataFrame with an (epoch, sat) row index
+    and a column per field, as streamed by records2table. Non-numeric
+    columns are left out.
+
+    """
+    fields = [c for c in df.columns if df[c].dtype.kind in 'biuf']
+    if df.empty:
+      return cls.empty([], [], fields)
+    items = df.index.get_level_values(0)
+    minors = df.index.get_level_values(1)
+    epochs = pd.Index(np.unique(items.values))
+    sats = pd.Index(np.unique(minors.values))
+    ii = epochs.get_indexer(items)
+    si = sats.get_indexer(minors)
+    cube = cls.empty(epochs, sats, fields)
+    for k, field in enumerate(fields):
+      cube.data[k, ii, si] = df[field].values
+    return cube
+
+  def to_panel(self):
+    """Returns the cube as a Panel (items are epochs, major axis is fields
+    and minor axis is satellites).
+
+    """
+    return pd.Panel(self.data.transpose(1, 0, 2), items=self.epochs,
+                    major_axis=self.fields, minor_axis=self.sats)
+
+  def to_long_frame(self):
+    """Returns the cube as a long DataFrame, with a row for each (epoch,
+    sat) with any non-NaN field, as from_long_frame expects.
+
+    """
+    present = ~np.isnan(self.data).all(axis=0)
+    ii, si = np.nonzero(present)
+    index = pd.MultiIndex.from_arrays([self.epochs[ii], self.sats[si]],
+                                      names=PANEL_INDEX_NAMES)
+    return pd.DataFrame(dict((f, self.data[k, ii, si])
+                             for k, f in enumerate(self.fields)),
+                        index=index, columns=list(self.fields))
+
+  @property
+  def shape(self):
+    """(epochs, sats, fields)
+
+    """
+    return len(self.epochs), len(self.sats), len(self.fields)
+
+  @property
+  def axes(self):
+    return [self.epochs, self.sats, self.fields]
+
+  @property
+  def values(self):
+    """The epochs x sats x fields array, as a view.
+
+    """
+    return self.data.transpose(1, 2, 0)
+
+  def __len__(self):
+    return len(self.epochs)
+
+  def __contains__(self, field):
+    return field in self._field_pos
+
+  def field(self, name):
+    """Returns a field as an epochs x sats array, which is a view.
+
+    """
+    return self.data[self._field_pos[name]]
+
+  def frame(self, name):
+    """Returns a field as an epochs x sats DataFrame.
+
+    """
+    return pd.DataFrame(self.field(name), index=self.epochs,
+                        columns=self.sats)
+
+  def epoch_frame(self, i):
+    """Returns the fields x sats DataFrame of the i-th epoch, as Panel
+    items are.
+
+    """
+    return pd.DataFrame(self.data[:, i, :], index=self.fields,
+                        columns=self.sats)
+
+  def __getitem__(self, key):
+    """A field name gives its array (see field), an integer gives an
+    epoch's DataFrame (see epoch_frame) and a slice gives the cube of
+    those epochs, which is a view.
+
+    """
+    if isinstance(key, slice):
+      return ObsCube(self.data[:, key], self.epochs[key], self.sats,
+                     self.fields)
+    if isinstance(key, (int, long, np.integer)):
+      return self.epoch_frame(key)
+    return self.field(key)
+
+  def between(self, start, end):
+    """Returns the cube of the epochs from start to end inclusive, which
+    is a view.
+
+    """
+    i = self.epochs.searchsorted(start, side='left')
+    j = self.epochs.searchsorted(end, side='right')
+    return self[i:j]
+
+  def select_epochs(self, mask):
+    """Returns the cube of the epochs where a boolean Series (indexed by
+    epoch) or array is True. Epochs missing from a Series are dropped.
+
+    """
+    if isinstance(mask, pd.Series):
+      mask = mask.reindex(self.epochs).fillna(False).values.astype(bool)
+    return ObsCube(self.data[:, mask], self.epochs[mask], self.sats,
+                   self.fields)
+
+  def reindex(self, epochs=None, sats=None, fields=None):
+    """Returns the cube conformed to new axes, with NaNs where there's
+    no data.
+
+    """
+    epochs = self.epochs if epochs is None else pd.Index(epochs)
+    sats = self.sats if sats is None else pd.Index(sats)
+    fields = self.fields if fields is None else pd.Index(fields)
+    out = ObsCube.empty(epochs, sats, fields)
+    ei = self.epochs.get_indexer(epochs)
+    si = self.sats.get_indexer(sats)
+    fi = self.fields.get_indexer(fields)
+    e_ok, s_ok, f_ok = ei >= 0, si >= 0, fi >= 0
+    out.data[np.ix_(f_ok, e_ok, s_ok)] = \
+      self.data[np.ix_(fi[f_ok], ei[e_ok], si[s_ok])]
+    return out
+
+  def join(self, other, rsuffix):
+    """Returns the cube of the fields of self and of other, aligned to the
+    epochs and sats of self. Fields of other that self also has get
+    rsuffix, as with Panel.join.
+
+    """
+    other = other.reindex(epochs=self.epochs, sats=self.sats)
+    fields = [f + rsuffix if f in self else f for f in other.fields]
+    return ObsCube(np.concatenate([self.data, other.data]), self.epochs,
+                   self.sats, list(self.fields) + fields)
+
+  def iteritems(self):
+    """Yields (epoch, fields x sats DataFrame), like Panel.iteritems.
+
+    """
+    for i, t in enumerate(self.epochs):
+      yield t, self.epoch_frame(i)
+
+
+def as_cube(obs):
+  """Returns obs as an ObsCube, converting it if it's a Panel.
+
+  """
+  if isinstance(obs, ObsCube):
+    return obs
+  return ObsCube.from_panel(obs)
+
+
+def read_cube(store, key):
+  """Reads a panel-like table from a records2table HDF5 store as an
+  ObsCube, whether it was stored as a Panel or streamed.
+
+  """
+  storer = store.get_storer(key)
+  if storer.is_table \
+     and getattr(storer.attrs, LAYOUT_ATTR, None) == PANEL_LAYOUT:
+    return ObsCube.from_long_frame(store.select(key))
+  table = store[key]
+  if isinstance(table, pd.DataFrame):
+    # An empty cube, see write_cube.
+    return ObsCube.from_long_frame(table)
+  return ObsCube.from_panel(table)
+
+
+def write_cube(store, key, cube):
+  """Writes an ObsCube to an HDF5 store as a streamed panel-like table,
+  which read_cube and table_io.read_table read back.
+
+  """
+  if key in store:
+    store.remove(key)
+  df = cube.to_long_frame()
+  if df.empty:
+    # Empty tables can't be appended.
+    store.put(key, df)
+    return
+  store.append(key, df, index=False)
+  setattr(store.get_storer(key).attrs, LAYOUT_ATTR, PANEL_LAYOUT)
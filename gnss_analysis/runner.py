@@ -9,8 +9,14 @@
 # EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
 # WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
 
+from functools import partial
+from gnss_analysis.abstract_analysis.checkpoint import DEFAULT_EVERY, \
+  Checkpointer
 from gnss_analysis.abstract_analysis.manage_tests import SITL
-from gnss_analysis.data_io import load_sdiffs_and_pos
+from gnss_analysis.constants import DGNSS_SETTINGS, DGNSS_SETTINGS_DEFAULTS
+from gnss_analysis.data_io import DEFAULT_STREAM_WINDOW, load_sdiffs_and_pos, \
+  stream_sdiffs_and_pos
+from gnss_analysis.derived_cache import DEFAULT_CACHE_DIR
 from gnss_analysis.tests.count import CountR
 from gnss_analysis.tests.iar_bools import *
 from gnss_analysis.tests.kf_internals import *
@@ -35,7 +41,7 @@ def determine_static_ecef(ecef_df):
   Parameters
   ----------
   ecef_df : DataFrame
-    A time series of ECEF positions.
+    A time series of ECEF positions, in columns 'x', 'y' and 'z'.
 
   Returns
   -------
@@ -43,7 +49,7 @@ def determine_static_ecef(ecef_df):
     An estimate of the receiver's position.
 
   """
-  return np.array(ecef_df.mean(axis=0))
+  return np.array(ecef_df[['x', 'y', 'z']].mean(axis=0))
 
 
 def guess_single_point_baselines(rover_ecef_df, base_ecef_df):
@@ -67,6 +73,14 @@ def guess_single_point_baselines(rover_ecef_df, base_ecef_df):
   return loc - rem
 
 
+def has_filter_settings():
+  """Returns whether the libswiftnav bindings can change the filter
+  settings (dgnss_management.dgnss_set_settings).
+
+  """
+  return hasattr(mgmt, 'dgnss_set_settings')
+
+
 class DGNSSUpdater(object):
   """Wraps an update function to be used by the SITL analysis.
 
@@ -74,14 +88,30 @@ class DGNSSUpdater(object):
   ----------
   first_data_point : DataFrame
     The first set of observations for initializing the filters.
-  rover_ecef_df : DataFrame
-    A time series of single point ECEF positions of the rover receiver.
-  base_ecef_df : DataFrame
-    A time series of single point ECEF positions of the base receiver.
+  rover_ecef : array
+    The ECEF position of the rover receiver.
+  snr_mask : float, optional
+    Leave satellites with a lower snr out of the first observations.
+  filter_settings : dict, optional
+    Filter settings (see constants.DGNSS_SETTINGS) to set before
+    initializing the filters. Settings that aren't given get their
+    libswiftnav defaults. Needs bindings that can set them (see
+    has_filter_settings).
 
   """
-  def __init__(self, first_data_point, rover_ecef):
-    mgmt.dgnss_init(first_data_point.apply(ut.mk_swiftnav_sdiff, axis=0).dropna(),
+  def __init__(self, first_data_point, rover_ecef, snr_mask=None,
+               filter_settings=None):
+    if filter_settings:
+      unknown = set(filter_settings) - set(DGNSS_SETTINGS)
+      if unknown:
+        raise Exception("Unknown filter settings: %s"
+                        % ', '.join(sorted(unknown)))
+      if not has_filter_settings():
+        raise Exception("These libswiftnav bindings can't change the filter "
+                        "settings (no dgnss_management.dgnss_set_settings).")
+      settings = dict(DGNSS_SETTINGS_DEFAULTS, **filter_settings)
+      mgmt.dgnss_set_settings(*[settings[name] for name in DGNSS_SETTINGS])
+    mgmt.dgnss_init(ut.mk_swiftnav_sdiffs(first_data_point, snr_mask),
                     rover_ecef)
 
   def update_function(self, datum, parameters):
@@ -90,11 +120,24 @@ class DGNSSUpdater(object):
 
     Parameters
     ----------
-    datum : DataFrame
-      A DataFrame of data necessary to create a set of sdiff_t.
+    datum : EpochContext
+      The context of a DataFrame of data necessary to create a set of
+      sdiff_t.
     """
-    mgmt.dgnss_update(datum.apply(ut.mk_swiftnav_sdiff, axis=0).dropna(),
-                      parameters.rover_ecef)
+    mgmt.dgnss_update(datum.sdiffs, parameters.rover_ecef)
+
+  def save_state(self):
+    """
+    Returns a copy of the filter state, as far as the bindings expose it,
+    for checkpoints. The bindings can't set the state, so resuming reruns
+    the filter up to the checkpoint and checks it against this copy.
+    """
+    return {'sats': mgmt.get_sats_management(),
+            'amb_kf_prns': mgmt.get_amb_kf_prns(),
+            'amb_kf_mean': mgmt.get_amb_kf_mean(),
+            'amb_kf_cov': mgmt.get_amb_kf_cov2(),
+            'iar_num_hyps': mgmt.dgnss_iar_num_hyps(),
+            'iar_num_sats': mgmt.dgnss_iar_num_sats()}
 
 
 class DGNSSParameters(object):
@@ -124,25 +167,69 @@ reports = [ CountR()
           # , KFCovR()
           ]
 
+# Every report, including the ones that can crash libswiftnav. Only run
+# these crash-isolated, as batch_run does.
+full_reports = [ CountR()
+               , FixedIARBegunR()
+               , FixedIARCompletedR()
+               , FixedIARLeastSquareStartedInPoolR()
+               , FixedIARLeastSquareEndedInPoolR()
+               , FloatBaselineR()
+               , FixedBaselineR()
+               ]
+
 
-def run(hdf5_filename, known_baseline, reports=reports, baseline_is_NED=False):
+def run(hdf5_filename, known_baseline, reports=reports, baseline_is_NED=False,
+        stream=False, window=DEFAULT_STREAM_WINDOW, snr_mask=None,
+        filter_settings=None, checkpoint=None, checkpoint_every=DEFAULT_EVERY,
+        cache_dir=None):
   """Alternative entry point for running DGNSS SITL analysis.
 
+  With stream, sdiffs are computed a window of epochs at a time while the
+  filter runs, instead of all before it, and the static receiver
+  positions are estimated from the single point positions of the first
+  window only.
+
+  Satellites with an snr below snr_mask are left out, and filter_settings
+  (see constants.DGNSS_SETTINGS) override the libswiftnav defaults.
+
+  Without stream, the sdiffs are kept in the data file, or in the derived
+  data cache in cache_dir if given (see data_io.load_sdiffs_and_pos).
+
+  With a checkpoint file, progress is saved to it every checkpoint_every
+  epochs, and a run resumes from it if it's there. Resuming only skips the
+  analyses of the epochs before the checkpoint: libswiftnav's filter state
+  can't be set from Python, so the filter is rerun over them.
+
   """
-  data, rover_ecef_df, base_ecef_df = load_sdiffs_and_pos(hdf5_filename)
-  if len(data.items) < 2:
-    raise Exception("Data must contain at least two observations.")
-  # data = data.ix[:,:,[0,2,22,30,31]]
-  first_datum = data.ix[1]
-  data = data.ix[2:]
+  if stream:
+    data = stream_sdiffs_and_pos(hdf5_filename, window)
+    rover_ecef_df, base_ecef_df = data.positions(window)
+    if len(rover_ecef_df) < 2:
+      raise Exception("Data must contain at least two observations.")
+    next(data)
+    first_datum = next(data)[1]
+  else:
+    data, rover_ecef_df, base_ecef_df = \
+      load_sdiffs_and_pos(hdf5_filename, cache_dir=cache_dir)
+    if len(data) < 2:
+      raise Exception("Data must contain at least two observations.")
+    # data = data.reindex(sats=[0,2,22,30,31])
+    first_datum = data[1]
+    data = data[2:]
 
   parameters = DGNSSParameters(known_baseline, rover_ecef_df,
                                base_ecef_df, baseline_is_NED)
   print parameters.known_baseline
-  updater = DGNSSUpdater(first_datum, parameters.rover_ecef)
+  updater = DGNSSUpdater(first_datum, parameters.rover_ecef, snr_mask,
+                         filter_settings)
   initial_sats = mgmt.get_sats_management()[1]
   initial_means = mgmt.get_amb_kf_mean()
-  tester = SITL(updater.update_function, data, parameters)
+  if checkpoint is not None:
+    checkpoint = Checkpointer(checkpoint, checkpoint_every)
+  tester = SITL(updater.update_function, data, parameters,
+                context_function=partial(ut.EpochContext, min_snr=snr_mask),
+                checkpoint=checkpoint, save_state=updater.save_state)
   tester.add_reports(reports)
   return tester.compute()
 
@@ -158,6 +245,22 @@ def main():
   parser.add_argument('baselineY', help='The baseline east  component.')
   parser.add_argument('baselineZ', help='The baseline down component.')
   parser.add_argument('--NED', action='store_true')
+  parser.add_argument('--stream', action='store_true',
+                      help='Compute sdiffs while the filter runs.')
+  parser.add_argument('--window', type=int, default=DEFAULT_STREAM_WINDOW,
+                      help='Number of epochs to compute at a time when '
+                      'streaming.')
+  parser.add_argument('--checkpoint', default=None,
+                      help='File to checkpoint the run to, and resume it '
+                      'from. Resuming only skips the analyses: the filter '
+                      'is rerun over every epoch before the checkpoint.')
+  parser.add_argument('--checkpoint_every', type=int, default=DEFAULT_EVERY,
+                      help='Number of epochs between checkpoints.')
+  parser.add_argument('--cache_dir', nargs='?', const=DEFAULT_CACHE_DIR,
+                      default=None,
+                      help='Keep the sdiffs in the derived data cache in this '
+                      'directory (%s if none is given), rather than in the '
+                      'HDF5 file.' % DEFAULT_CACHE_DIR)
   args = parser.parse_args()
   hdf5_filename = args.file
   baselineX = args.baselineX
@@ -165,7 +268,11 @@ def main():
   baselineZ = args.baselineZ
   args.NED
   baseline = np.array(map(float, [baselineX, baselineY, baselineZ]))
-  reports = run(hdf5_filename, baseline, baseline_is_NED=args.NED)
+  reports = run(hdf5_filename, baseline, baseline_is_NED=args.NED,
+                stream=args.stream, window=args.window,
+                checkpoint=args.checkpoint,
+                checkpoint_every=args.checkpoint_every,
+                cache_dir=args.cache_dir)
   for key, report in reports.iteritems():
     print '(key=' + key + ') \t' + str(report)
 
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Ian Horn <ian@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+"""Vectorized satellite position, velocity and clock error computation
+from GPS broadcast ephemerides.
+
+calc_sat_states follows libswiftnav's calc_sat_state (IS-GPS-200D,
+Table 20-IV) step for step, but on arrays of ephemerides and times, so
+that the states of every satellite at every epoch are computed in a
+handful of array operations instead of one libswiftnav call (and one
+Ephemeris construction) each.
+
+"""
+
+from swiftnav.gpstime import datetime2gpst
+import numpy as np
+
+# Constants from libswiftnav (include/libswiftnav/constants.h)
+NAV_GM = 3.986005e14
+NAV_OMEGAE_DOT = 7.2921151467e-005
+NAV_F = -4.442807633e-10
+WEEK_SECS = 7 * 24 * 3600
+
+# Ephemeris fields used by calc_sat_states, as named in the ephemerides
+# tables.
+EPH_FIELDS = ['tgd', 'c_rs', 'c_rc', 'c_uc', 'c_us', 'c_ic', 'c_is',
+              'dn', 'm0', 'ecc', 'sqrta', 'omega0', 'omegadot', 'w',
+              'inc', 'inc_dot', 'af0', 'af1', 'af2',
+              'toe_wn', 'toe_tow', 'toc_wn', 'toc_tow']
+
+# Maximum number of eccentric anomaly iterations, as in libswiftnav.
+MAX_KEPLER_ITERS = 6
+
+
+def gps_times(times):
+  """Returns the GPS weeks and times of week of a sequence of datetimes.
+
+  """
+  gpsts = [datetime2gpst(t) for t in times]
+  return (np.array([g.wn for g in gpsts], dtype=np.float64),
+          np.array([g.tow for g in gpsts], dtype=np.float64))
+
+
+def calc_sat_states(eph, wn, tow):
+  """Computes satellite positions, velocities and clock errors.
+
+  Parameters
+  ----------
+  eph : dict or DataFrame
+    Arrays of ephemeris fields (see EPH_FIELDS), all of the same shape,
+    or broadcastable with wn and tow.
+  wn : array
+    GPS weeks of the times to compute states at
+  tow : array
+    GPS times of week (s) of the times to compute states at
+
+  Returns
+  -------
+  array
+    Positions (ECEF, m), with an extra trailing axis of length 3
+  array
+    Velocities (ECEF, m/s), with an extra trailing axis of length 3
+  array
+    Clock errors (s)
+  array
+    Clock rate errors (s/s)
+
+  """
+  f = lambda name: np.asarray(eph[name], dtype=np.float64)
+  wn = np.asarray(wn, dtype=np.float64)
+  tow = np.asarray(tow, dtype=np.float64)
+
+  # Satellite clock terms, from the clock data reference time.
+  tdiff = (wn - f('toc_wn')) * WEEK_SECS + (tow - f('toc_tow'))
+  af1, af2 = f('af1'), f('af2')
+  clock_err = f('af0') + tdiff * (af1 + tdiff * af2) - f('tgd')
+  clock_rate_err = af1 + 2.0 * tdiff * af2
+
+  # Time from the ephemeris reference epoch.
+  tdiff = (wn - f('toe_wn')) * WEEK_SECS + (tow - f('toe_tow'))
+
+  sqrta, ecc = f('sqrta'), f('ecc')
+  a = sqrta * sqrta
+  ma_dot = np.sqrt(NAV_GM / (a * a * a)) + f('dn')
+  ma = f('m0') + ma_dot * tdiff
+
+  # Solve Kepler's equation for the eccentric anomaly. As in libswiftnav,
+  # each element stops iterating once it has converged.
+  ea = ma.copy()
+  active = np.ones(ea.shape, dtype=bool)
+  for _ in range(MAX_KEPLER_ITERS):
+    ea_old = ea
+    step = (ma - ea_old + ecc * np.sin(ea_old)) / (1.0 - ecc * np.cos(ea_old))
+    ea = np.where(active, ea_old + step, ea_old)
+    active &= np.abs(ea - ea_old) > 1.0e-14
+    if not active.any():
+      break
+  ea_dot = ma_dot / (1.0 - ecc * np.cos(ea))
+
+  # Relativistic correction term
+  einstein = NAV_F * ecc * sqrta * np.sin(ea)
+
+  # True anomaly and argument of latitude
+  temp = np.sqrt(1.0 - ecc * ecc)
+  al = np.arctan2(temp * np.sin(ea), np.cos(ea) - ecc) + f('w')
+  al_dot = temp * ea_dot / (1.0 - ecc * np.cos(ea))
+  sin2al, cos2al = np.sin(2.0 * al), np.cos(2.0 * al)
+
+  # Corrected argument of latitude, radius and inclination
+  cal = al + f('c_us') * sin2al + f('c_uc') * cos2al
+  c_rs, c_rc = f('c_rs'), f('c_rc')
+  r = a * (1.0 - ecc * np.cos(ea)) + c_rc * cos2al + c_rs * sin2al
+  r_dot = a * ecc * np.sin(ea) * ea_dot \
+          + 2.0 * al_dot * (c_rs * cos2al - c_rc * sin2al)
+  c_is, c_ic, inc_dot = f('c_is'), f('c_ic'), f('inc_dot')
+  inc = f('inc') + inc_dot * tdiff + c_ic * cos2al + c_is * sin2al
+  inc_dot = inc_dot + 2.0 * al_dot * (c_is * cos2al - c_ic * sin2al)
+
+  # Position and velocity in the orbital plane
+  x = r * np.cos(cal)
+  y = r * np.sin(cal)
+  x_dot = r_dot * np.cos(cal) - y * al_dot
+  y_dot = r_dot * np.sin(cal) + x * al_dot
+
+  # Corrected longitude of the ascending node
+  om_dot = f('omegadot') - NAV_OMEGAE_DOT
+  om = f('omega0') + tdiff * om_dot - NAV_OMEGAE_DOT * f('toe_tow')
+
+  cos_om, sin_om = np.cos(om), np.sin(om)
+  cos_inc, sin_inc = np.cos(inc), np.sin(inc)
+  pos = np.empty(np.shape(x) + (3,))
+  pos[..., 0] = x * cos_om - y * cos_inc * sin_om
+  pos[..., 1] = x * sin_om + y * cos_inc * cos_om
+  pos[..., 2] = y * sin_inc
+
+  temp = y_dot * cos_inc - y * sin_inc * inc_dot
+  vel = np.empty(pos.shape)
+  vel[..., 0] = -om_dot * pos[..., 1] + x_dot * cos_om - temp * sin_om
+  vel[..., 1] = om_dot * pos[..., 0] + x_dot * sin_om + temp * cos_om
+  vel[..., 2] = y * cos_inc * inc_dot + y_dot * sin_inc
+
+  return pos, vel, clock_err + einstein, clock_rate_err
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Ian Horn <ian@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+"""Batched single point positioning.
+
+solve_spp solves the iterative least squares position and clock bias
+problem of libswiftnav's calc_PVT (earth rotation corrected geometric
+ranges, starting from the center of the earth, iterating until the
+position update is under a millimeter) for every epoch of a log at once.
+Epochs are rows of stacked (epoch x satellite) arrays, and the
+satellites used at each epoch are selected by a mask, so that epochs
+with different numbers of satellites are solved together. Unlike
+calc_PVT, no velocity is solved for and there is no RAIM.
+
+"""
+
+from gnss_analysis.constants import GPS_C, MIN_SATS
+from gnss_analysis.sat_state import NAV_OMEGAE_DOT
+import numpy as np
+
+SPP_MAX_ITERS = 20
+SPP_TOL = 1e-3
+
+# WGS84 ellipsoid, for the local level frame of the DOPs.
+WGS84_A = 6378137.0
+WGS84_E2 = 6.69437999014e-3
+
+DOP_NAMES = ['gdop', 'pdop', 'tdop', 'hdop', 'vdop']
+
+
+def _ned_rotations(pos):
+  """Returns the ECEF to NED rotation matrices at positions of shape
+  (..., 3), of shape (..., 3, 3).
+
+  """
+  x, y, z = pos[..., 0], pos[..., 1], pos[..., 2]
+  p = np.hypot(x, y)
+  lon = np.arctan2(y, x)
+  lat = np.arctan2(z, p * (1.0 - WGS84_E2))
+  for _ in range(4):
+    n = WGS84_A / np.sqrt(1.0 - WGS84_E2 * np.sin(lat) ** 2)
+    lat = np.arctan2(z + WGS84_E2 * n * np.sin(lat), p)
+  sin_lat, cos_lat = np.sin(lat), np.cos(lat)
+  sin_lon, cos_lon = np.sin(lon), np.cos(lon)
+  rot = np.empty(np.shape(lat) + (3, 3))
+  rot[..., 0, 0] = -sin_lat * cos_lon
+  rot[..., 0, 1] = -sin_lat * sin_lon
+  rot[..., 0, 2] = cos_lat
+  rot[..., 1, 0] = -sin_lon
+  rot[..., 1, 1] = cos_lon
+  rot[..., 1, 2] = 0.0
+  rot[..., 2, 0] = -cos_lat * cos_lon
+  rot[..., 2, 1] = -cos_lat * sin_lon
+  rot[..., 2, 2] = -sin_lat
+  return rot
+
+
+def _geometry(state, sat_pos):
+  """Returns the earth rotation corrected ranges and unit line of sight
+  vectors (receiver to satellite) from receiver states of shape (T, 4) to
+  satellite positions of shape (T, S, 3).
+
+  """
+  rx = state[:, None, :3]
+  tau = np.sqrt(((rx - sat_pos) ** 2).sum(axis=-1)) / GPS_C
+  we_tau = NAV_OMEGAE_DOT * tau
+  cos_wt, sin_wt = np.cos(we_tau), np.sin(we_tau)
+  rotated = np.empty(sat_pos.shape)
+  rotated[..., 0] = cos_wt * sat_pos[..., 0] + sin_wt * sat_pos[..., 1]
+  rotated[..., 1] = -sin_wt * sat_pos[..., 0] + cos_wt * sat_pos[..., 1]
+  rotated[..., 2] = sat_pos[..., 2]
+  los = rotated - rx
+  ranges = np.sqrt((los ** 2).sum(axis=-1))
+  return ranges, los / ranges[..., None]
+
+
+def solve_spp(pseudoranges, sat_pos, mask=None,
+              max_iters=SPP_MAX_ITERS, tol=SPP_TOL):
+  """Solves for receiver positions and clock biases at many epochs.
+
+  Parameters
+  ----------
+  pseudoranges : array
+    Satellite clock corrected pseudoranges (m), of shape (T, S)
+  sat_pos : array
+    Satellite positions (ECEF, m), of shape (T, S, 3)
+  mask : array, optional
+    Which measurements to use, of shape (T, S). By default, those whose
+    pseudorange and satellite position aren't NaN. Masked out ones may
+    be NaN.
+  max_iters : int, optional
+    Maximum number of iterations (default SPP_MAX_ITERS)
+  tol : float, optional
+    An epoch has converged when the norm of its position update is less
+    than tol (m). (default SPP_TOL)
+
+  Returns
+  -------
+  array
+    Receiver positions (ECEF, m), of shape (T, 3)
+  array
+    Receiver clock biases (m), of shape (T,)
+  dict
+    Dilutions of precision (see DOP_NAMES), arrays of shape (T,)
+  array
+    Pseudorange residuals (m) of the solution, of shape (T, S)
+
+    Epochs with fewer than MIN_SATS measurements, with a singular
+    geometry, or that haven't converged within max_iters, have NaN
+    solutions, DOPs and residuals. Masked out
+    measurements have NaN residuals.
+
+  """
+  pseudoranges = np.asarray(pseudoranges, dtype=np.float64)
+  sat_pos = np.asarray(sat_pos, dtype=np.float64)
+  valid = ~(np.isnan(pseudoranges) | np.isnan(sat_pos).any(axis=-1))
+  mask = valid if mask is None else np.asarray(mask, dtype=bool) & valid
+  n_epochs = pseudoranges.shape[0]
+  # Masked out measurements get zero weight, and finite stand ins so that
+  # they don't spread NaNs through the sums.
+  w = mask.astype(np.float64)
+  pr = np.where(mask, pseudoranges, 0.0)
+  sat_pos = np.where(mask[..., None], sat_pos, 1.0)
+
+  state = np.zeros((n_epochs, 4))
+  ok = mask.sum(axis=1) >= MIN_SATS
+  active = ok.copy()
+  eye = np.eye(4)
+  for _ in range(max_iters):
+    if not active.any():
+      break
+    ranges, los = _geometry(state[active], sat_pos[active])
+    G = np.concatenate([-los, np.ones(ranges.shape + (1,))], axis=-1)
+    wa = w[active]
+    omp = pr[active] - ranges - state[active, 3:]
+    N = np.einsum('tsi,ts,tsj->tij', G, wa, G)
+    singular = np.abs(np.linalg.det(N)) < 1e-12
+    N[singular] = eye
+    rhs = np.einsum('tsi,ts,ts->ti', G, wa, omp)
+    dx = np.linalg.solve(N, rhs[..., None])[..., 0]
+    dx[singular] = np.nan
+    state[active] += dx
+    idx = np.flatnonzero(active)
+    ok[idx[singular]] = False
+    active[idx] = ~singular & (np.sqrt((dx[:, :3] ** 2).sum(axis=1)) >= tol)
+  # Epochs still updating haven't converged.
+  ok[active] = False
+  state[~ok] = np.nan
+
+  # DOPs and residuals at the solutions.
+  ranges, los = _geometry(state, sat_pos)
+  G = np.concatenate([-los, np.ones(ranges.shape + (1,))], axis=-1)
+  N = np.einsum('tsi,ts,tsj->tij', G, w, G)
+  N[~ok] = eye
+  H = np.linalg.inv(N)
+  H[~ok] = np.nan
+  rot = _ned_rotations(np.where(ok[:, None], state[:, :3], 1.0))
+  H_ned = np.einsum('tij,tjk,tlk->til', rot, H[:, :3, :3], rot)
+  diag = lambda m: np.diagonal(m, axis1=1, axis2=2)
+  dops = {'gdop': np.sqrt(diag(H).sum(axis=1)),
+          'pdop': np.sqrt(diag(H)[:, :3].sum(axis=1)),
+          'tdop': np.sqrt(H[:, 3, 3]),
+          'hdop': np.sqrt(diag(H_ned)[:, :2].sum(axis=1)),
+          'vdop': np.sqrt(H_ned[:, 2, 2])}
+  residuals = np.where(mask, pr - ranges - state[:, 3:], np.nan)
+  return state[:, :3], state[:, 3], dops, residuals
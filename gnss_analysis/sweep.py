@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Ian Horn <ian@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+"""Sweeps the SITL analysis over a space of parameters.
+
+Every combination of parameter values is run on every dataset of a
+batch_run manifest, in a worker_pool.WorkerPool, and the reports of all
+the runs are collected into one table, indexed by the dataset's row and
+the parameter values.
+
+The parameters are:
+
+  baseline_offset_x, baseline_offset_y, baseline_offset_z :
+    offsets added to the known baseline, in its frame (ECEF or NED)
+  snr_mask :
+    satellites with a lower snr are left out of the filter
+  phase_var_test, code_var_test, ... :
+    the libswiftnav filter settings (see constants.DGNSS_SETTINGS)
+
+The sdiffs of each dataset are computed once, before the runs, by a job
+of their own in the same worker pool, and every run reads them from the
+dataset's file, or from the derived data cache if given a cache
+directory (see data_io.load_sdiffs_and_pos).
+
+"""
+
+from gnss_analysis.batch_run import read_manifest
+from gnss_analysis.constants import DGNSS_SETTINGS
+from gnss_analysis.data_io import load_sdiffs_and_pos
+from gnss_analysis.derived_cache import DEFAULT_CACHE_DIR
+from gnss_analysis.runner import full_reports, has_filter_settings, \
+  reports as default_reports, run as single_run
+from gnss_analysis.worker_pool import WorkerPool
+import itertools
+import multiprocessing
+import numpy as np
+import pandas as pd
+import time
+import warnings
+
+BASELINE_OFFSETS = ['baseline_offset_x', 'baseline_offset_y',
+                    'baseline_offset_z']
+PARAMETERS = BASELINE_OFFSETS + ['snr_mask'] + DGNSS_SETTINGS
+
+DATASET_INDEX = 'dataset'
+
+
+def _check_names(names):
+  unknown = [name for name in names if name not in PARAMETERS]
+  if unknown:
+    raise Exception("Unknown sweep parameters: %s" % ', '.join(unknown))
+
+
+def grid(space):
+  """Returns every combination of parameter values.
+
+  Parameters
+  ----------
+  space : dict
+    Values to take, by parameter name
+
+  Returns
+  -------
+  list of dict
+    The combinations, as parameter values by name
+
+  """
+  _check_names(space)
+  names = sorted(space)
+  return [dict(zip(names, values))
+          for values in itertools.product(*[space[n] for n in names])]
+
+
+def random_sample(space, n, seed=None):
+  """Returns n random combinations of parameter values.
+
+  Parameters
+  ----------
+  space : dict
+    By parameter name, either a (low, high) tuple to draw uniformly
+    from, or a list of values to choose from
+  n : int
+    Number of combinations
+  seed : int, optional
+    Seed of the random numbers
+
+  Returns
+  -------
+  list of dict
+    The combinations, as parameter values by name
+
+  """
+  _check_names(space)
+  rng = np.random.RandomState(seed)
+  names = sorted(space)
+  columns = []
+  for name in names:
+    values = space[name]
+    if isinstance(values, tuple):
+      columns.append(rng.uniform(values[0], values[1], n))
+    else:
+      columns.append([values[i] for i in rng.randint(len(values), size=n)])
+  return [dict(zip(names, values)) for values in zip(*columns)]
+
+
+def _run_job(entry, params, full, cache_dir):
+  """Worker job for sweep. Returns the reports of a run and the seconds
+  it took.
+
+  """
+  start = time.time()
+  offset = np.array([params.get(name, 0.) for name in BASELINE_OFFSETS])
+  settings = dict((name, params[name]) for name in DGNSS_SETTINGS
+                  if name in params)
+  reports = single_run(entry['file'], entry['baseline'] + offset,
+                       reports=full_reports if full else default_reports,
+                       baseline_is_NED=entry['ned'],
+                       snr_mask=params.get('snr_mask', None),
+                       filter_settings=settings, cache_dir=cache_dir)
+  return reports, time.time() - start
+
+
+def sweep(entries, combos, workers=None, full=False, timeout=None,
+          max_bytes=None, retries=1, cache_dir=None):
+  """Runs the SITL analysis of each entry of a manifest with each
+  combination of parameter values.
+
+  The sdiffs of each dataset are computed first, in the same pool of
+  workers as the runs. A run that fails is reported and its row records
+  the failure (see worker_pool.RunFailure.as_dict), so that it doesn't
+  abort the sweep, as do the rows of a dataset whose sdiffs couldn't be
+  computed.
+
+  Parameters
+  ----------
+  entries : list of dict
+    Datasets, as from batch_run.read_manifest
+  combos : list of dict
+    Parameter values by name, as from grid or random_sample. Every
+    combination must have the same parameters. Filter settings need
+    bindings that can set them (see runner.has_filter_settings).
+  workers : int, optional
+    Number of runs at a time, each in its own process. If None, use one
+    per CPU.
+  full : bool, optional
+    Compute runner.full_reports, rather than runner.reports
+  timeout, max_bytes, retries : optional
+    As for batch_run.batch_run
+  cache_dir : str, optional
+    Directory of the derived data cache to keep the sdiffs in, rather
+    than in the datasets' files (see data_io.load_sdiffs_and_pos)
+
+  Returns
+  -------
+  DataFrame
+    The reports of each run, indexed by the dataset's row and the
+    parameter values, in the order of the entries and combinations
+
+  """
+  names = sorted(combos[0]) if combos else []
+  _check_combos(combos, names)
+  keys = [(entry, combo) for entry in entries for combo in combos]
+  rows = [None] * len(keys)
+  pool = WorkerPool(min(workers or multiprocessing.cpu_count(), len(keys)),
+                    timeout=timeout, max_bytes=max_bytes, retries=retries)
+  try:
+    failed = _precompute(pool, sorted(set(e['file'] for e in entries)),
+                         cache_dir)
+    runs = []
+    for i, (entry, combo) in enumerate(keys):
+      if entry['file'] in failed:
+        rows[i] = failed[entry['file']].as_dict()
+      else:
+        runs.append(i)
+    _run_all(pool, [keys[i] for i in runs], full, cache_dir, rows, runs)
+  finally:
+    pool.close()
+  index = pd.MultiIndex.from_tuples(
+    [(entry['row'],) + tuple(combo[name] for name in names)
+     for entry, combo in keys],
+    names=[DATASET_INDEX] + names)
+  return pd.DataFrame(rows, index=index)
+
+
+def _check_combos(combos, names):
+  for combo in combos:
+    if sorted(combo) != names:
+      raise Exception("Sweep combinations have different parameters.")
+  _check_names(names)
+  settings = [name for name in names if name in DGNSS_SETTINGS]
+  if settings and not has_filter_settings():
+    raise Exception("Can't sweep %s: these libswiftnav bindings can't change "
+                    "the filter settings (no "
+                    "dgnss_management.dgnss_set_settings)."
+                    % ', '.join(settings))
+
+
+def _precompute_job(filename, cache_dir):
+  """Worker job for sweep, computing the sdiffs of a dataset."""
+  load_sdiffs_and_pos(filename, cache_dir=cache_dir)
+
+
+def _precompute(pool, filenames, cache_dir):
+  """Computes the sdiffs of each dataset once, in the pool, so that the
+  runs all read them rather than each computing them. Returns the
+  RunFailure of each dataset whose sdiffs couldn't be computed, by
+  filename.
+
+  """
+  failed = {}
+  jobs = [(filename, cache_dir) for filename in filenames]
+  for i, _, failure in pool.imap_unordered(_precompute_job, jobs):
+    if failure is not None:
+      print "Failed to compute the sdiffs of %s (%s, %d attempts):" \
+        % (filenames[i], failure.kind, failure.attempts)
+      print failure.detail
+      warnings.warn("Failed to compute the sdiffs of %s." % filenames[i])
+      failed[filenames[i]] = failure
+  return failed
+
+
+def _run_all(pool, keys, full, cache_dir, rows, rows_index):
+  """Runs each (entry, combo) of keys in the pool, putting its reports,
+  or its failure, in rows at the position given by rows_index.
+
+  """
+  jobs = [(entry, combo, full, cache_dir) for entry, combo in keys]
+  results = pool.imap_unordered(_run_job, jobs)
+  for n, (i, result, failure) in enumerate(results, 1):
+    entry, combo = keys[i]
+    label = "%s %s" % (entry['row'], combo)
+    if failure is None:
+      reports, elapsed = result
+      print "[%d/%d] Ran %s in %.1f sec." % (n, len(jobs), label, elapsed)
+      rows[rows_index[i]] = reports
+    else:
+      print "[%d/%d] Failed to run %s (%s, %d attempts):" \
+        % (n, len(jobs), label, failure.kind, failure.attempts)
+      print failure.detail
+      warnings.warn("Failed to run %s." % label)
+      rows[rows_index[i]] = failure.as_dict()
+
+
+def parse_param(arg):
+  """Parses a --param argument, 'name=v1,v2,...' (values to take) or
+  'name=low:high' (a range to sample), into (name, values).
+
+  """
+  name, sep, values = arg.partition('=')
+  if not sep:
+    raise ValueError("Expected name=values, not %r." % arg)
+  name = name.strip()
+  _check_names([name])
+  if ':' in values:
+    low, high = values.split(':')
+    return name, (float(low), float(high))
+  return name, [float(v) for v in values.split(',')]
+
+
+def main():
+  import argparse
+  parser = argparse.ArgumentParser(
+    description='RTK Filter SITL parameter sweep over many datasets.')
+  parser.add_argument('manifest',
+                      help='CSV manifest of the datasets (file,x,y,z[,ned]'
+                      '[,row]).')
+  parser.add_argument('outfile', help='Specify the HDF5 file to output into.')
+  parser.add_argument('-k', '--key', default='sweep',
+                      help='The key for the output table.')
+  parser.add_argument('-p', '--param', action='append', default=[],
+                      help='A parameter to sweep, as name=v1,v2,... or, with '
+                      '--samples, name=low:high. Parameters: %s.'
+                      % ', '.join(PARAMETERS))
+  parser.add_argument('-n', '--samples', type=int, default=None,
+                      help='Run this many random combinations, rather than '
+                      'every combination.')
+  parser.add_argument('--seed', type=int, default=None,
+                      help='Seed of the random combinations.')
+  parser.add_argument('-w', '--workers', type=int, default=None,
+                      help='Number of runs at a time (default one per CPU).')
+  parser.add_argument('--full', action='store_true',
+                      help='Compute every report, including the IAR and '
+                      'baseline reports that can crash libswiftnav.')
+  parser.add_argument('--timeout', type=float, default=None,
+                      help='Seconds a run may take before it is killed.')
+  parser.add_argument('--max_memory', type=int, default=None,
+                      help='Cap on the memory of each worker, in MB.')
+  parser.add_argument('--retries', type=int, default=1,
+                      help='Times to rerun a run that crashed or timed out.')
+  parser.add_argument('--cache_dir', nargs='?', const=DEFAULT_CACHE_DIR,
+                      default=None,
+                      help='Keep the sdiffs in the derived data cache in this '
+                      'directory (%s if none is given), rather than in the '
+                      'HDF5 files.' % DEFAULT_CACHE_DIR)
+  args = parser.parse_args()
+  space = dict(parse_param(p) for p in args.param)
+  if args.samples is None:
+    ranges = [name for name, v in space.iteritems() if isinstance(v, tuple)]
+    if ranges:
+      parser.error('Ranges need --samples: %s' % ', '.join(ranges))
+    combos = grid(space)
+  else:
+    combos = random_sample(space, args.samples, args.seed)
+  max_bytes = None if args.max_memory is None else args.max_memory << 20
+  table = sweep(read_manifest(args.manifest), combos, workers=args.workers,
+                full=args.full, timeout=args.timeout, max_bytes=max_bytes,
+                retries=args.retries, cache_dir=args.cache_dir)
+  with pd.HDFStore(args.outfile) as store:
+    store[args.key] = table
+  if 'failure' in table.columns:
+    print "%d runs failed." % table['failure'].notnull().sum()
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Bhaskar Mookerji <mookerji@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+"""Appendable HDF5 table storage for records2table output.
+
+The original records2table output stores each table in the fixed
+format, either as a 'wide' Panel (items, fields, minor) or as a
+DataFrame whose columns are record keys and whose rows are fields. Neither
+can be appended to, so the whole log has to be held in memory before
+anything is written.
+
+Streamed tables are instead stored in the table format in 'long'
+orientation: one row per record, one column per field. Panel-like tables
+carry a two-level (item, minor) row index. The original layout is
+recorded in the storer attributes, and read_table turns both kinds of
+table back into the Panel/DataFrame layout that the rest of this library
+expects.
+
+"""
+
+import ast
+import numpy as np
+import pandas as pd
+import warnings
+
+# Storer attribute recording the original layout of a streamed table.
+LAYOUT_ATTR = 'layout'
+PANEL_LAYOUT = 'panel'
+FRAME_LAYOUT = 'frame'
+
+# Index level names for panel-like tables stored in long orientation.
+PANEL_INDEX_NAMES = ['item', 'minor']
+
+# Minimum width of string columns in appendable tables. SBP text fields
+# (e.g., MsgLog) are at most 255 bytes.
+STRING_ITEMSIZE = 255
+
+# Storer attributes recording the width of a streamed table's string
+# columns, and which of them hold the reprs of other Python values.
+ITEMSIZE_ATTR = 'string_itemsize'
+REPR_ATTR = 'repr_columns'
+
+# Group of the side tables of streamed tables, and the storer attribute
+# of a streamed table listing its side tables (see ChunkedTableWriter).
+PARTS_GROUP = '/_parts/'
+PARTS_ATTR = 'side_tables'
+
+# Stored in string columns for missing values.
+NAN_REP = '__nan__'
+
+warnings.filterwarnings('ignore', category=pd.io.pytables.PerformanceWarning)
+
+
+def long_frame(attr, layout):
+  """Converts nested record dicts, as accumulated by StoreToHDF5, into a
+  long DataFrame with one row per record.
+
+  Parameters
+  ----------
+  attr : dict, DataFrame or PanelAccumulator
+    Either {key: {field: value}} (FRAME_LAYOUT) or
+    {item: {minor: {field: value}}} (PANEL_LAYOUT). Long DataFrames are
+    returned as is, and accumulators are converted with to_long_frame.
+  layout : str
+    FRAME_LAYOUT or PANEL_LAYOUT
+
+  Returns
+  ----------
+  pandas.DataFrame
+
+  """
+  if isinstance(attr, pd.DataFrame):
+    return attr
+  if hasattr(attr, 'to_long_frame'):
+    return attr.to_long_frame()
+  if layout == PANEL_LAYOUT:
+    keys, rows = [], []
+    for item, records in attr.iteritems():
+      for minor, record in records.iteritems():
+        keys.append((item, minor))
+        rows.append(record)
+    if not keys:
+      return pd.DataFrame()
+    index = pd.MultiIndex.from_tuples(keys, names=PANEL_INDEX_NAMES)
+    return pd.DataFrame(rows, index=index)
+  if not attr:
+    return pd.DataFrame()
+  return pd.DataFrame(attr.values(), index=attr.keys())
+
+
+def from_long_frame(df, layout):
+  """Inverse of long_frame: returns the Panel or wide DataFrame that
+  records2table writes in the fixed format.
+
+  """
+  if layout == PANEL_LAYOUT:
+    if df.empty:
+      return pd.Panel()
+    p = df.sort_index().to_panel().transpose(1, 0, 2)
+    p.major_axis.name = None
+    p.minor_axis.name = None
+    p.items.name = None
+    return p
+  if layout == FRAME_LAYOUT:
+    return df.sort_index().T
+  return df
+
+
+def read_table(store, key):
+  """Reads a table from a records2table HDF5 store, returning it in the
+  fixed-format layout whether or not it was streamed.
+
+  Parameters
+  ----------
+  store : pandas.HDFStore
+    Pandas HDFStore
+  key : str
+    Table key
+
+  Returns
+  ----------
+  pandas.Panel or pandas.DataFrame
+
+  """
+  storer = store.get_storer(key)
+  if not storer.is_table:
+    return store[key]
+  layout = getattr(storer.attrs, LAYOUT_ATTR, None)
+  parts = [key] + list(getattr(storer.attrs, PARTS_ATTR, []))
+  df = pd.concat([_decode(store.select(part),
+                          getattr(store.get_storer(part).attrs, REPR_ATTR,
+                                  []))
+                  for part in parts])
+  return from_long_frame(df, layout)
+
+
+def table_keys(store):
+  """Returns the keys of the tables of a store, leaving out the side
+  tables of streamed tables (see ChunkedTableWriter).
+
+  """
+  return [key for key in store.keys() if not key.startswith(PARTS_GROUP)]
+
+
+def _is_missing(v):
+  return v is None or (isinstance(v, float) and np.isnan(v))
+
+
+def _normalize_chunk(df, repr_columns=()):
+  """Coerces a chunk to dtypes that can be appended consistently: every
+  numeric or boolean column becomes float64 (as it would in a Panel),
+  string columns stay strings, and columns of any other values (or in
+  repr_columns) hold their reprs, so that _decode can restore them.
+  Missing values are NaN, whatever the column.
+
+  Returns
+  ----------
+  (pandas.DataFrame, set)
+    The chunk, and its columns of reprs
+
+  """
+  reprs = set()
+  for col in df.columns:
+    kind = df[col].dtype.kind
+    if kind in 'biuf':
+      df[col] = df[col].astype(np.float64)
+    elif kind == 'M':
+      continue
+    elif col in repr_columns or not all(_is_missing(v) or
+                                        isinstance(v, basestring)
+                                        for v in df[col]):
+      df[col] = df[col].apply(lambda v: np.nan if _is_missing(v) else repr(v))
+      reprs.add(col)
+    else:
+      df[col] = df[col].apply(lambda v: np.nan if _is_missing(v) else v)
+  return df, reprs
+
+
+def _decode(df, repr_columns):
+  """Inverse of the repr encoding of _normalize_chunk."""
+  for col in repr_columns:
+    if col in df.columns:
+      df[col] = df[col].apply(lambda v: ast.literal_eval(v)
+                              if isinstance(v, basestring) else v)
+  return df
+
+
+def _string_width(df):
+  return max([0] + [len(v) for col in df.columns
+                    if df[col].dtype == np.object_
+                    for v in df[col] if isinstance(v, basestring)])
+
+
+def _reindex(df, columns, dtypes):
+  """Returns a normalized chunk with the given columns, giving those that
+  are all missing from it the given dtypes (float or string), so that
+  they match the table they're appended to.
+
+  """
+  df = df.reindex(columns=columns)
+  for col in columns:
+    dtype = dtypes.get(col)
+    if dtype is not None and np.dtype(dtype).kind in 'fO' \
+       and df[col].dtype != dtype and df[col].isnull().all():
+      df[col] = df[col].astype(dtype)
+  return df
+
+
+class _Part(object):
+  """The columns, dtypes, repr columns and string width of a table, or
+  of one of its side tables, as ChunkedTableWriter appends to them.
+
+  """
+
+  def __init__(self, key, columns, dtypes, reprs, itemsize):
+    self.key = key
+    self.columns = columns
+    self.dtypes = dict(dtypes.iteritems())
+    self.reprs = reprs
+    self.itemsize = itemsize
+
+  def conform(self, df, reprs):
+    """Returns a normalized chunk with the columns of the table, or None
+    if it can't be appended to it.
+
+    """
+    if not set(df.columns) <= set(self.columns) \
+       or not reprs <= self.reprs \
+       or _string_width(df) > self.itemsize:
+      return None
+    df = _reindex(df, self.columns, self.dtypes)
+    if any(df[col].dtype != self.dtypes[col] for col in self.columns):
+      return None
+    return df
+
+
+class ChunkedTableWriter(object):
+  """Appends chunks of records to an HDF5 store as they are produced.
+
+  Appendable tables can't grow new columns, change the type of a column
+  or widen their string columns, so a chunk that needs any of that is
+  appended to a new side table instead, under PARTS_GROUP, with the
+  columns of the table and the chunk, which then takes the chunks that
+  fit it. The side tables of a table are listed in its storer attributes,
+  and read_table reads them along with it. Nothing written is read back
+  or rewritten, so memory doesn't grow with the log.
+
+  Missing values are NaN, stored as NAN_REP in string columns, as they
+  are in tables that aren't streamed.
+
+  Parameters
+  ----------
+  filename : str
+    Output HDF5 filename.
+  chunk_size : int
+    Number of messages to accumulate between flushes.
+  mode : str, optional
+    'w' (default) overwrites an existing file. 'a' appends to the tables
+    already in it.
+
+  """
+
+  def __init__(self, filename, chunk_size, mode='w'):
+    self.filename = filename
+    self.chunk_size = chunk_size
+    self.store = pd.HDFStore(filename, mode=mode)
+    self.parts = {}
+    for key in table_keys(self.store):
+      storer = self.store.get_storer(key)
+      if storer.is_table and storer.nrows:
+        key = key.lstrip('/')
+        self.parts[key] = [self._load_part(part) for part in
+                           [key] + list(getattr(storer.attrs, PARTS_ATTR, []))]
+
+  def _load_part(self, key):
+    attrs = self.store.get_storer(key).attrs
+    first = self.store.select(key, stop=1)
+    return _Part(key, list(first.columns), first.dtypes,
+                 set(getattr(attrs, REPR_ATTR, [])),
+                 getattr(attrs, ITEMSIZE_ATTR, STRING_ITEMSIZE))
+
+  def append(self, key, attr, layout):
+    """Appends nested record dicts to the table under key.
+
+    """
+    df = long_frame(attr, layout)
+    if df.empty:
+      return
+    parts = self.parts.get(key)
+    if parts is None:
+      df, reprs = _normalize_chunk(df)
+      self.parts[key] = [self._create(key, df, layout, reprs)]
+      return
+    old_reprs = set().union(*[part.reprs for part in parts])
+    df, reprs = _normalize_chunk(df, old_reprs)
+    for part in parts:
+      conformed = part.conform(df, reprs)
+      if conformed is not None:
+        self.store.append(part.key, conformed, index=False, nan_rep=NAN_REP)
+        return
+    columns = list(df.columns)
+    dtypes = {}
+    for part in reversed(parts):
+      columns += [col for col in part.columns if col not in columns]
+      dtypes.update(part.dtypes)
+    side_key = '%s/%s_%d' % (PARTS_GROUP.strip('/'), key, len(parts))
+    parts.append(self._create(side_key, _reindex(df, columns, dtypes),
+                              layout, reprs | old_reprs))
+    setattr(self.store.get_storer(key).attrs, PARTS_ATTR,
+            [part.key for part in parts[1:]])
+
+  def _create(self, key, df, layout, reprs):
+    """Writes a normalized frame as a new table under key, replacing any
+    fixed-format placeholder that's there, e.g. a table that was empty,
+    and returns its _Part.
+
+    """
+    if key in self.store:
+      self.store.remove(key)
+    itemsize = max(STRING_ITEMSIZE, _string_width(df))
+    min_itemsize = dict((str(col), itemsize) for col in df.columns
+                        if df[col].dtype == np.object_)
+    for i, name in enumerate(df.index.names):
+      level = df.index.get_level_values(i)
+      if level.dtype == np.object_:
+        min_itemsize[name or 'index'] = STRING_ITEMSIZE
+    self.store.append(key, df, index=False,
+                      min_itemsize=min_itemsize or None, nan_rep=NAN_REP)
+    reprs = set(reprs) & set(df.columns)
+    attrs = self.store.get_storer(key).attrs
+    setattr(attrs, LAYOUT_ATTR, layout)
+    setattr(attrs, REPR_ATTR, sorted(reprs))
+    setattr(attrs, ITEMSIZE_ATTR, itemsize)
+    return _Part(key, list(df.columns), df.dtypes, reprs, itemsize)
+
+  def put(self, key, value):
+    """Writes a whole, fixed-format table.
+
+    """
+    self.store.put(key, value)
+
+  def has_table(self, key):
+    return key in self.parts
+
+  def get_attr(self, name, default=None):
+    """Returns an attribute of the store's root group.
+
+    """
+    return getattr(self.store._handle.root._v_attrs, name, default)
+
+  def set_attr(self, name, value):
+    setattr(self.store._handle.root._v_attrs, name, value)
+
+  def close(self):
+    for parts in self.parts.values():
+      for part in parts:
+        self.store.create_table_index(part.key, optlevel=9, kind='full')
+    self.store.close()
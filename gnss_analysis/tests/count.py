@@ -19,7 +19,9 @@ class CountA(Analysis):
       key='count',
       keep_as_fold=True,
       keep_as_map=keep_as_map,
-      fold_init=0)
+      fold_init=0,
+      map_shape=(),
+      map_dtype=int)
   def compute(self, datum, current_analyses, prev_fold, parameters):
     return prev_fold['count'] + 1
 
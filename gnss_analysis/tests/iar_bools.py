@@ -89,9 +89,8 @@ class FixedIARLeastSquareInPool(Analysis):
 
   def compute(self, data, current_analyses, prev_fold, parameters):
     if current_analyses['FixedIARBegun'] and mgmt.dgnss_iar_num_sats() >= 4:
-      dat = data.apply(ut.mk_swiftnav_sdiff, axis=0).dropna()
       iar_de, iar_phase = mgmt.get_iar_de_and_phase(
-        dat, parameters.rover_ecef + 0.5 * parameters.known_baseline)
+        data.sdiffs, parameters.rover_ecef + 0.5 * parameters.known_baseline)
       ia_vec_from_b = ut.get_N_from_b(iar_phase,
                                       iar_de,
                                       parameters.known_baseline)
@@ -111,9 +110,8 @@ class FixedIARLeastSquareStartedInPool(Analysis):
 
   def compute(self, data, current_analyses, prev_fold, parameters):
     if current_analyses['FixedIARBegun'] and not prev_fold['FixedIARBegun']:
-      dat = data.apply(ut.mk_swiftnav_sdiff, axis=0).dropna()
       iar_de, iar_phase = mgmt.get_iar_de_and_phase(
-        dat, parameters.rover_ecef + 0.5 * parameters.known_baseline)
+        data.sdiffs, parameters.rover_ecef + 0.5 * parameters.known_baseline)
       ia_vec_from_b = ut.get_N_from_b(iar_phase,
                                       iar_de,
                                       parameters.known_baseline)
@@ -134,9 +132,8 @@ class FixedIARLeastSquareEndedInPool(Analysis):
 
   def compute(self, data, current_analyses, prev_fold, parameters):
     if current_analyses['FixedIARCompleted'] and not prev_fold['FixedIARCompleted']:
-      dat = data.apply(ut.mk_swiftnav_sdiff, axis=0).dropna()
       iar_de, iar_phase = mgmt.get_iar_de_and_phase(
-        dat, parameters.rover_ecef + 0.5 * parameters.known_baseline)
+        data.sdiffs, parameters.rover_ecef + 0.5 * parameters.known_baseline)
       ia_vec_from_b = ut.get_N_from_b(iar_phase,
                                       iar_de,
                                       parameters.known_baseline)
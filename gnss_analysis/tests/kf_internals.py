@@ -38,7 +38,9 @@ class KFNumSats(Analysis):
   def __init__(self):
     super(KFNumSats, self).__init__(
       key='KFNumSats',
-      keep_as_map=True)
+      keep_as_map=True,
+      map_shape=(),
+      map_dtype=int)
   def compute(self, data, current_analyses, prev_fold, parameters):
     prns = mgmt.get_sats_management()[1]
     if len(prns) < 2:
@@ -52,7 +54,8 @@ class KFMean(Analysis):
   def __init__(self):
     super(KFMean, self).__init__(
       key='KFMean',
-      keep_as_map=True)
+      keep_as_map=True,
+      map_shape=(None,))
   def compute(self, data, current_analyses, prev_fold, parameters):
     return mgmt.get_amb_kf_mean()
 
@@ -63,7 +66,8 @@ class KFCov(Analysis):
   def __init__(self):
     super(KFCov, self).__init__(
       key='KFCov',
-      keep_as_map=True)
+      keep_as_map=True,
+      map_shape=(None, None))
   def compute(self, data, current_analyses, prev_fold, parameters):
     return mgmt.get_amb_kf_cov2()
 
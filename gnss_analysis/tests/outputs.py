@@ -12,7 +12,6 @@
 from gnss_analysis.abstract_analysis.analysis import *
 from gnss_analysis.abstract_analysis.report import *
 import numpy as np
-import gnss_analysis.utils as ut
 import swiftnav.dgnss_management as mgmt
 from swiftnav.dgnss_management import AmbiguityState
 
@@ -38,11 +37,11 @@ class FloatBaselineA(Analysis):
   def __init__(self):
     k = 'FloatBaseline'
     super(FloatBaselineA, self).__init__(key=k, keep_as_map=True,
-      parents=set([AmbiguityStateA()]))
+      parents=set([AmbiguityStateA()]), map_shape=(3,))
 
   def compute(self, data, current_analyses, prev_fold, parameters):
-    d = data.apply(ut.mk_swiftnav_sdiff, axis=0).dropna()
-    flag, _, b = mgmt.dgnss_float_baseline(d, parameters.rover_ecef, current_analyses['AmbiguityState'])
+    flag, _, b = mgmt.dgnss_float_baseline(data.sdiffs, parameters.rover_ecef,
+                                        current_analyses['AmbiguityState'])
     if flag != 0:
       return np.array([np.nan, np.nan, np.nan])
     return b
@@ -70,11 +69,11 @@ class FixedBaselineA(Analysis):
   def __init__(self):
     k = 'FixedBaseline'
     super(FixedBaselineA, self).__init__(key=k, keep_as_map=True,
-      parents=set([AmbiguityStateA()]))
+      parents=set([AmbiguityStateA()]), map_shape=(3,))
 
   def compute(self, data, current_analyses, prev_fold, parameters):
-    d = data.apply(ut.mk_swiftnav_sdiff, axis=0).dropna()
-    flag, _, b = mgmt.dgnss_fixed_baseline(d, parameters.rover_ecef, current_analyses['AmbiguityState'])
+    flag, _, b = mgmt.dgnss_fixed_baseline(data.sdiffs, parameters.rover_ecef,
+                                        current_analyses['AmbiguityState'])
     if flag != 0:
       return np.array([np.nan, np.nan, np.nan])
     return b
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Bhaskar Mookerji <mookerji@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+"""Reading of raw, framed SBP binary captures.
+
+Each SBP frame is a 0x55 preamble, a little-endian message type, sender
+and payload length, the payload, and a CRC-16 (CCITT) of everything
+between the preamble and the CRC. Captures are memory-mapped and scanned
+frame by frame. A frame with a bad CRC or a truncated frame is skipped by
+searching for the next preamble after its start, so a corrupt stretch of
+the capture only loses the frames it overlaps.
+
+Unlike JSON logs, binary captures carry no host timestamps. Records are
+given a host offset (delta) of the milliseconds of GPS time since the
+capture's first MsgGPSTime, or 0 before it, and a NaN host time.
+
+"""
+
+from gnss_analysis.tools.log_reader import GPS_TIME_ID
+from sbp.msg import SBP
+from sbp.table import dispatch
+import binascii
+import mmap
+import os
+import struct
+import warnings
+
+SBP_PREAMBLE = 0x55
+
+# Preamble, message type, sender and length.
+HEADER = struct.Struct('<BHHB')
+CRC = struct.Struct('<H')
+
+MAX_FRAME_SIZE = HEADER.size + 255 + CRC.size
+
+MSEC_PER_WEEK = 7 * 24 * 3600 * 1000
+
+# Bytes at the start of a log in which is_binary_log looks for a frame.
+SNIFF_BYTES = 4096
+
+
+def crc16(data, crc=0):
+  """Returns the CRC-16 (CCITT, as used by SBP) of a byte string.
+
+  """
+  # binascii's CRC-CCITT is SBP's, computed in C.
+  return binascii.crc_hqx(data, crc)
+
+
+def pack_frame(msg_type, sender, payload):
+  """Returns the SBP frame of a message payload.
+
+  """
+  header = HEADER.pack(SBP_PREAMBLE, msg_type, sender, len(payload))
+  return header + payload + CRC.pack(crc16(header[1:] + payload))
+
+
+def _frame_end(buf, start):
+  """Returns the end of the frame at start in buf, or None if it isn't a
+  whole frame with a valid CRC.
+
+  """
+  end = start + HEADER.size
+  if end > len(buf):
+    return None
+  end += ord(buf[end - 1]) + CRC.size
+  if end > len(buf):
+    return None
+  crc, = CRC.unpack(buf[end - CRC.size:end])
+  return end if crc16(buf[start + 1:end - CRC.size]) == crc else None
+
+
+def is_binary_log(log_datafile):
+  """Returns whether a log is a binary SBP capture rather than a JSON log:
+  whether a frame with a valid CRC, followed by another (or the end of
+  the log), starts in its first SNIFF_BYTES bytes. Captures may start
+  mid-frame.
+
+  """
+  with open(log_datafile, 'rb') as f:
+    buf = f.read(SNIFF_BYTES + 2 * MAX_FRAME_SIZE)
+  preamble = chr(SBP_PREAMBLE)
+  start = buf.find(preamble)
+  while 0 <= start < SNIFF_BYTES:
+    end = _frame_end(buf, start)
+    # A CRC can match by chance, so the next frame has to as well.
+    if end is not None and (end == len(buf) or
+                            _frame_end(buf, end) is not None):
+      return True
+    start = buf.find(preamble, start + 1)
+  return False
+
+
+class FrameReader(object):
+  """Iterates over the frames of a binary SBP capture, counting the
+  corrupt frames and bytes it skips.
+
+  Parameters
+  ----------
+  log_datafile : str
+    Binary SBP capture filename
+
+  """
+
+  def __init__(self, log_datafile):
+    self.log_datafile = log_datafile
+    self.n_frames = 0
+    self.n_crc_errors = 0
+    self.n_skipped_bytes = 0
+
+  def frames(self):
+    """Yields (msg_type, sender, payload, crc) for each valid frame.
+
+    """
+    with open(self.log_datafile, 'rb') as f:
+      if os.fstat(f.fileno()).st_size == 0:
+        return
+      buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+      try:
+        for frame in self._scan(buf):
+          yield frame
+      finally:
+        buf.close()
+
+  def _scan(self, buf):
+    preamble = chr(SBP_PREAMBLE)
+    size = len(buf)
+    pos = 0
+    while True:
+      start = buf.find(preamble, pos)
+      if start < 0:
+        self.n_skipped_bytes += size - pos
+        return
+      self.n_skipped_bytes += start - pos
+      end = start + HEADER.size
+      if end > size:
+        self.n_skipped_bytes += size - start
+        return
+      _, msg_type, sender, length = HEADER.unpack(buf[start:end])
+      end += length + CRC.size
+      if end > size:
+        # Truncated, or a corrupt length: look for a frame inside it.
+        self.n_skipped_bytes += 1
+        pos = start + 1
+        continue
+      body = buf[start + 1:end - CRC.size]
+      crc, = CRC.unpack(buf[end - CRC.size:end])
+      if crc16(body) != crc:
+        self.n_crc_errors += 1
+        self.n_skipped_bytes += 1
+        pos = start + 1
+        continue
+      self.n_frames += 1
+      pos = end
+      yield msg_type, sender, body[HEADER.size - 1:], crc
+
+
+def iter_binary_records(log_datafile, record_filter=None, num_records=None):
+  """Iterates over a binary SBP capture, yielding (msg, data) pairs like
+  log_reader.iter_records, where data has the 'delta' and 'timestamp' of
+  the record and its 'msg_type'.
+
+  Parameters
+  ----------
+  log_datafile : str
+    Binary SBP capture filename
+  record_filter : RecordFilter, optional
+    Selects which records to decode. Host time windows aren't supported.
+  num_records : int, optional
+    Stop after reading this many frames, whether or not they were
+    accepted.
+
+  """
+  if record_filter is not None and (record_filter.host_start is not None or
+                                    record_filter.host_end is not None):
+    raise ValueError("Binary SBP captures have no host times.")
+  reader = FrameReader(log_datafile)
+  first_gps_ms = None
+  delta = 0
+  for i, (msg_type, sender, payload, crc) in enumerate(reader.frames()):
+    if num_records is not None and i >= num_records:
+      break
+    msg = None
+    if msg_type == GPS_TIME_ID:
+      msg = dispatch(SBP(msg_type, sender, len(payload), payload, crc))
+      gps_ms = msg.wn * MSEC_PER_WEEK + msg.tow
+      if first_gps_ms is None:
+        first_gps_ms = gps_ms
+      delta = gps_ms - first_gps_ms
+      if record_filter is not None and record_filter.needs_gps_time:
+        record_filter.update_gps_time({'data': {'wn': msg.wn,
+                                                'tow': msg.tow}})
+    if record_filter is not None \
+       and not record_filter.accepts(msg_type, None):
+      if record_filter.done:
+        break
+      continue
+    if msg is None:
+      msg = dispatch(SBP(msg_type, sender, len(payload), payload, crc))
+    yield msg, {'delta': delta,
+                'timestamp': float('nan'),
+                'data': {'msg_type': msg_type, 'sender': sender}}
+  if reader.n_crc_errors or reader.n_skipped_bytes:
+    warnings.warn("Skipped %d bytes of %s, including %d frames with bad CRCs."
+                  % (reader.n_skipped_bytes, log_datafile,
+                     reader.n_crc_errors))
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Bhaskar Mookerji <mookerji@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+"""Follows a growing HITL JSON log, appending its new records to a
+streamed records2table HDF5 store.
+
+The byte offset of the last complete record converted is kept in the
+store, so following can be stopped and resumed later. Each read appends
+the new records to the tables, as with records2table --stream, and
+decorates the tables that interpolate.py would with an approx_gps_time
+column. The table writer only appends, never going back over what it's
+written (see table_io.ChunkedTableWriter), so approx_gps_time is
+interpolated from the single point solutions received so far, and is NaT
+for records appended before there were any. Ephemeris tables are
+rewritten in full without approx_gps_time, and reindex_tables isn't
+applied.
+
+"""
+
+from gnss_analysis.hitl_table_utils import GPS_TIME_TABS, MSEC_TO_SEC, \
+  interpolate_gpst_model
+from gnss_analysis.table_io import ChunkedTableWriter, long_frame, read_table
+from gnss_analysis.tools.log_reader import follow_records
+from gnss_analysis.tools.records2table import StoreToHDF5, \
+  DEFAULT_CHUNK_SIZE, DEFAULT_FOLLOW_INTERVAL, UNSTREAMED_TABLES, from_table
+import os
+import pandas as pd
+import time
+
+# Root attribute of the store holding the byte offset converted so far.
+OFFSET_ATTR = 'follow_offset'
+
+GPST_COL = 'approx_gps_time'
+
+
+class GPSTimeInterpolator(object):
+  """Interpolates GPS times from host log offsets, using the same linear
+  model as get_gps_time_col, refit as single point solutions arrive.
+
+  """
+
+  def __init__(self):
+    self.gps_times = []
+    self.host_offsets = []
+    self.model = None
+    self.init_date = None
+
+  def update(self, gps_times, host_offsets):
+    """Adds single point solution times and their host offsets (msec), and
+    refits the model.
+
+    """
+    self.gps_times.extend(gps_times)
+    self.host_offsets.extend(host_offsets)
+    if len(self.gps_times) < 2:
+      return
+    idx = pd.DataFrame({'index': self.gps_times,
+                        'host_offset': self.host_offsets})
+    idx = idx.sort('index').reset_index(drop=True)
+    self.model = interpolate_gpst_model(idx)
+    self.init_date = pd.Timestamp(idx['index'][0])
+
+  def apply(self, host_offsets):
+    """Returns the GPS times of a Series of host offsets (msec).
+
+    """
+    if self.model is None:
+      return pd.Series(pd.NaT, index=host_offsets.index,
+                       dtype='datetime64[ns]')
+    gps_offset = self.model.beta.x * host_offsets * MSEC_TO_SEC \
+                 + self.model.beta.intercept
+    return self.init_date + pd.to_timedelta(gps_offset, unit='s')
+
+
+class InterpolatingTableWriter(ChunkedTableWriter):
+  """ChunkedTableWriter which adds approx_gps_time to the chunks of the
+  given tables, and follows rover_spp to fit the GPS time model.
+
+  """
+
+  def __init__(self, filename, chunk_size, interpolator, gps_time_tabs,
+               mode='w'):
+    super(InterpolatingTableWriter, self).__init__(filename, chunk_size, mode)
+    self.interpolator = interpolator
+    self.gps_time_tabs = set(gps_time_tabs)
+
+  def append(self, key, attr, layout):
+    df = long_frame(attr, layout)
+    if df.empty:
+      return
+    if key == 'rover_spp':
+      self.interpolator.update(df.index, df['host_offset'])
+    elif key in self.gps_time_tabs and 'host_offset' in df:
+      df[GPST_COL] = self.interpolator.apply(df['host_offset'])
+    super(InterpolatingTableWriter, self).append(key, df, layout)
+
+
+class LogFollower(object):
+  """Converts a JSON log to HDF5 incrementally as it grows.
+
+  If filename is a store written by a previous LogFollower, conversion
+  resumes from the offset recorded in it. Otherwise, it's overwritten.
+
+  Parameters
+  ----------
+  log_datafile : str
+    JSON log filename
+  filename : str
+    Output HDF5 filename
+  chunk_size : int, optional
+    Number of messages between flushes within a single read.
+  tables : list, optional
+    Only write these tables (see records2table.TABLES).
+  gps_time_tabs : list, optional
+    Tables to add approx_gps_time to.
+
+  """
+
+  def __init__(self, log_datafile, filename, chunk_size=DEFAULT_CHUNK_SIZE,
+               tables=None, gps_time_tabs=GPS_TIME_TABS):
+    self.log_datafile = log_datafile
+    self.filename = filename
+    self.chunk_size = chunk_size
+    self.gps_time_tabs = gps_time_tabs
+    self.processor = StoreToHDF5(tables=tables)
+    self.interpolator = GPSTimeInterpolator()
+    self.offset = 0
+    self.mode = 'w'
+    if os.path.isfile(filename):
+      with pd.HDFStore(filename, mode='r') as store:
+        offset = getattr(store._handle.root._v_attrs, OFFSET_ATTR, None)
+        if offset is not None:
+          self.offset = int(offset)
+          self.mode = 'a'
+          if 'rover_spp' in store:
+            spp = read_table(store, 'rover_spp').T
+            if not spp.empty:
+              self.interpolator.update(spp.index, spp.host_offset)
+          # The ephemeris tables are rewritten whole as they change, so
+          # they have to start from what's already stored.
+          for tab in UNSTREAMED_TABLES:
+            if tab in store:
+              setattr(self.processor, tab, from_table(store[tab]))
+
+  def _open(self):
+    writer = InterpolatingTableWriter(self.filename, self.chunk_size,
+                                      self.interpolator, self.gps_time_tabs,
+                                      mode=self.mode)
+    self.mode = 'a'
+    self.processor.writer = writer
+    return writer
+
+  def poll(self):
+    """Converts the records appended to the log since the last poll, and
+    returns how many there were.
+
+    """
+    if os.path.getsize(self.log_datafile) < self.offset:
+      raise ValueError("%s is shorter than the %d bytes already converted."
+                       % (self.log_datafile, self.offset))
+    writer = self._open()
+    n = 0
+    try:
+      for msg, data, offset in follow_records(self.log_datafile, self.offset):
+        self.processor.process_message(data['delta'], data['timestamp'], msg)
+        self.offset = offset
+        n += 1
+      self.processor.sync()
+      writer.set_attr(OFFSET_ATTR, self.offset)
+    finally:
+      writer.close()
+      self.processor.writer = None
+    return n
+
+  def finish(self):
+    """Writes the held back records and the remaining tables. Following
+    may still be resumed afterwards.
+
+    """
+    writer = self._open()
+    writer.set_attr(OFFSET_ATTR, self.offset)
+    self.processor.save(self.filename)
+    self.processor.writer = None
+
+
+def follow(log_datafile, filename, interval=DEFAULT_FOLLOW_INTERVAL,
+           chunk_size=DEFAULT_CHUNK_SIZE, tables=None, verbose=False):
+  """Follows a JSON log, appending its records to filename every interval
+  seconds until interrupted.
+
+  Parameters
+  ----------
+  log_datafile : str
+    JSON log filename
+  filename : str
+    Output HDF5 filename
+  interval : float, optional
+    Seconds between reads of the log
+  chunk_size : int, optional
+    Number of messages between flushes within a single read
+  tables : list, optional
+    Only write these tables
+  verbose : bool
+    Verbose output
+
+  """
+  follower = LogFollower(log_datafile, filename, chunk_size, tables)
+  if verbose and follower.offset:
+    print "Resuming %s at byte %d." % (log_datafile, follower.offset)
+  try:
+    while True:
+      n = follower.poll()
+      if verbose:
+        print "Appended %d records, up to byte %d." % (n, follower.offset)
+      time.sleep(interval)
+  except KeyboardInterrupt:
+    print "Stopping."
+  finally:
+    follower.finish()
+  return filename
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Bhaskar Mookerji <mookerji@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+"""Timing breakdown of a records2table conversion.
+
+For each message type, an IngestProfile counts the records and sums the
+time spent reading and decoding them (including skipping the filtered
+out records before them) and the time spent in their handler. For each
+table, it sums the time spent writing it, whether in flushes or in
+save(), and records its size on disk.
+
+"""
+
+from contextlib import contextmanager
+import json
+import tables
+import time
+
+
+class IngestProfile(object):
+  """Accumulates the timings of a conversion.
+
+  """
+
+  def __init__(self):
+    self.start = time.time()
+    self.msg_types = {}
+    self.tables = {}
+
+  def _msg_type(self, name):
+    return self.msg_types.setdefault(name, {'count': 0,
+                                            'decode_sec': 0.,
+                                            'handler_sec': 0.})
+
+  def _table(self, name):
+    return self.tables.setdefault(name, {'save_sec': 0., 'bytes': None})
+
+  def add_decode(self, name, sec):
+    t = self._msg_type(name)
+    t['count'] += 1
+    t['decode_sec'] += sec
+
+  def add_handler(self, name, sec):
+    self._msg_type(name)['handler_sec'] += sec
+
+  @contextmanager
+  def saving(self, name):
+    """Times the body of a with statement as saving table name.
+
+    """
+    start = time.time()
+    yield
+    self._table(name)['save_sec'] += time.time() - start
+
+  def measure_sizes(self, filename):
+    """Records the size on disk of each table of an HDF5 file.
+
+    """
+    with tables.open_file(filename, mode='r') as f:
+      for group in f.root._f_iter_nodes('Group'):
+        size = sum(leaf.size_on_disk
+                   for leaf in group._f_walknodes('Leaf'))
+        self._table(group._v_name)['bytes'] = size
+
+  def summary(self):
+    """Returns the profile as a dict of plain values.
+
+    """
+    return {'total_sec': time.time() - self.start,
+            'records': sum(t['count'] for t in self.msg_types.itervalues()),
+            'msg_types': self.msg_types,
+            'tables': self.tables}
+
+  def write(self, filename):
+    """Writes the summary as JSON.
+
+    """
+    with open(filename, 'w') as f:
+      json.dump(self.summary(), f, indent=2, sort_keys=True)
+
+  def report(self):
+    """Prints the summary, slowest message types first.
+
+    """
+    print "%-28s %8s %10s %10s" % ('msg_type', 'count', 'decode_s',
+                                   'handler_s')
+    for name, t in sorted(self.msg_types.iteritems(),
+                          key=lambda kv: -kv[1]['decode_sec']
+                          - kv[1]['handler_sec']):
+      print "%-28s %8d %10.3f %10.3f" % (name, t['count'], t['decode_sec'],
+                                         t['handler_sec'])
+    print "%-28s %10s %12s" % ('table', 'save_s', 'bytes')
+    for name, t in sorted(self.tables.iteritems(),
+                          key=lambda kv: -kv[1]['save_sec']):
+      print "%-28s %10.3f %12s" % (name, t['save_sec'], t['bytes'])
@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Bhaskar Mookerji <mookerji@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+"""Selective reading of JSON SBP logs.
+
+JSONLogIterator parses every line and builds a full SBP message for it.
+When only a few message types or a short time window are wanted, most
+of that work is thrown away. The reader here peeks at the message type
+and host time of each raw line before parsing it, so records that don't
+pass a RecordFilter are skipped without being decoded.
+
+The JSON records already hold the decoded message fields, so rebuilding
+the SBP message from the payload is mostly wasted as well. A
+LazyDecoder instead wraps the JSON fields in a JSONMessage, which
+handlers can read like the SBP message (through msg_class and
+msg_fields), and only builds SBP messages for the types it's told to.
+
+"""
+
+from gnss_analysis.constants import MSEC_TO_SECONDS
+from sbp.msg import SBP
+from sbp.table import dispatch, _SBP_TABLE
+from sbp.utils import exclude_fields
+import json
+import re
+import sbp.navigation as nav
+import swiftnav.gpstime as gpstime
+import warnings
+
+# SBP message type IDs, keyed by message class and by class name.
+MSG_TYPE_IDS = dict((cls, msg_type) for msg_type, cls in _SBP_TABLE.iteritems())
+MSG_TYPES_BY_NAME = dict((cls.__name__, cls) for cls in MSG_TYPE_IDS)
+
+_MSG_TYPE_RE = re.compile(r'"msg_type":\s*(\d+)')
+_TIMESTAMP_RE = re.compile(r'"timestamp":\s*([-+.\deE]+)')
+
+
+def msg_type_id(msg_type):
+  """Returns the numeric SBP message type of a message class, class name
+  or message type ID (e.g., nav.MsgPosLLH, 'MsgPosLLH', '0x201' or 513).
+
+  """
+  if isinstance(msg_type, (int, long)):
+    return msg_type
+  if isinstance(msg_type, basestring):
+    if msg_type in MSG_TYPES_BY_NAME:
+      return MSG_TYPE_IDS[MSG_TYPES_BY_NAME[msg_type]]
+    try:
+      return int(msg_type, 0)
+    except ValueError:
+      raise ValueError("Unknown SBP message type: %s" % msg_type)
+  return MSG_TYPE_IDS[msg_type]
+
+
+def peek(line):
+  """Returns the message type and host timestamp of a raw JSON log line
+  without parsing it, or (None, None) if they can't be found.
+
+  """
+  msg_type = _MSG_TYPE_RE.search(line)
+  timestamp = _TIMESTAMP_RE.search(line)
+  if msg_type is None or timestamp is None:
+    return None, None
+  return int(msg_type.group(1)), float(timestamp.group(1))
+
+
+def decode(item):
+  """Builds the SBP message for a parsed JSON log record.
+
+  """
+  return dispatch(SBP.from_json_dict(dict(item['data'])))
+
+
+# SBP framing fields of JSON records, which aren't message fields.
+FRAMING_FIELDS = frozenset(['sender', 'msg_type', 'crc', 'length',
+                            'preamble', 'payload'])
+
+
+class Struct(dict):
+  """Dict of decoded JSON fields, which are also readable as attributes,
+  like the construct Containers of SBP messages.
+
+  """
+
+  __slots__ = ()
+
+  def __getattr__(self, name):
+    try:
+      return self[name]
+    except KeyError:
+      raise AttributeError(name)
+
+
+def _from_json(value):
+  if isinstance(value, dict):
+    return Struct((k, _from_json(v)) for k, v in value.iteritems())
+  if isinstance(value, list):
+    return [_from_json(v) for v in value]
+  if isinstance(value, unicode):
+    return value.encode('utf-8')
+  return value
+
+
+class JSONMessage(object):
+  """Stands in for the SBP message of a JSON log record, reading its
+  fields from the record instead of decoding the payload.
+
+  Parameters
+  ----------
+  sbp_class : class
+    SBP message class of the record
+  data : dict
+    The record's 'data' dict
+
+  """
+
+  def __init__(self, sbp_class, data):
+    self.sbp_class = sbp_class
+    self.data = data
+
+  def __getattr__(self, name):
+    try:
+      return _from_json(self.data[name])
+    except KeyError:
+      raise AttributeError(name)
+
+  def fields(self):
+    """Returns the message fields, like sbp.utils.exclude_fields.
+
+    """
+    return dict((k, _from_json(v)) for k, v in self.data.iteritems()
+                if k not in FRAMING_FIELDS)
+
+
+def msg_class(msg):
+  """Returns the SBP message class of an SBP message or JSONMessage.
+
+  """
+  if isinstance(msg, JSONMessage):
+    return msg.sbp_class
+  return type(msg)
+
+
+def msg_fields(msg):
+  """Returns the fields of an SBP message or JSONMessage as a dict.
+
+  """
+  if isinstance(msg, JSONMessage):
+    return msg.fields()
+  return exclude_fields(msg)
+
+
+class LazyDecoder(object):
+  """Record decoder for iter_records which returns JSONMessages, except
+  for the given message types and for messages with nested fields of
+  types it doesn't know to be handled, which are fully decoded.
+
+  Parameters
+  ----------
+  decode_types : iterable, optional
+    Message types to fully decode (see msg_type_id).
+  handled_types : iterable, optional
+    Message types whose handlers read nested fields through msg_class
+    and msg_fields.
+
+  """
+
+  def __init__(self, decode_types=(), handled_types=()):
+    self.decode_types = set(msg_type_id(t) for t in decode_types)
+    self.handled_types = set(msg_type_id(t) for t in handled_types)
+
+  def __call__(self, item):
+    data = item['data']
+    msg_type = data['msg_type']
+    sbp_class = _SBP_TABLE.get(msg_type)
+    if sbp_class is None or msg_type in self.decode_types:
+      return decode(item)
+    if msg_type not in self.handled_types:
+      for k, v in data.iteritems():
+        if isinstance(v, (dict, list)):
+          return decode(item)
+    return JSONMessage(sbp_class, data)
+
+
+class RecordFilter(object):
+  """Selects log records by message type and time window.
+
+  GPS time isn't known until a record is decoded, so the filter follows
+  MsgGPSTime messages and applies the GPS time window using the latest
+  GPS time it has seen. Records before the first MsgGPSTime are rejected
+  if a GPS time window is given. Both windows are closed intervals, and
+  either end may be None.
+
+  Parameters
+  ----------
+  msg_types : iterable, optional
+    Message types to keep (see msg_type_id). All types by default.
+  host_time_window : (float, float), optional
+    Host UNIX epoch (UTC) window, compared with the record timestamps.
+  gps_time_window : (datetime, datetime), optional
+    GPS time window.
+
+  """
+
+  def __init__(self, msg_types=None, host_time_window=None,
+               gps_time_window=None):
+    if msg_types is None:
+      self.msg_types = None
+    else:
+      self.msg_types = set(msg_type_id(t) for t in msg_types)
+    self.host_start, self.host_end = host_time_window or (None, None)
+    self.gps_start, self.gps_end = gps_time_window or (None, None)
+    self.gps_time = None
+    self.done = False
+
+  def _in_window(self, t, start, end):
+    if end is not None and t > end:
+      # Logs are in time order, so nothing after this can match.
+      self.done = True
+      return False
+    return start is None or t >= start
+
+  def accepts(self, msg_type, timestamp):
+    """Returns whether a record with the given message type and host
+    timestamp should be decoded.
+
+    """
+    if not self._in_window(timestamp, self.host_start, self.host_end):
+      return False
+    if self.needs_gps_time:
+      if self.gps_time is None:
+        return False
+      if not self._in_window(self.gps_time, self.gps_start, self.gps_end):
+        return False
+    return self.msg_types is None or msg_type in self.msg_types
+
+  def update_gps_time(self, item):
+    data = item['data']
+    self.gps_time = gpstime.gpst_components2datetime(
+      data['wn'], data['tow'] / MSEC_TO_SECONDS)
+
+  @property
+  def needs_gps_time(self):
+    return self.gps_start is not None or self.gps_end is not None
+
+
+GPS_TIME_ID = msg_type_id(nav.MsgGPSTime)
+
+
+def iter_records(log_datafile, record_filter=None, num_records=None,
+                 decoder=decode):
+  """Iterates over a JSON log, yielding (msg, data) pairs like
+  JSONLogIterator.next(), but only for records accepted by the filter.
+
+  Parameters
+  ----------
+  log_datafile : str
+    JSON log filename
+  record_filter : RecordFilter, optional
+    Selects which records to decode. All of them by default.
+  num_records : int, optional
+    Stop after reading this many records from the log, whether or not
+    they were accepted.
+  decoder : function, optional
+    Makes the message of a parsed record, e.g. a LazyDecoder. Defaults
+    to building the SBP message.
+
+  """
+  with open(log_datafile, 'r') as f:
+    for i, line in enumerate(f):
+      if num_records is not None and i >= num_records:
+        break
+      item = None
+      if record_filter is not None:
+        msg_type, timestamp = peek(line)
+        if msg_type is None:
+          item = _parse(line, i)
+          if item is None:
+            continue
+          msg_type, timestamp = item['data']['msg_type'], item['timestamp']
+        if msg_type == GPS_TIME_ID and record_filter.needs_gps_time:
+          item = item or _parse(line, i)
+          if item is None:
+            continue
+          record_filter.update_gps_time(item)
+        if not record_filter.accepts(msg_type, timestamp):
+          if record_filter.done:
+            break
+          continue
+      item = item or _parse(line, i)
+      if item is not None:
+        yield decoder(item), item
+
+
+def _parse(line, i):
+  try:
+    return json.loads(line)
+  except ValueError:
+    warnings.warn("Skipping unreadable log record %d." % i)
+    return None
+
+
+def follow_records(log_datafile, offset=0):
+  """Iterates over the complete records of a JSON log from byte offset
+  onwards, yielding (msg, data, offset) where offset is just past the
+  record. A partly written final line is left for the next call.
+
+  Parameters
+  ----------
+  log_datafile : str
+    JSON log filename
+  offset : int, optional
+    Byte offset to start reading from, at the start of a line.
+
+  """
+  with open(log_datafile, 'rb') as f:
+    f.seek(offset)
+    for i, line in enumerate(iter(f.readline, '')):
+      if not line.endswith('\n'):
+        break
+      offset += len(line)
+      item = _parse(line, i)
+      if item is not None:
+        yield decode(item), item, offset
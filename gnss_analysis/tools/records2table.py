@@ -38,9 +38,18 @@ File path: data/serial-link-20150506-175750.log.json.fake.hdf5
 
 """
 
+from gnss_analysis.accumulators import PanelAccumulator
 from gnss_analysis.constants import *
+from gnss_analysis.table_io import ChunkedTableWriter, FRAME_LAYOUT, PANEL_LAYOUT
+from gnss_analysis.tools.binary_reader import is_binary_log, \
+  iter_binary_records
+from gnss_analysis.tools.ingest_profile import IngestProfile
+from gnss_analysis.tools.log_reader import LazyDecoder, RecordFilter, \
+  iter_records, msg_class, msg_fields
+from contextlib import contextmanager
+from itertools import islice
 from sbp.client.loggers.json_logger import JSONLogIterator
-from sbp.utils import exclude_fields, walk_json_dict
+from sbp.utils import walk_json_dict
 import os
 import pandas as pd
 import sbp.acquisition as acq
@@ -65,25 +74,71 @@ warnings.filterwarnings('ignore', category=pd.io.pytables.PerformanceWarning)
 # deterministic sequence count offset for each run of coincident logs.
 SEQ_INTERVAL = 0.05
 
-SPECIALLY_HANDLED_TYPES = [ob.MsgObs,
-                           ob.MsgObsDepA,
-                           ob.MsgEphemeris,
-                           ob.MsgEphemerisDepA,
-                           ob.MsgEphemerisDepB,
-                           nav.MsgPosECEF,
-                           nav.MsgPosLLH,
-                           nav.MsgBaselineNED,
-                           nav.MsgBaselineECEF,
-                           tr.MsgTrackingState,
-                           tr.MsgTrackingStateDepA,
-                           piksi.MsgIarState,
-                           lg.MsgLog,
-                           lg.MsgPrintDep,
-                           piksi.MsgThreadState,
-                           piksi.MsgUartState,
-                           acq.MsgAcqResult,
-                           acq.MsgAcqResultDepA
-                           ]
+# Version of the records2table output. Bump it when the tables written for
+# a given log change, so that logs converted before are converted again.
+INGEST_VERSION = 1
+
+# Output tables, in the order they're written, and whether each is stored as
+# a Panel or a DataFrame.
+TABLES = [('base_obs', PANEL_LAYOUT),
+          ('base_obs_integrity', FRAME_LAYOUT),
+          ('rover_obs', PANEL_LAYOUT),
+          ('rover_obs_integrity', FRAME_LAYOUT),
+          ('ephemerides', PANEL_LAYOUT),
+          ('rover_ephemerides', PANEL_LAYOUT),
+          ('base_ephemerides', PANEL_LAYOUT),
+          ('rover_spp', FRAME_LAYOUT),
+          ('rover_llh', FRAME_LAYOUT),
+          ('rover_rtk_ned', FRAME_LAYOUT),
+          ('rover_rtk_ecef', FRAME_LAYOUT),
+          ('rover_tracking', PANEL_LAYOUT),
+          ('rover_iar_state', FRAME_LAYOUT),
+          ('rover_logs', FRAME_LAYOUT),
+          ('rover_thread_state', PANEL_LAYOUT),
+          ('rover_uart_state', PANEL_LAYOUT),
+          ('rover_acq', PANEL_LAYOUT)]
+
+# Ephemeris tables are small and are updated in place as ephemerides are
+# re-broadcast, so they're kept in memory and written once at the end even
+# when streaming.
+UNSTREAMED_TABLES = ['ephemerides', 'rover_ephemerides', 'base_ephemerides']
+
+# Observations for an epoch may be split across several messages, so the
+# latest epoch of these tables is held back when streaming.
+EPOCH_TABLES = ['base_obs', 'base_obs_integrity',
+                'rover_obs', 'rover_obs_integrity']
+
+# SBP message types each table is built from. Any other table name is
+# taken to be the class name of a generically handled message.
+_OBS_TYPES = [ob.MsgObs, ob.MsgObsDepA]
+_EPH_TYPES = [ob.MsgEphemeris, ob.MsgEphemerisDepA, ob.MsgEphemerisDepB]
+TABLE_MSG_TYPES = {'base_obs': _OBS_TYPES,
+                   'base_obs_integrity': _OBS_TYPES,
+                   'rover_obs': _OBS_TYPES,
+                   'rover_obs_integrity': _OBS_TYPES,
+                   'ephemerides': _EPH_TYPES,
+                   'rover_ephemerides': _EPH_TYPES,
+                   'base_ephemerides': _EPH_TYPES,
+                   'rover_spp': [nav.MsgGPSTime, nav.MsgPosECEF],
+                   'rover_llh': [nav.MsgGPSTime, nav.MsgPosLLH],
+                   'rover_rtk_ned': [nav.MsgGPSTime, nav.MsgBaselineNED],
+                   'rover_rtk_ecef': [nav.MsgGPSTime, nav.MsgBaselineECEF],
+                   'rover_tracking': [tr.MsgTrackingState,
+                                      tr.MsgTrackingStateDepA],
+                   'rover_iar_state': [piksi.MsgIarState],
+                   'rover_logs': [lg.MsgLog, lg.MsgPrintDep],
+                   'rover_thread_state': [piksi.MsgThreadState],
+                   'rover_uart_state': [piksi.MsgUartState],
+                   'rover_acq': [acq.MsgAcqResult, acq.MsgAcqResultDepA]}
+
+# Fields of the observation tables, in the order _process_obs appends them.
+OBS_FIELDS = ['P', 'L', 'cn0', 'lock', 'host_offset', 'host_time']
+
+# Default number of messages between flushes when streaming.
+DEFAULT_CHUNK_SIZE = 50000
+
+# Default number of seconds between reads of a followed log.
+DEFAULT_FOLLOW_INTERVAL = 5.0
 
 def _is_nested(attr):
   return len(attr.keys()) > 0 and isinstance(attr[attr.keys()[0]], dict)
@@ -93,15 +148,135 @@ def dict_depth(d, depth=0):
     return depth
   return max(dict_depth(v, depth + 1) for k, v in d.iteritems())
 
+def table_msg_types(tables):
+  """Returns the SBP message types (classes or class names) needed to
+  build the given tables.
+
+  """
+  msg_types = set()
+  for tab in tables:
+    msg_types.update(TABLE_MSG_TYPES.get(tab, [tab]))
+  return msg_types
+
+
+@contextmanager
+def _untimed():
+  yield
+
+
+def to_table(attr):
+  """Converts accumulated records to the Panel or DataFrame stored in the
+  HDF5 file.
+
+  """
+  if isinstance(attr, PanelAccumulator):
+    return attr.to_panel() if attr else pd.DataFrame()
+  if dict_depth(attr) == 3:
+    return pd.Panel(attr)
+  return pd.DataFrame(attr)
+
+def from_table(table):
+  """Inverse of to_table for nested record dicts, so that a table which
+  is rewritten whole (see UNSTREAMED_TABLES) can be added to after it's
+  read back.
+
+  """
+  if isinstance(table, pd.Panel):
+    return dict((item, table[item].dropna(axis=1, how='all').to_dict())
+                for item in table.items)
+  return table.to_dict()
+
 class StoreToHDF5(object):
   """Stores observations as HDF5.
 
+  Messages are dispatched on their type through the handlers registry,
+  which maps SBP message classes to the names of StoreToHDF5 methods (or
+  to functions taking the same arguments as a _process_* method,
+  including self). Types without a handler go to _process_generic.
+  Use register_handler to add handlers for new message types.
+
+  Messages may be SBP messages or log_reader.JSONMessages (see
+  lazy_decoder). Handler methods read their type and fields with
+  msg_class and msg_fields, so they work with either; function handlers
+  are always given SBP messages.
+
+  Parameters
+  ----------
+  writer : ChunkedTableWriter, optional
+    If given, tables are flushed to the writer every writer.chunk_size
+    messages instead of being held in memory until save().
+  tables : list, optional
+    Only write these of the specially handled tables. Generically handled
+    messages are always written.
+  profile : IngestProfile, optional
+    If given, handler and table save times are added to it.
+
   """
 
-  def __init__(self):
-    self.base_obs = {}
+  handlers = {ob.MsgObs: '_process_obs',
+              ob.MsgObsDepA: '_process_obs',
+              ob.MsgEphemeris: '_process_eph',
+              ob.MsgEphemerisDepA: '_process_eph',
+              ob.MsgEphemerisDepB: '_process_eph',
+              nav.MsgGPSTime: '_process_gps_time',
+              nav.MsgPosECEF: '_process_pos',
+              nav.MsgPosLLH: '_process_pos',
+              nav.MsgBaselineNED: '_process_pos',
+              nav.MsgBaselineECEF: '_process_pos',
+              tr.MsgTrackingState: '_process_tracking',
+              tr.MsgTrackingStateDepA: '_process_tracking',
+              piksi.MsgIarState: '_process_iar',
+              lg.MsgLog: '_process_log',
+              lg.MsgPrintDep: '_process_log',
+              piksi.MsgThreadState: '_process_thread_state',
+              piksi.MsgUartState: '_process_uart_state',
+              acq.MsgAcqResult: '_process_acq',
+              acq.MsgAcqResultDepA: '_process_acq'}
+
+  @classmethod
+  def register_handler(cls, msg_type, handler):
+    """Registers a handler for an SBP message type, replacing any existing
+    one. Affects instances of cls constructed afterwards.
+
+    Parameters
+    ----------
+    msg_type : class
+      SBP message class, e.g. sbp.navigation.MsgVelNED
+    handler : str or function
+      Name of a method of cls, or a function with the signature
+      handler(store, host_offset, host_time, msg).
+
+    """
+    # Copy so that registering on a subclass leaves its parents alone.
+    cls.handlers = dict(cls.handlers)
+    cls.handlers[msg_type] = handler
+
+  @classmethod
+  def lazy_decoder(cls):
+    """Returns a LazyDecoder which only builds SBP messages for the types
+    with function handlers.
+
+    """
+    methods = [t for t, h in cls.handlers.iteritems()
+               if isinstance(h, basestring)]
+    functions = [t for t, h in cls.handlers.iteritems()
+                 if not isinstance(h, basestring)]
+    return LazyDecoder(decode_types=functions, handled_types=methods)
+
+  def __init__(self, writer=None, tables=None, profile=None):
+    self.tables = None if tables is None else set(tables)
+    self.profile = profile
+    self.dispatch = {}
+    for msg_type, handler in self.handlers.iteritems():
+      if isinstance(handler, basestring):
+        self.dispatch[msg_type] = getattr(self, handler)
+      else:
+        self.dispatch[msg_type] = handler.__get__(self, type(self))
+    self.writer = writer
+    self.n_pending = 0
+    self.base_obs = PanelAccumulator(OBS_FIELDS)
     self.base_obs_integrity = {}
-    self.rover_obs = {}
+    self.rover_obs = PanelAccumulator(OBS_FIELDS)
     self.rover_obs_integrity = {}
     self.ephemerides = {}
     self.rover_ephemerides = {}
@@ -111,91 +286,84 @@ class StoreToHDF5(object):
     self.rover_llh = {}
     self.rover_rtk_ned = {}
     self.rover_rtk_ecef = {}
-    self.rover_tracking = {}
+    self.rover_tracking = PanelAccumulator()
     self.rover_iar_state = {}
     self.rover_logs = {}
     self.rover_thread_state = {}
     self.rover_uart_state = {}
     self.rover_acq = {}
     self.log_seq = 0
+    self.last_log_offset = None
     self.time = None
     self.generic_msgs = {}
 
   def _process_obs(self, host_offset, host_time, msg):
-    if type(msg) in [ob.MsgObs, ob.MsgObsDepA]:
-      time = time_fn(msg.header.t.wn, msg.header.t.tow / MSEC_TO_SECONDS)
-      # n_obs is split bytewise between the total and the count (which message
-      # this is).
-      count = 0x0F & msg.header.n_obs
-      total = msg.header.n_obs >> 4
-      t = self.base_obs if from_base(msg) else self.rover_obs
-      ti = self.base_obs_integrity if from_base(msg) else \
-           self.rover_obs_integrity
-      # Convert pseudorange, carrier phase to SI units.
-      for o in msg.obs:
-        prn = o.sid if msg.msg_type is ob.SBP_MSG_OBS else o.prn
-        v = {'P': o.P / CM_TO_M, 'L': o.L.i + o.L.f / Q32_WIDTH,
-             'cn0': o.cn0, 'lock': o.lock}
-        v.update({'host_offset': host_offset, 'host_time': host_time})
-        if time in t:
-          t[time].update({prn: v})
-        else:
-          t[time] = {prn: v}
-        # Set the 'counts' field such that the Nth bit is 1 iff we have
-        # received a message whose 'count' field (the first byte of the n_obs
-        # field) is N. If we have gotten them all, counts should be
-        # (1 << total) - 1, and python makes the numbers really big as needed.
-        if time in ti:
-          ti[time].update({'counts':ti[time]['counts'] | 1 << count})
-        else:
-          ti[time] = {'total': total, 'counts': 1 << count}
+    time = time_fn(msg.header.t.wn, msg.header.t.tow / MSEC_TO_SECONDS)
+    # n_obs is split bytewise between the total and the count (which message
+    # this is).
+    count = 0x0F & msg.header.n_obs
+    total = msg.header.n_obs >> 4
+    t = self.base_obs if from_base(msg) else self.rover_obs
+    ti = self.base_obs_integrity if from_base(msg) else \
+         self.rover_obs_integrity
+    # Convert pseudorange, carrier phase to SI units.
+    for o in msg.obs:
+      prn = o.sid if msg.msg_type is ob.SBP_MSG_OBS else o.prn
+      t.append_row(time, prn, (o.P / CM_TO_M, o.L.i + o.L.f / Q32_WIDTH,
+                               o.cn0, o.lock, host_offset, host_time))
+      # Set the 'counts' field such that the Nth bit is 1 iff we have
+      # received a message whose 'count' field (the first byte of the n_obs
+      # field) is N. If we have gotten them all, counts should be
+      # (1 << total) - 1, and python makes the numbers really big as needed.
+      if time in ti:
+        ti[time].update({'counts':ti[time]['counts'] | 1 << count})
+      else:
+        ti[time] = {'total': total, 'counts': 1 << count}
 
   def _process_eph(self, host_offset, host_time, msg):
-    if type(msg) in [ob.MsgEphemeris,
-                     ob.MsgEphemerisDepA,
-                     ob.MsgEphemerisDepB]:
-      time = gpstime.gpst_components2datetime(msg.toe_wn, msg.toe_tow)
-      t = self.base_ephemerides if from_base(msg) else self.rover_ephemerides
-      prn = msg.sid if msg.msg_type is ob.SBP_MSG_EPHEMERIS else msg.prn
-      m = exclude_fields(msg)
-      m['host_time'] = host_time
-      self.eph_seq = self.eph_seq + 1 if host_offset in self.ephemerides else 0
-      m['host_offset'] = host_offset + SEQ_INTERVAL*self.eph_seq
-      # For the moment, SITL and HITL analyses expect different
-      # formats of ephemerides tables. Keep both until everyone's
-      # migrated appropriately.
-      if msg.healthy == 1 and msg.valid == 1:
-        if time in self.ephemerides:
-          self.ephemerides[time].update({prn: m})
-        else:
-          self.ephemerides[time] = {prn: m}
-      if prn in t:
-        t[prn].update({m['host_offset']: m})
+    time = gpstime.gpst_components2datetime(msg.toe_wn, msg.toe_tow)
+    t = self.base_ephemerides if from_base(msg) else self.rover_ephemerides
+    prn = msg.sid if msg.msg_type is ob.SBP_MSG_EPHEMERIS else msg.prn
+    m = msg_fields(msg)
+    m['host_time'] = host_time
+    self.eph_seq = self.eph_seq + 1 if host_offset in self.ephemerides else 0
+    m['host_offset'] = host_offset + SEQ_INTERVAL*self.eph_seq
+    # For the moment, SITL and HITL analyses expect different
+    # formats of ephemerides tables. Keep both until everyone's
+    # migrated appropriately.
+    if msg.healthy == 1 and msg.valid == 1:
+      if time in self.ephemerides:
+        self.ephemerides[time].update({prn: m})
       else:
-        t[prn] = {m['host_offset']: m}
+        self.ephemerides[time] = {prn: m}
+    if prn in t:
+      t[prn].update({m['host_offset']: m})
+    else:
+      t[prn] = {m['host_offset']: m}
+
+  def _process_gps_time(self, host_offset, host_time, msg):
+    self.time = msg
 
   def _process_pos(self, host_offset, host_time, msg):
-    if type(msg) is nav.MsgGPSTime:
-      self.time = msg
-    elif self.time is not None:
-      m = exclude_fields(msg)
+    if self.time is not None:
+      m = msg_fields(msg)
       m.update({'host_offset': host_offset, 'host_time': host_time})
-      if type(msg) is nav.MsgPosECEF:
+      if msg_class(msg) is nav.MsgPosECEF:
         time = time_fn(self.time.wn, msg.tow / MSEC_TO_SECONDS)
         m['tow'] /= MSEC_TO_SECONDS
         self.rover_spp[time] = m
-      elif type(msg) is nav.MsgPosLLH:
+      elif msg_class(msg) is nav.MsgPosLLH:
         time = time_fn(self.time.wn, msg.tow / MSEC_TO_SECONDS)
         m['tow'] /= MSEC_TO_SECONDS
         self.rover_llh[time] = m
-      elif type(msg) is nav.MsgBaselineNED:
+      elif msg_class(msg) is nav.MsgBaselineNED:
         time = time_fn(self.time.wn, msg.tow / MSEC_TO_SECONDS)
         m['tow'] /= MSEC_TO_SECONDS
         m['n'] /= MM_TO_M
         m['e'] /= MM_TO_M
         m['d'] /= MM_TO_M
         self.rover_rtk_ned[time] = m
-      elif type(msg) is nav.MsgBaselineECEF:
+      elif msg_class(msg) is nav.MsgBaselineECEF:
         time = time_fn(self.time.wn, msg.tow / MSEC_TO_SECONDS)
         m['tow'] /= MSEC_TO_SECONDS
         m['x'] /= MM_TO_M
@@ -204,82 +372,74 @@ class StoreToHDF5(object):
         self.rover_rtk_ecef[time] = m
 
   def _process_tracking(self, host_offset, host_time, msg):
-    if type(msg) in [tr.MsgTrackingState, tr.MsgTrackingStateDepA]:
-      m = exclude_fields(msg)
-      # Flatten a bit: reindex at the top level by prn and remove the
-      # 'states' field from the message.
-      for s in msg.states:
-        d = walk_json_dict(s)
-        prn = s.sid if msg.msg_type is tr.SBP_MSG_TRACKING_STATE else s.prn
-        d['host_offset'] = host_offset
-        d['host_time'] = host_time
-        if prn in self.rover_tracking:
-          self.rover_tracking[prn].update({host_offset: d})
-        else:
-          self.rover_tracking[prn] = {host_offset: d}
-      del m['states']
+    m = msg_fields(msg)
+    # Flatten a bit: reindex at the top level by prn and remove the
+    # 'states' field from the message.
+    for s in msg.states:
+      d = walk_json_dict(s)
+      prn = s.sid if msg.msg_type is tr.SBP_MSG_TRACKING_STATE else s.prn
+      d['host_offset'] = host_offset
+      d['host_time'] = host_time
+      self.rover_tracking.append(prn, host_offset, d)
+    del m['states']
 
   def _process_iar(self, host_offset, host_time, msg):
-    if type(msg) is piksi.MsgIarState:
-      m = exclude_fields(msg)
-      m['host_offset'] = host_offset
-      m['host_time'] = host_time
-      self.rover_iar_state[host_offset] = m
+    m = msg_fields(msg)
+    m['host_offset'] = host_offset
+    m['host_time'] = host_time
+    self.rover_iar_state[host_offset] = m
 
   def _process_log(self, host_offset, host_time, msg):
-    if type(msg) in [lg.MsgLog, lg.MsgPrintDep]:
-      m = exclude_fields(msg)
-      self.log_seq = self.log_seq + 1 if host_offset in self.rover_logs else 0
-      m['host_offset'] = host_offset + SEQ_INTERVAL*self.log_seq
-      m['host_time'] = host_time
-      self.rover_logs[m['host_offset']] = m
+    m = msg_fields(msg)
+    self.log_seq = self.log_seq + 1 if host_offset == self.last_log_offset else 0
+    self.last_log_offset = host_offset
+    m['host_offset'] = host_offset + SEQ_INTERVAL*self.log_seq
+    m['host_time'] = host_time
+    self.rover_logs[m['host_offset']] = m
 
   def _process_thread_state(self, host_offset, host_time, msg):
-    if type(msg) is piksi.MsgThreadState:
-      m = exclude_fields(msg)
-      m['host_offset'] = host_offset
-      m['host_time'] = host_time
-      m['cpu'] *= 0.1 # Scale from 1000. to 100.
-      name = m['name'].rstrip('\x00')
-      del m['name']
-      if len(name) > 0:
-        if name in self.rover_thread_state:
-          self.rover_thread_state[name].update({host_offset: m})
-        else:
-          self.rover_thread_state[name] = {host_offset: m}
+    m = msg_fields(msg)
+    m['host_offset'] = host_offset
+    m['host_time'] = host_time
+    m['cpu'] *= 0.1 # Scale from 1000. to 100.
+    name = m['name'].rstrip('\x00')
+    del m['name']
+    if len(name) > 0:
+      if name in self.rover_thread_state:
+        self.rover_thread_state[name].update({host_offset: m})
+      else:
+        self.rover_thread_state[name] = {host_offset: m}
 
   def _process_uart_state(self, host_offset, host_time, msg):
-    if type(msg) is piksi.MsgUartState:
-      m = exclude_fields(msg)
-      for i in ['uart_a', 'uart_b' ,'uart_ftdi']:
-        n = walk_json_dict(m[i])
-        n['host_offset'] = host_offset
-        n['host_time'] = host_time
-        # Normalize to percentage from 255.
-        n['rx_buffer_level'] = m[i]['rx_buffer_level'] / 255.
-        n['tx_buffer_level'] = m[i]['tx_buffer_level'] / 255.
-        if i in self.rover_uart_state:
-          self.rover_uart_state[i].update({host_offset: n})
-        else:
-          self.rover_uart_state[i] = {host_offset: n}
-      l = walk_json_dict(m['latency'])
-      l['host_offset'] = host_offset
-      l['host_time'] = host_time
-      if 'latency' in self.rover_uart_state:
-        self.rover_uart_state['latency'].update({host_offset: l})
+    m = msg_fields(msg)
+    for i in ['uart_a', 'uart_b' ,'uart_ftdi']:
+      n = walk_json_dict(m[i])
+      n['host_offset'] = host_offset
+      n['host_time'] = host_time
+      # Normalize to percentage from 255.
+      n['rx_buffer_level'] = m[i]['rx_buffer_level'] / 255.
+      n['tx_buffer_level'] = m[i]['tx_buffer_level'] / 255.
+      if i in self.rover_uart_state:
+        self.rover_uart_state[i].update({host_offset: n})
       else:
-        self.rover_uart_state['latency'] = {host_offset: l}
+        self.rover_uart_state[i] = {host_offset: n}
+    l = walk_json_dict(m['latency'])
+    l['host_offset'] = host_offset
+    l['host_time'] = host_time
+    if 'latency' in self.rover_uart_state:
+      self.rover_uart_state['latency'].update({host_offset: l})
+    else:
+      self.rover_uart_state['latency'] = {host_offset: l}
 
   def _process_acq(self, host_offset, host_time, msg):
-    if type(msg) in [acq.MsgAcqResult, acq.MsgAcqResultDepA]:
-      prn = msg.sid if msg.msg_type is acq.SBP_MSG_ACQ_RESULT else msg.prn
-      m = exclude_fields(msg)
-      m['host_offset'] = host_offset
-      m['host_time'] = host_time
-      if prn in self.rover_acq:
-        self.rover_acq[prn].update({host_offset: m})
-      else:
-        self.rover_acq[prn] = {host_offset: m}
+    prn = msg.sid if msg.msg_type is acq.SBP_MSG_ACQ_RESULT else msg.prn
+    m = msg_fields(msg)
+    m['host_offset'] = host_offset
+    m['host_time'] = host_time
+    if prn in self.rover_acq:
+      self.rover_acq[prn].update({host_offset: m})
+    else:
+      self.rover_acq[prn] = {host_offset: m}
 
   def _process_generic(self, host_offset, host_time, msg):
     """
@@ -297,10 +457,10 @@ class StoreToHDF5(object):
       SBP message payload
 
     """
-    m = exclude_fields(msg)
+    m = msg_fields(msg)
     m['host_offset'] = host_offset
     m['host_time'] = host_time
-    key = msg.__class__.__name__
+    key = msg_class(msg).__name__
     msg_dict = self.generic_msgs.get(key, {})
     msg_dict.update({m['host_offset'] : m})
     self.generic_msgs[key] = msg_dict
@@ -311,9 +471,9 @@ class StoreToHDF5(object):
     """Dispatches specific message types to the appropriate
     tables.
 
-    The SPECIALLY_HANDLED_TYPES list decides whether a msg
-    is uniquely processed.  We'd like MsgGPSTime to be used
-    for other message timestamps and to be stored as a table
+    The handlers registry decides whether a msg is uniquely
+    processed. Everything else is stored in a table named after its
+    class. MsgGPSTime is used for other message timestamps.
 
     Parameters
     ----------
@@ -325,56 +485,108 @@ class StoreToHDF5(object):
       SBP message payload
 
     """
-    if type(msg) in SPECIALLY_HANDLED_TYPES + [nav.MsgGPSTime]:
-      self._process_acq(host_offset, host_time, msg)
-      self._process_eph(host_offset, host_time, msg)
-      self._process_iar(host_offset, host_time, msg)
-      self._process_log(host_offset, host_time, msg)
-      self._process_obs(host_offset, host_time, msg)
-      self._process_pos(host_offset, host_time, msg)
-      self._process_tracking(host_offset, host_time, msg)
-      self._process_thread_state(host_offset, host_time, msg)
-      self._process_uart_state(host_offset, host_time, msg)
+    cls = msg_class(msg)
+    handler = self.dispatch.get(cls, self._process_generic)
+    if self.profile is None:
+      handler(host_offset, host_time, msg)
     else:
-      self._process_generic(host_offset, host_time, msg)
+      start = time.time()
+      handler(host_offset, host_time, msg)
+      self.profile.add_handler(cls.__name__, time.time() - start)
+    if self.writer is not None:
+      self.n_pending += 1
+      if self.n_pending >= self.writer.chunk_size:
+        self.flush()
+
+  def flush(self):
+    """Appends everything accumulated so far to the streaming writer and
+    clears it from memory, except for the ephemeris tables and the latest
+    observation epoch.
+
+    """
+    for tab, layout in TABLES:
+      if tab in UNSTREAMED_TABLES:
+        continue
+      attr = getattr(self, tab)
+      if isinstance(attr, PanelAccumulator):
+        chunk = attr.drain(tab in EPOCH_TABLES)
+      else:
+        chunk, held = attr, {}
+        if tab in EPOCH_TABLES and attr:
+          latest = max(attr.iterkeys())
+          held[latest] = attr.pop(latest)
+        setattr(self, tab, held)
+      if self.is_selected(tab):
+        with self._saving(tab):
+          self.writer.append(tab, chunk, layout)
+    for key, msgdict in self.generic_msgs.iteritems():
+      with self._saving(key):
+        self.writer.append(key, msgdict, FRAME_LAYOUT)
+    self.generic_msgs = {}
+    self.n_pending = 0
 
+  def sync(self):
+    """Flushes to the streaming writer and rewrites the unstreamed
+    tables, so that the output is complete up to the held back epoch.
+    Unlike save, more messages may be processed afterwards.
+
+    """
+    self.flush()
+    for tab in UNSTREAMED_TABLES:
+      attr = getattr(self, tab)
+      if self.is_selected(tab) and attr:
+        with self._saving(tab):
+          self.writer.put(tab, to_table(attr))
+
+  def is_selected(self, tab):
+    return self.tables is None or tab in self.tables
+
+  def _saving(self, tab):
+    if self.profile is None:
+      return _untimed()
+    return self.profile.saving(tab)
+
+  def _save_streamed(self):
+    self.flush()
+    for tab, layout in TABLES:
+      if not self.is_selected(tab):
+        continue
+      attr = getattr(self, tab)
+      with self._saving(tab):
+        if tab in EPOCH_TABLES:
+          # Append the final, held back epoch.
+          self.writer.append(tab, attr, layout)
+        if self.writer.has_table(tab):
+          continue
+        if not attr:
+          warnings.warn('%s is empty.' % tab)
+        self.writer.put(tab, to_table(attr))
+    self.writer.close()
 
   def save(self, filename):
+    if self.writer is not None:
+      assert filename == self.writer.filename, \
+        "Streamed output is written to %s." % self.writer.filename
+      self._save_streamed()
+      return
     if os.path.exists(filename):
       print "Unlinking %s, which already exists!" % filename
       os.unlink(filename)
     try:
       f = pd.HDFStore(filename, mode='w')
-      tabs = ['base_obs',
-              'base_obs_integrity',
-              'rover_obs',
-              'rover_obs_integrity',
-              'ephemerides',
-              'rover_ephemerides',
-              'base_ephemerides',
-              'rover_spp',
-              'rover_llh',
-              'rover_rtk_ned',
-              'rover_rtk_ecef',
-              'rover_tracking',
-              'rover_iar_state',
-              'rover_logs',
-              'rover_thread_state',
-              'rover_uart_state',
-              'rover_acq']
-      for tab in tabs:
-        attr = getattr(self, tab)
-        if dict_depth(attr) == 3:
-          f.put(tab, pd.Panel(attr))
-        else:
-          f.put(tab, pd.DataFrame(attr))
+      for tab, _ in TABLES:
+        if not self.is_selected(tab):
+          continue
+        with self._saving(tab):
+          f.put(tab, to_table(getattr(self, tab)))
         if f.get(tab).empty:
           warnings.warn('%s is empty.' % tab)
       # For each generic message we add a column whose
       # name comes from the Msg's class name
       for eachkey in self.generic_msgs.iterkeys():
         msgdict = self.generic_msgs.get(eachkey, {})
-        f.put(eachkey, pd.DataFrame(msgdict))
+        with self._saving(eachkey):
+          f.put(eachkey, pd.DataFrame(msgdict))
         if f.get(eachkey).empty:
            warnings.warn('%s is empty.' % eachkey)
     except:
@@ -384,22 +596,128 @@ class StoreToHDF5(object):
       f.close()
 
 
-def hdf5_write(log_datafile, filename, verbose=False):
-  processor = StoreToHDF5()
+def mk_processor(filename, chunk_size=None, tables=None, profile=None):
+  """Makes a StoreToHDF5, streaming to filename every chunk_size
+  messages if chunk_size is given.
+
+  """
+  if chunk_size is None:
+    return StoreToHDF5(tables=tables, profile=profile)
+  return StoreToHDF5(writer=ChunkedTableWriter(filename, int(chunk_size)),
+                     tables=tables, profile=profile)
+
+
+def json_log_records(log_datafile):
+  """Yields (msg, data) for every record of a JSON log.
+
+  """
+  with JSONLogIterator(log_datafile) as log:
+    for msg, data in log.next():
+      yield msg, data
+
+
+def hdf5_write(log_datafile, filename, verbose=False, chunk_size=None,
+               num_records=None, tables=None, msg_types=None,
+               host_time_window=None, gps_time_window=None, lazy=False,
+               profile=None):
+  """Converts a JSON log, or a raw SBP binary capture, to HDF5.
+
+  If any of tables, msg_types or the time windows are given, records
+  which can't contribute to the output are skipped before they are
+  decoded.
+
+  Parameters
+  ----------
+  log_datafile : str
+    JSON log or binary SBP capture filename (see binary_reader)
+  filename : str
+    Output HDF5 filename
+  verbose : bool
+    Verbose output
+  chunk_size : int, optional
+    If given, stream tables to filename every chunk_size messages so that
+    memory use doesn't grow with the length of the log. Streamed tables
+    should be read back with gnss_analysis.table_io.read_table.
+  num_records : int, optional
+    Number of log records to read.
+  tables : list, optional
+    Tables to write (see TABLES). Generic message tables may be named by
+    their message class name, e.g. 'MsgVelNED'.
+  msg_types : list, optional
+    Additional SBP message types to ingest, as classes, class names or
+    message type IDs. With neither tables nor msg_types, every message
+    type is ingested.
+  host_time_window : (float, float), optional
+    Only ingest records with host UNIX times in this window.
+  gps_time_window : (datetime, datetime), optional
+    Only ingest records received while the latest MsgGPSTime is in this
+    window.
+  lazy : bool, optional
+    Build table rows from the decoded JSON fields instead of decoding
+    every SBP message (see StoreToHDF5.lazy_decoder).
+  profile : str, optional
+    If given, write an IngestProfile summary of the conversion to this
+    JSON file.
+
+  """
+  ingest_profile = None if profile is None else IngestProfile()
+  processor = mk_processor(filename, chunk_size, tables, ingest_profile)
+  if num_records is not None:
+    num_records = int(num_records)
+  selected_types = None
+  if tables is not None or msg_types is not None:
+    selected_types = table_msg_types(tables or []) | set(msg_types or [])
+  record_filter = None
+  if selected_types is not None or host_time_window is not None \
+     or gps_time_window is not None:
+    record_filter = RecordFilter(selected_types,
+                                 host_time_window,
+                                 gps_time_window)
+  if is_binary_log(log_datafile):
+    records = iter_binary_records(log_datafile, record_filter, num_records)
+  elif lazy:
+    records = iter_records(log_datafile, record_filter, num_records,
+                           decoder=processor.lazy_decoder())
+  elif record_filter is None:
+    records = islice(json_log_records(log_datafile), num_records)
+  else:
+    records = iter_records(log_datafile, record_filter, num_records)
+  if ingest_profile is not None:
+    records = _timed_records(records, ingest_profile)
   i = 0
   logging_interval = 10000
   start = time.time()
-  with JSONLogIterator(log_datafile) as log:
-    for msg, data in log.next():
-      i += 1
-      if verbose and i % logging_interval == 0:
-        print "Processed %d records! @ %.1f sec." % (i, time.time() - start)
-      processor.process_message(data['delta'],  data['timestamp'], msg)
-    print "Processed %d records!" % i
-    processor.save(filename)
+  for msg, data in records:
+    i += 1
+    if verbose and i % logging_interval == 0:
+      print "Processed %d records! @ %.1f sec." % (i, time.time() - start)
+    processor.process_message(data['delta'],  data['timestamp'], msg)
+  print "Processed %d records!" % i
+  processor.save(filename)
+  if ingest_profile is not None:
+    ingest_profile.measure_sizes(filename)
+    ingest_profile.write(profile)
+    if verbose:
+      ingest_profile.report()
   return filename
 
 
+def _timed_records(records, profile):
+  """Adds the time taken to read each record to profile, by the type of
+  message read.
+
+  """
+  records = iter(records)
+  while True:
+    start = time.time()
+    try:
+      msg, data = next(records)
+    except StopIteration:
+      return
+    profile.add_decode(msg_class(msg).__name__, time.time() - start)
+    yield msg, data
+
+
 def main():
   """Fuck some Pandas
 
@@ -407,7 +725,7 @@ def main():
   import argparse
   parser = argparse.ArgumentParser(description='Swift Nav SBP log to HDF5 table tool.')
   parser.add_argument('file',
-                      help='Specify the log file to use.')
+                      help='Specify the log file (JSON or binary SBP) to use.')
   parser.add_argument('-o', '--output',
                       nargs=1,
                       help='Test results output filename.')
@@ -415,28 +733,81 @@ def main():
                       nargs=1,
                       default=[None],
                       help='Number or SBP records to process.')
+  parser.add_argument('-s', '--stream',
+                      action='store_true',
+                      help='Stream tables to disk in bounded chunks.')
+  parser.add_argument('-c', '--chunk_size',
+                      nargs=1,
+                      default=[DEFAULT_CHUNK_SIZE],
+                      help='Number of SBP records per chunk when streaming.')
+  parser.add_argument('-t', '--tables',
+                      nargs='+',
+                      default=None,
+                      help='Only write these tables (e.g., rover_logs '
+                           'rover_rtk_ned MsgVelNED).')
+  parser.add_argument('-m', '--msg_types',
+                      nargs='+',
+                      default=None,
+                      help='Also ingest these SBP message types, by class '
+                           'name or message type ID.')
+  parser.add_argument('-l', '--lazy',
+                      action='store_true',
+                      help='Build tables from the decoded JSON fields instead '
+                           'of decoding every SBP message.')
+  parser.add_argument('-p', '--profile',
+                      nargs=1,
+                      default=[None],
+                      help='Write a JSON timing breakdown of the conversion '
+                           'to this file.')
+  parser.add_argument('-f', '--follow',
+                      action='store_true',
+                      help='Keep appending records to the output as the log '
+                           'grows, until interrupted.')
+  parser.add_argument('-i', '--interval',
+                      nargs=1,
+                      type=float,
+                      default=[DEFAULT_FOLLOW_INTERVAL],
+                      help='Seconds between reads of the log when following.')
+  parser.add_argument('--host_time',
+                      nargs=2,
+                      type=float,
+                      default=None,
+                      metavar=('START', 'END'),
+                      help='Only ingest records with host UNIX times '
+                           'between START and END.')
+  parser.add_argument('--gps_time',
+                      nargs=2,
+                      default=None,
+                      metavar=('START', 'END'),
+                      help='Only ingest records received between GPS times '
+                           'START and END (e.g., "2015-03-15 02:02:23").')
   args = parser.parse_args()
   log_datafile = args.file
   if args.output is None:
     filename = log_datafile + '.hdf5'
   else:
     filename = args.output[0]
-  num_records = args.num_records[0]
-  processor = StoreToHDF5()
-  i = 0
-  logging_interval = 10000
-  start = time.time()
-  with JSONLogIterator(log_datafile) as log:
-    for msg, data in log.next():
-      i += 1
-      if i % logging_interval == 0:
-        print "Processed %d records! @ %.1f sec." \
-          % (i, time.time() - start)
-      processor.process_message(data['delta'], data['timestamp'], msg)
-      if num_records is not None and i >= int(num_records):
-        print "Processed %d records!" % i
-        break
-    processor.save(filename)
+  if args.follow:
+    from gnss_analysis.tools.follow import follow
+    follow(log_datafile, filename,
+           interval=args.interval[0],
+           chunk_size=int(args.chunk_size[0]),
+           tables=args.tables,
+           verbose=True)
+    return
+  gps_time_window = None
+  if args.gps_time is not None:
+    gps_time_window = tuple(pd.Timestamp(t).to_datetime() for t in args.gps_time)
+  hdf5_write(log_datafile, filename,
+             verbose=True,
+             chunk_size=args.chunk_size[0] if args.stream else None,
+             num_records=args.num_records[0],
+             tables=args.tables,
+             msg_types=args.msg_types,
+             host_time_window=args.host_time,
+             gps_time_window=gps_time_window,
+             lazy=args.lazy,
+             profile=args.profile[0])
 
 if __name__ == "__main__":
   main()
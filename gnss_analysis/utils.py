@@ -41,6 +41,73 @@ def mk_swiftnav_sdiff(x):
                     x.snr,
                     x.prn)
 
+
+# Fields of a libswiftnav sdiff_t, in the order mk_swiftnav_sdiffs reads
+# them.
+SINGLE_DIFF_FIELDS = ['P', 'L', 'D1',
+                      'sat_pos_x', 'sat_pos_y', 'sat_pos_z',
+                      'sat_vel_x', 'sat_vel_y', 'sat_vel_z',
+                      'snr', 'prn']
+
+
+def mk_swiftnav_sdiffs(datum, min_snr=None):
+  """
+  Make the libswiftnav sdiff_t of each satellite of an epoch with a
+  pseudorange. Equivalent to datum.apply(mk_swiftnav_sdiff, axis=0).dropna(),
+  but the fields are pulled out as arrays once, rather than read from a
+  Series per satellite.
+
+  Parameters
+  ----------
+  datum : DataFrame
+    The fields (see SINGLE_DIFF_FIELDS) x satellites of an epoch.
+  min_snr : float, optional
+    If given, satellites with a lower snr are left out.
+
+  Returns
+  -------
+  Series
+    The SingleDiffs, indexed by satellite.
+  """
+  v = datum.ix[SINGLE_DIFF_FIELDS].values.astype(np.float64)
+  P, L, D1 = v[0], v[1], v[2]
+  pos, vel = v[3:6], v[6:9]
+  snr, prn = v[9], v[10]
+  use = ~np.isnan(P)
+  if min_snr is not None:
+    use &= snr >= min_snr
+  sats = np.flatnonzero(use)
+  sdiffs = [SingleDiff(P[k], L[k], D1[k], pos[:, k].copy(), vel[:, k].copy(),
+                       snr[k], prn[k])
+            for k in sats]
+  return pd.Series(sdiffs, index=datum.columns[sats], dtype=object)
+
+
+class EpochContext(object):
+  """
+  Data derived from an epoch's datum, computed at most once and shared
+  by the SITL update function and every analysis of the epoch (see
+  SITL's context_function).
+
+  Parameters
+  ----------
+  datum : DataFrame
+    The fields x satellites of an epoch.
+  min_snr : float, optional
+    Leave satellites with a lower snr out of the SingleDiffs.
+  """
+  def __init__(self, datum, min_snr=None):
+    self.datum = datum
+    self.min_snr = min_snr
+    self._sdiffs = None
+
+  @property
+  def sdiffs(self):
+    """The SingleDiffs of the epoch, as from mk_swiftnav_sdiffs."""
+    if self._sdiffs is None:
+      self._sdiffs = mk_swiftnav_sdiffs(self.datum, self.min_snr)
+    return self._sdiffs
+
 def sphere_b_covariance(var=0.0025):
     return np.eye(3, 3) * var
 
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Ian Horn <ian@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+"""A pool of crash-isolated worker processes.
+
+libswiftnav can crash the process it runs in, and a multiprocessing.Pool
+hangs when one of its workers dies. WorkerPool supervises its workers
+itself: each job runs in a long-lived child process, and a child that
+crashes, is killed by a signal, or runs past its timeout is replaced by a
+fresh one, while the job is retried or recorded as a RunFailure. Workers
+are only replaced when they fail, so a batch of jobs costs one process
+start per worker rather than per job.
+
+"""
+
+from collections import deque
+import multiprocessing
+import os
+import select
+import signal
+import time
+import traceback
+
+try:
+  import resource
+except ImportError:
+  # No memory caps where there's no resource module.
+  resource = None
+
+SIGNAL_NAMES = dict((getattr(signal, name), name) for name in dir(signal)
+                    if name.startswith('SIG') and not name.startswith('SIG_'))
+
+# Seconds between checks for timed out and dead workers.
+POLL_INTERVAL = 0.1
+
+
+class RunFailure(object):
+  """Why a job failed.
+
+  Attributes
+  ----------
+  kind : str
+    'error' (the job raised an exception), 'signal' (its process was
+    killed by a signal), 'exit' (its process exited) or 'timeout'
+  detail : str
+    The traceback, signal name, exit code or timeout
+  attempts : int
+    Number of times the job was run
+  elapsed : float
+    Seconds the last attempt ran for
+
+  """
+
+  def __init__(self, kind, detail, attempts, elapsed):
+    self.kind = kind
+    self.detail = detail
+    self.attempts = attempts
+    self.elapsed = elapsed
+
+  def as_dict(self):
+    return {'failure': self.kind,
+            'failure_detail': self.detail,
+            'failure_attempts': self.attempts,
+            'failure_elapsed': self.elapsed}
+
+  def __repr__(self):
+    return "RunFailure(%r, %r, attempts=%d)" % (self.kind, self.detail,
+                                                self.attempts)
+
+
+def _worker_main(conn, max_bytes):
+  """Runs (function, args) jobs from conn until it's closed or sent None,
+  sending back (True, result) or (False, traceback) for each.
+
+  """
+  if max_bytes and resource is not None:
+    resource.setrlimit(resource.RLIMIT_AS, (max_bytes, max_bytes))
+  while True:
+    try:
+      job = conn.recv()
+    except EOFError:
+      return
+    if job is None:
+      return
+    fn, args = job
+    try:
+      reply = (True, fn(*args))
+    except Exception:
+      reply = (False, traceback.format_exc())
+    try:
+      conn.send(reply)
+    except Exception:
+      conn.send((False, traceback.format_exc()))
+
+
+class _Worker(object):
+
+  def __init__(self, max_bytes):
+    self.conn, child_conn = multiprocessing.Pipe()
+    self.process = multiprocessing.Process(target=_worker_main,
+                                           args=(child_conn, max_bytes))
+    self.process.daemon = True
+    self.process.start()
+    child_conn.close()
+    self.job = None
+    self.started = None
+
+  def submit(self, job, fn, args):
+    self.job = job
+    self.started = time.time()
+    self.conn.send((fn, args))
+
+  def kill(self):
+    self.process.terminate()
+    self.process.join(1)
+    if self.process.is_alive():
+      os.kill(self.process.pid, signal.SIGKILL)
+      self.process.join()
+    self.conn.close()
+
+  def stop(self):
+    try:
+      self.conn.send(None)
+    except (IOError, OSError):
+      pass
+    self.process.join(1)
+    if self.process.is_alive():
+      self.kill()
+    else:
+      self.conn.close()
+
+  def death(self):
+    """Returns the (kind, detail) of the death of the worker's process."""
+    self.process.join(1)
+    code = self.process.exitcode
+    if code is None:
+      self.kill()
+      return 'exit', 'lost contact'
+    if code < 0:
+      return 'signal', SIGNAL_NAMES.get(-code, str(-code))
+    return 'exit', str(code)
+
+
+class WorkerPool(object):
+  """A warm pool of crash-isolated worker processes.
+
+  Parameters
+  ----------
+  workers : int, optional
+    Number of worker processes (default one per CPU)
+  timeout : float, optional
+    Seconds a job may run for before its worker is killed (default no
+    limit)
+  max_bytes : int, optional
+    Cap on the address space of each worker (default no cap)
+  retries : int, optional
+    Times to rerun a job whose worker crashed or timed out. Jobs that
+    raise an exception aren't retried. (default 1)
+
+  """
+
+  def __init__(self, workers=None, timeout=None, max_bytes=None, retries=1):
+    self.n_workers = workers or multiprocessing.cpu_count()
+    self.timeout = timeout
+    self.max_bytes = max_bytes
+    self.retries = retries
+    self.workers = []
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def _start_workers(self, n):
+    while len(self.workers) < n:
+      self.workers.append(_Worker(self.max_bytes))
+
+  def _replace(self, worker):
+    # The worker's process is dead by now, but its end of the pipe is
+    # still open unless it was killed.
+    worker.conn.close()
+    self.workers.remove(worker)
+    self.workers.append(_Worker(self.max_bytes))
+
+  def _dispatch(self, pending, fn):
+    """Submits pending jobs to the idle workers, and returns the busy
+    ones.
+
+    """
+    for worker in self.workers:
+      if worker.job is None and pending:
+        job = pending.popleft()
+        worker.submit(job, fn, job[1])
+    return [w for w in self.workers if w.job is not None]
+
+  def _reap(self, worker, ready, now, pending):
+    """Checks on a busy worker, given the connections ready to read.
+    Returns (i, result, failure) if its job is done, or None if it's
+    still running or was put back in pending to be retried. A worker
+    that died or timed out is replaced.
+
+    """
+    i, args, attempt = worker.job
+    elapsed = now - worker.started
+    if worker.conn in ready:
+      try:
+        ok, value = worker.conn.recv()
+      except (EOFError, IOError):
+        kind, detail = worker.death()
+      else:
+        worker.job = None
+        if ok:
+          return i, value, None
+        return i, None, RunFailure('error', value, attempt, elapsed)
+    elif not worker.process.is_alive():
+      kind, detail = worker.death()
+    elif self.timeout is not None and elapsed > self.timeout:
+      worker.kill()
+      kind, detail = 'timeout', '%.1f sec' % self.timeout
+    else:
+      return None
+    self._replace(worker)
+    if attempt <= self.retries:
+      pending.appendleft((i, args, attempt + 1))
+      return None
+    return i, None, RunFailure(kind, detail, attempt, elapsed)
+
+  def imap_unordered(self, fn, arg_tuples):
+    """Runs fn(*args) for each args in arg_tuples, and yields (i, result,
+    failure) for the i-th as each finishes, where failure is None or a
+    RunFailure (and then result is None). fn must be picklable, as a
+    module level function is.
+
+    """
+    pending = deque((i, tuple(args), 1) for i, args in enumerate(arg_tuples))
+    self._start_workers(min(self.n_workers, len(pending)))
+    while pending or any(w.job is not None for w in self.workers):
+      busy = self._dispatch(pending, fn)
+      ready = select.select([w.conn for w in busy], [], [], POLL_INTERVAL)[0]
+      now = time.time()
+      for worker in busy:
+        done = self._reap(worker, ready, now, pending)
+        if done is not None:
+          yield done
+
+  def close(self):
+    """Stops the workers."""
+    for worker in self.workers:
+      if worker.job is None:
+        worker.stop()
+      else:
+        worker.kill()
+    self.workers = []
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Bhaskar Mookerji <mookerji@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+from gnss_analysis.accumulators import PanelAccumulator
+from pandas.util.testing import assert_panel_equal
+import numpy as np
+import pandas as pd
+
+
+def test_panel_accumulator():
+  records = [(3, 12, {'P': 1.0, 'cn0': 40}),
+             (1, 12, {'P': 2.0, 'cn0': 41}),
+             (1, 4, {'P': 3.0, 'cn0': 42, 'lock': 7}),
+             (3, 12, {'P': 4.0, 'cn0': 43})]
+  expected = {}
+  acc = PanelAccumulator(['P'])
+  for i in range(300):
+    for item, minor, record in records:
+      item = item + 10*i
+      expected.setdefault(item, {})[minor] = record
+      acc.append(item, minor, record)
+  assert len(acc) == 1200
+  assert_panel_equal(acc.to_panel(), pd.Panel(expected).astype(np.float64))
+  df = acc.drain(keep_latest_item=True)
+  assert df.shape == (899, 3)
+  assert len(acc) == 2
+  assert acc.to_panel().to_dict().keys() == [2993]
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Ian Horn <ian@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+import gnss_analysis.batch_run as br
+import numpy as np
+import os
+import pandas as pd
+import pytest
+import signal
+
+
+def test_read_manifest(tmpdir):
+  manifest = tmpdir.join('runs.csv')
+  manifest.write("file,x,y,z,ned,row\n"
+                 "# A comment\n"
+                 "a.hdf5,0.1,1.3,-0.2,true,first\n"
+                 "b.hdf5,1,2,3,,\n")
+  entries = br.read_manifest(str(manifest))
+  assert [e['file'] for e in entries] == ['a.hdf5', 'b.hdf5']
+  assert [e['row'] for e in entries] == ['first', 'b.hdf5']
+  assert [e['ned'] for e in entries] == [True, False]
+  assert np.allclose(entries[0]['baseline'], [0.1, 1.3, -0.2])
+  tmpdir.join('bad.csv').write("file,x,y\na.hdf5,1,2\n")
+  with pytest.raises(Exception):
+    br.read_manifest(str(tmpdir.join('bad.csv')))
+
+
+def test_batch_run(tmpdir, monkeypatch):
+  def fake_run(filename, baseline, reports=None, baseline_is_NED=False,
+               stream=False, checkpoint=None):
+    if filename == 'bad.hdf5':
+      raise ValueError("Bad file.")
+    if filename == 'crash.hdf5':
+      os.kill(os.getpid(), signal.SIGSEGV)
+    return {'count': str(int(baseline.sum())), 'ned': baseline_is_NED}
+  # The workers are forked, so they see the fake.
+  monkeypatch.setattr(br, 'single_run', fake_run)
+  files = ['a.hdf5', 'bad.hdf5', 'c.hdf5', 'crash.hdf5']
+  entries = [{'file': f, 'row': f, 'baseline': np.ones(3) * i, 'ned': i > 1}
+             for i, f in enumerate(files)]
+  outfile = str(tmpdir.join('agg.hdf5'))
+  with pytest.warns(UserWarning):
+    failures = dict(br.batch_run(entries, outfile, workers=2, retries=1))
+  assert sorted(failures) == ['bad.hdf5', 'crash.hdf5']
+  assert failures['bad.hdf5'].kind == 'error'
+  assert 'Bad file.' in failures['bad.hdf5'].detail
+  assert failures['crash.hdf5'].kind == 'signal'
+  assert failures['crash.hdf5'].attempts == 2
+  with pd.HDFStore(outfile) as store:
+    table = store['table']
+  assert sorted(table.index) == files
+  assert table.loc['c.hdf5', 'count'] == '6'
+  assert table.loc['c.hdf5', 'ned']
+  assert table.loc['crash.hdf5', 'failure'] == 'signal'
+  assert table.loc['crash.hdf5', 'failure_detail'] == 'SIGSEGV'
+  assert table.loc['bad.hdf5', 'failure'] == 'error'
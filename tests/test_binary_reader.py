@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Bhaskar Mookerji <mookerji@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+from gnss_analysis.tools.binary_reader import FrameReader, crc16, pack_frame, \
+  is_binary_log
+from gnss_analysis.tools.records2table import hdf5_write
+from pandas.util.testing import assert_frame_equal
+import base64
+import json
+import pandas as pd
+
+
+def json_frames(log_datafile):
+  frames = []
+  with open(log_datafile) as f:
+    for line in f:
+      data = json.loads(line)['data']
+      payload = base64.b64decode(data['payload'])
+      frame = pack_frame(data['msg_type'], data['sender'], payload)
+      # The ephemerides in this log don't match their recorded CRCs.
+      if data['msg_type'] != 70:
+        assert crc16(frame[1:-2]) == data['crc']
+      frames.append(frame)
+  return frames
+
+
+def test_binary_log(tmpdir):
+  log_datafile \
+    = "./data/serial_link_log_20150314-190228_dl_sat_fail_test1.log.json.dat"
+  frames = json_frames(log_datafile)
+  # Corrupt a frame's CRC and put some noise between two others.
+  bad = frames[100][:-1] + chr(ord(frames[100][-1]) ^ 0xFF)
+  capture = frames[:100] + [bad, '\x55\x01\x02'] + frames[101:]
+  binary = tmpdir.join('capture.sbp')
+  binary.write(''.join(capture), mode='wb')
+  assert is_binary_log(str(binary))
+  assert not is_binary_log(log_datafile)
+  # A capture may start mid-frame.
+  partial = tmpdir.join('partial.sbp')
+  partial.write(''.join(frames[:20])[7:], mode='wb')
+  assert is_binary_log(str(partial))
+  reader = FrameReader(str(binary))
+  assert len(list(reader.frames())) == len(frames) - 1
+  assert reader.n_crc_errors == 2
+  assert reader.n_skipped_bytes == len(bad) + 3
+  expected = hdf5_write(log_datafile, str(tmpdir.join('expected.hdf5')))
+  converted = hdf5_write(str(binary), str(tmpdir.join('binary.hdf5')))
+  host_fields = ['host_offset', 'host_time']
+  with pd.HDFStore(expected) as e, pd.HDFStore(converted) as b:
+    for tab in ['rover_spp', 'rover_rtk_ned']:
+      assert_frame_equal(b[tab].drop(host_fields), e[tab].drop(host_fields))
+    assert_frame_equal(b.rover_obs.to_frame().drop(host_fields, axis=1),
+                       e.rover_obs.to_frame().drop(host_fields, axis=1))
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Ian Horn <ian@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+from gnss_analysis.data_io import SDIFF_FIELDS, SdiffStream, \
+  _sdiffs_and_pos_inputs, iter_sdiffs_and_pos, mk_sdiffs_and_abs_pos, \
+  mk_sdiffs_cube, screen_sdiffs, sdiffs_cache_key
+import datetime
+import gnss_analysis.constants as constants
+import gnss_analysis.spp as spp
+import numpy as np
+import pandas as pd
+import pytest
+
+SAMPLE_HDF5 = "data/serial-link-20150506-175750.log.json.new_fields.hdf5"
+
+
+def screen_sdiffs_loop(times, lock1, lock2, carr, has_eph):
+  """The epoch by epoch, sat by sat screening of the reference
+  implementation of mk_sdiffs_and_abs_pos.
+
+  """
+  accept = np.zeros(lock1.shape, dtype=bool)
+  dops = np.empty(lock1.shape)
+  dops.fill(np.nan)
+  for i, t in enumerate(times):
+    for k in range(lock1.shape[1]):
+      if i > 0 and has_eph[i, k] and not np.isnan(carr[i, k]) \
+         and not np.isnan(carr[i - 1, k]):
+        dt = (t - times[i - 1]).total_seconds()
+        dops[i, k] = (carr[i, k] - carr[i - 1, k]) / dt
+      prev1 = lock1[i - 1, k] if i > 0 else np.nan
+      prev2 = lock2[i - 1, k] if i > 0 else np.nan
+      has_info = not (np.isnan(lock1[i, k]) or np.isnan(lock2[i, k]))
+      lock1_good = np.isnan(prev1) or lock1[i, k] == prev1
+      lock2_good = np.isnan(prev2) or lock2[i, k] == prev2
+      accept[i, k] = has_eph[i, k] and has_info and lock1_good and lock2_good
+  return accept, dops
+
+
+def test_screen_sdiffs():
+  np.random.seed(0)
+  shape = (50, 8)
+  t0 = datetime.datetime(2015, 3, 1)
+  times = [t0 + datetime.timedelta(seconds=0.2 * i + 0.05 * (i % 3))
+           for i in range(shape[0])]
+  nan_at = lambda p: np.random.random(shape) < p
+  lock1 = np.random.randint(0, 2, shape).astype(float)
+  lock2 = np.random.randint(0, 2, shape).astype(float)
+  lock1[nan_at(0.1)] = np.nan
+  lock2[nan_at(0.1)] = np.nan
+  carr_loc = np.random.random(shape) * 1e6
+  carr_rem = np.random.random(shape) * 1e6
+  carr_loc[nan_at(0.1)] = np.nan
+  carr_rem[nan_at(0.1)] = np.nan
+  has_eph = ~nan_at(0.05)
+  accept, dop_loc, dop_rem = screen_sdiffs(times, lock1, lock2,
+                                           carr_loc, carr_rem, has_eph)
+  expected_accept, expected_dop_loc = \
+    screen_sdiffs_loop(times, lock1, lock2, carr_loc, has_eph)
+  _, expected_dop_rem = screen_sdiffs_loop(times, lock1, lock2,
+                                           carr_rem, has_eph)
+  assert (accept == expected_accept).all()
+  assert np.allclose(dop_loc, expected_dop_loc, equal_nan=True)
+  assert np.allclose(dop_rem, expected_dop_rem, equal_nan=True)
+
+
+def test_mk_sdiffs_cube():
+  times = [datetime.datetime(2015, 3, 1, 0, 0, s) for s in range(3)]
+  sats = [3, 7, 12]
+  grid = np.arange(9, dtype=float).reshape(3, 3)
+  sat_pos = np.arange(27, dtype=float).reshape(3, 3, 3)
+  accept = np.array([[True, False, False],
+                     [True, False, True],
+                     [False, False, True]])
+  sdiffs = mk_sdiffs_cube(times, sats, grid, grid + 100, grid + 200,
+                          sat_pos, -sat_pos, accept)
+  assert list(sdiffs.fields) == SDIFF_FIELDS
+  assert list(sdiffs.epochs) == times
+  # Sat 7 is never accepted.
+  assert list(sdiffs.sats) == [3, 12]
+  epoch = sdiffs[1]
+  assert epoch.ix['P', 12] == 5
+  assert epoch.ix['L', 12] == 105
+  assert epoch.ix['snr', 12] == 205
+  assert epoch.ix['prn', 12] == 12
+  assert (epoch.ix[['sat_pos_x', 'sat_pos_y', 'sat_pos_z'], 12]
+          == sat_pos[1, 2]).all()
+  assert (epoch.ix[['sat_vel_x', 'sat_vel_y', 'sat_vel_z'], 12]
+          == -sat_pos[1, 2]).all()
+  assert sdiffs[2].ix[:, 3].isnull().all()
+  assert np.isnan(sdiffs.field('D1')).all()
+
+
+def test_sdiffs_cache_key(monkeypatch):
+  inputs = [pd.DataFrame({'P': [1., 2.]}), pd.DataFrame({'L': [3.]})]
+  keys = ['ephemerides', 'rover_obs']
+  names = ['sdiffs', 'rover_spp']
+  key = sdiffs_cache_key(inputs, keys, names)
+  assert sdiffs_cache_key(inputs, list(keys), list(names)) == key
+  assert sdiffs_cache_key(inputs, ['ephemerides', 'rover'], names) != key
+  assert sdiffs_cache_key(inputs, keys, ['sd', 'rover_spp']) != key
+  assert sdiffs_cache_key(inputs[:1] + [inputs[0]], keys, names) != key
+  monkeypatch.setattr(constants, 'EPHEMERIS_TOL', constants.EPHEMERIS_TOL + 1)
+  assert sdiffs_cache_key(inputs, keys, names) != key
+  monkeypatch.undo()
+  monkeypatch.setattr(spp, 'SPP_TOL', spp.SPP_TOL / 10)
+  assert sdiffs_cache_key(inputs, keys, names) != key
+
+
+@pytest.mark.long
+def test_iter_sdiffs_and_pos():
+  with pd.HDFStore(SAMPLE_HDF5, mode='r') as s:
+    ephs, rover_obs, base_obs = _sdiffs_and_pos_inputs(
+      s, 'ephemerides', 'rover_obs', 'base_obs', 'base_obs_integrity',
+      'rover_obs_integrity')
+  rover_obs = rover_obs[:250]
+  base_obs = base_obs[:250]
+  sdiffs, rover_ecef, base_ecef = mk_sdiffs_and_abs_pos(ephs, rover_obs,
+                                                        base_obs)
+  epochs = list(iter_sdiffs_and_pos(ephs, rover_obs, base_obs, window=40))
+  assert [t for t, _, _, _ in epochs] == list(sdiffs.epochs)
+  for i, (t, df, loc, rem) in enumerate(epochs):
+    expected = sdiffs[i].dropna(axis=1, how='all')
+    assert list(df.columns) == list(expected.columns)
+    assert np.allclose(df.values, expected.values, equal_nan=True)
+    assert np.allclose(loc.values, rover_ecef.ix[t].values, equal_nan=True)
+    assert np.allclose(rem.values, base_ecef.ix[t].values, equal_nan=True)
+  stream = SdiffStream(ephs, rover_obs, base_obs, window=40)
+  rover_head, _ = stream.positions(10)
+  assert (rover_head.index == sdiffs.epochs[:10]).all()
+  assert [t for t, _ in stream.iteritems()] == list(sdiffs.epochs)
+
+
+@pytest.mark.long
+def test_mk_sdiffs_and_abs_pos_paths():
+  """The vectorized path should compute the same sdiffs and positions as
+  the epoch by epoch reference path.
+
+  """
+  with pd.HDFStore(SAMPLE_HDF5, mode='r') as s:
+    ephs, rover_obs, base_obs = _sdiffs_and_pos_inputs(
+      s, 'ephemerides', 'rover_obs', 'base_obs', 'base_obs_integrity',
+      'rover_obs_integrity')
+  rover_obs = rover_obs[:100]
+  base_obs = base_obs[:100]
+  sdiffs, rover_ecef, base_ecef = mk_sdiffs_and_abs_pos(ephs, rover_obs,
+                                                        base_obs)
+  loop_sdiffs, loop_rover_ecef, loop_base_ecef = \
+    mk_sdiffs_and_abs_pos(ephs, rover_obs, base_obs, vectorized=False)
+  assert list(sdiffs.epochs) == list(loop_sdiffs.epochs)
+  for i in range(len(sdiffs)):
+    actual = sdiffs[i].dropna(axis=1, how='all')
+    expected = loop_sdiffs[i].dropna(axis=1, how='all')
+    assert list(actual.columns) == list(expected.columns)
+    assert np.allclose(actual.values, expected.values, equal_nan=True)
+  for actual, expected in [(rover_ecef, loop_rover_ecef),
+                           (base_ecef, loop_base_ecef)]:
+    assert list(actual.index) == list(expected.index)
+    assert np.allclose(actual[['x', 'y', 'z']].values, expected.values,
+                       atol=1e-3, equal_nan=True)
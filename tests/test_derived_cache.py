@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Ian Horn <ian@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+from gnss_analysis.derived_cache import DerivedCache, cache_key, table_hash
+import numpy as np
+import os
+import pandas as pd
+
+
+def test_table_hash():
+  df = pd.DataFrame(np.arange(6.).reshape(2, 3), columns=['a', 'b', 'c'])
+  assert table_hash(df) == table_hash(df.copy())
+  changed = df.copy()
+  changed.ix[1, 'c'] = 6.5
+  assert table_hash(changed) != table_hash(df)
+  relabeled = df.copy()
+  relabeled.columns = ['a', 'b', 'd']
+  assert table_hash(relabeled) != table_hash(df)
+  assert cache_key('x', table_hash(df)) != cache_key('y', table_hash(df))
+
+
+def test_derived_cache(tmpdir):
+  cache = DerivedCache(str(tmpdir.join('cache')))
+  df = pd.DataFrame(np.random.randn(100, 3), columns=['x', 'y', 'z'])
+  assert cache.get('a', ['spp']) is None
+  cache.put('a', {'spp': df, 'half': df * 0.5})
+  spp, half = cache.get('a', ['spp', 'half'])
+  assert (spp == df).all().all()
+  assert (half == df * 0.5).all().all()
+
+
+def test_derived_cache_eviction(tmpdir):
+  cache = DerivedCache(str(tmpdir))
+  df = pd.DataFrame(np.random.randn(1000, 3), columns=['x', 'y', 'z'])
+  for i, key in enumerate(['a', 'b', 'c']):
+    cache.put(key, {'spp': df})
+    os.utime(cache.path(key), (i, i))
+  entry_size = os.path.getsize(cache.path('a'))
+  # Using 'a' makes 'b' the least recently used.
+  assert cache.get('a', ['spp']) is not None
+  cache.max_bytes = 2 * entry_size
+  cache.evict()
+  assert sorted(os.listdir(str(tmpdir))) == ['a.hdf5', 'c.hdf5']
+  cache.max_bytes = 0
+  cache.put('d', {'spp': df})
+  assert os.listdir(str(tmpdir)) == ['d.hdf5']
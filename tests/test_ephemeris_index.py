@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Ian Horn <ian@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+from gnss_analysis.data_io import fill_in_ephs, get_fst_ephs, get_timed_ephs
+from gnss_analysis.ephemeris_index import EphemerisIndex
+from gnss_analysis.sat_state import EPH_FIELDS
+from swiftnav.gpstime import gpst_components2datetime
+import numpy as np
+import pandas as pd
+
+
+def mk_ephs():
+  """Two sats with ephemerides at toe = 0h, 2h and 4h of week 1836. Sat 1
+  misses the first, and sat 2 the last.
+
+  """
+  toes = [0, 7200, 14400]
+  items = [gpst_components2datetime(1836, toe) for toe in toes]
+  data = np.empty((3, len(EPH_FIELDS), 2))
+  data.fill(np.nan)
+  for i, toe in enumerate(toes):
+    for s in range(2):
+      if (s, i) in [(0, 0), (1, 2)]:
+        continue
+      data[i, :, s] = i + 10 * s
+      data[i, EPH_FIELDS.index('toe_wn'), s] = 1836
+      data[i, EPH_FIELDS.index('toe_tow'), s] = toe
+  return pd.Panel(data, items=items, major_axis=EPH_FIELDS, minor_axis=[1, 2])
+
+
+def test_fill_in_ephs():
+  ephs = mk_ephs()
+  fst = get_fst_ephs(ephs)
+  assert fst[1]['af0'] == 1
+  assert fst[2]['af0'] == 10
+  filled = fill_in_ephs(ephs, fst)
+  assert list(filled.ix[:, 'af0', 1]) == [1, 1, 2]
+  assert list(filled.ix[:, 'af0', 2]) == [10, 11, 11]
+  t = gpst_components2datetime(1836, 7300)
+  assert get_timed_ephs(filled, t)[2]['af0'] == 11
+  assert get_timed_ephs(filled, ephs.items[0])[2]['af0'] == 10
+
+
+def test_ephemeris_index():
+  ephs = mk_ephs()
+  index = EphemerisIndex(ephs)
+  assert index.sats == [1, 2]
+  t = lambda tow: gpst_components2datetime(1836, tow)
+  # Before the first and at the time of an ephemeris, use the one before.
+  assert index.lookup(t(100), 1)['af0'] == 1
+  assert index.lookup(t(7200), 1)['af0'] == 1
+  assert index.lookup(t(7201), 1)['af0'] == 1
+  assert index.lookup(t(14401), 1)['af0'] == 2
+  # Sat 2's last ephemeris (toe 2h) expires after EPHEMERIS_TOL.
+  assert index.lookup(t(7200 + 4 * 3600), 2)['af0'] == 11
+  assert index.lookup(t(7201 + 4 * 3600), 2) is None
+  grid = index.ephs_at([t(100), t(7201), t(7201 + 4 * 3600)], [2, 1, 3])
+  af0 = grid['af0']
+  assert af0.shape == (3, 3)
+  assert np.isnan(af0[2, 0]) and np.isnan(af0[:, 2]).all()
+  assert list(af0[:2, 0]) == [10, 11]
+  assert list(af0[:, 1]) == [1, 1, 2]
+  intervals = index.intervals(2)
+  assert list(intervals.end) == [1836 * 604800 + 7200,
+                                 1836 * 604800 + 7200 + 4 * 3600]
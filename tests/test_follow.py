@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Bhaskar Mookerji <mookerji@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+from gnss_analysis.table_io import read_table
+from gnss_analysis.tools.follow import LogFollower, OFFSET_ATTR, GPST_COL
+from gnss_analysis.tools.records2table import hdf5_write
+from pandas.util.testing import assert_frame_equal
+import pandas as pd
+
+
+def test_follow(tmpdir):
+  log_datafile \
+    = "./data/serial_link_log_20150314-190228_dl_sat_fail_test1.log.json.dat"
+  expected = hdf5_write(log_datafile, str(tmpdir.join('expected.hdf5')))
+  with open(log_datafile) as f:
+    lines = f.readlines()
+  log = tmpdir.join('serial-link.log.json')
+  filename = str(tmpdir.join('followed.hdf5'))
+  # Grow the log in three steps, the first ending with a partial line.
+  log.write(''.join(lines[:1000]) + lines[1000][:20])
+  follower = LogFollower(str(log), filename, chunk_size=100)
+  assert follower.poll() == 1000
+  log.write(lines[1000][20:] + ''.join(lines[1001:1500]), mode='a')
+  assert follower.poll() == 500
+  follower.finish()
+  # Resume from the offset recorded in the store, twice, the second time
+  # after some of the ephemerides (the log's first is at line 1525).
+  log.write(''.join(lines[1500:1560]), mode='a')
+  follower = LogFollower(str(log), filename, chunk_size=100)
+  assert follower.offset == len(''.join(lines[:1500]))
+  assert follower.poll() == 60
+  follower.finish()
+  log.write(''.join(lines[1560:]), mode='a')
+  follower = LogFollower(str(log), filename, chunk_size=100)
+  # The ephemerides from before the restart are kept.
+  assert sorted(follower.processor.rover_ephemerides) == [10, 27]
+  assert follower.poll() == len(lines) - 1560
+  follower.finish()
+  with pd.HDFStore(expected) as e, pd.HDFStore(filename) as s:
+    assert getattr(s._handle.root._v_attrs, OFFSET_ATTR) == log.size()
+    for tab in ['rover_spp', 'rover_rtk_ned']:
+      assert_frame_equal(read_table(s, tab), e[tab], check_dtype=False)
+    for tab in ['ephemerides', 'rover_ephemerides']:
+      assert_frame_equal(s[tab].to_frame(filter_observations=False),
+                         e[tab].to_frame(filter_observations=False),
+                         check_dtype=False)
+    assert_frame_equal(read_table(s, 'rover_obs').to_frame(),
+                       e.rover_obs.to_frame(), check_dtype=False)
+    logs = read_table(s, 'rover_logs').T
+    assert_frame_equal(logs.drop(GPST_COL, axis=1), e.rover_logs.T,
+                       check_dtype=False)
+    gpst = logs[GPST_COL].dropna()
+    assert len(gpst) > 0
+    assert pd.DatetimeIndex(gpst).is_monotonic_increasing
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Bhaskar Mookerji <mookerji@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+from gnss_analysis.ingest_manifest import IngestManifest, source_entry
+import gnss_analysis.ingest_manifest as im
+import os
+
+
+def test_ingest_manifest(tmpdir, monkeypatch):
+  log = tmpdir.join('serial-link.log.json')
+  log.write('{"timestamp": 1}\n')
+  out = tmpdir.join('serial-link.log.json.hdf5')
+  out.write('')
+  manifest = IngestManifest(str(tmpdir))
+  assert not manifest.is_current(str(log))
+  manifest.record(str(log), source_entry(str(log), str(out)))
+  manifest.save()
+  manifest = IngestManifest(str(tmpdir))
+  assert manifest.is_current(str(log))
+  assert manifest.output(str(log)) == str(out)
+  assert not manifest.changed
+  # Touching the log doesn't change its contents.
+  os.utime(str(log), (0, 0))
+  assert manifest.is_current(str(log))
+  # The new mtime is saved, so the log isn't hashed again.
+  assert manifest.changed
+  manifest.save()
+  manifest = IngestManifest(str(tmpdir))
+  monkeypatch.setattr(im, 'file_hash', None)
+  assert manifest.is_current(str(log))
+  monkeypatch.undo()
+  log.write('{"timestamp": 2}\n')
+  assert not manifest.is_current(str(log))
+  manifest.record(str(log), source_entry(str(log), str(out)))
+  assert manifest.is_current(str(log))
+  im.INGEST_VERSION += 1
+  try:
+    assert not manifest.is_current(str(log))
+  finally:
+    im.INGEST_VERSION -= 1
+  out.remove()
+  assert not manifest.is_current(str(log))
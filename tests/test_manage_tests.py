@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Ian Horn <ian@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+from gnss_analysis.abstract_analysis.analysis import Analysis
+from gnss_analysis.abstract_analysis.checkpoint import SEGMENTS_SUFFIX, \
+  CheckpointError, Checkpointer
+from gnss_analysis.abstract_analysis.manage_tests import AnalysisCycleError, \
+  ExecutionPlan, SITL
+from gnss_analysis.abstract_analysis.report import Report
+import os
+import pytest
+
+
+class Context(object):
+  """Counts the derivations of its datum."""
+  made = []
+
+  def __init__(self, datum):
+    self.datum = datum
+    self.derived = None
+    Context.made.append(self)
+
+  def derive(self):
+    if self.derived is None:
+      self.derived = self.datum * 10
+      self.n_derived = getattr(self, 'n_derived', 0) + 1
+    return self.derived
+
+
+class DerivedA(Analysis):
+  def __init__(self, key):
+    super(DerivedA, self).__init__(key=key, keep_as_map=True)
+
+  def compute(self, data, current_analyses, prev_fold, parameters):
+    return data.derive()
+
+
+class DoubledA(Analysis):
+  def __init__(self):
+    super(DoubledA, self).__init__(key='doubled', keep_as_map=True,
+                                   map_shape=(2,), map_dtype=int)
+
+  def compute(self, data, current_analyses, prev_fold, parameters):
+    return [data.datum, 2 * data.datum]
+
+
+class SumA(Analysis):
+  def __init__(self):
+    super(SumA, self).__init__(key='sum', keep_as_fold=True, fold_init=0,
+                               parents=set([DerivedA('a'), DerivedA('b')]))
+
+  def compute(self, data, current_analyses, prev_fold, parameters):
+    return prev_fold['sum'] + current_analyses['a'] + current_analyses['b']
+
+
+class SumR(Report):
+  def __init__(self):
+    super(SumR, self).__init__(key='sum', parents=set([SumA()]))
+
+  def report(self, data, analyses, folds, parameters):
+    return folds['sum'], list(analyses['a'])
+
+
+class DoubledR(Report):
+  def __init__(self):
+    super(DoubledR, self).__init__(key='doubled', parents=set([DoubledA()]))
+
+  def report(self, data, analyses, folds, parameters):
+    return analyses['doubled']
+
+
+def test_context_function():
+  updated = []
+  update = lambda datum, parameters: updated.append(datum.derive())
+  Context.made = []
+  sitl = SITL(update, [1, 2, 3], context_function=Context)
+  sitl.add_reports([SumR()])
+  assert sitl.compute()['sum'] == (120, [10, 20, 30])
+  assert updated == [10, 20, 30]
+  assert [c.datum for c in Context.made] == [1, 2, 3]
+  assert all(c.n_derived == 1 for c in Context.made)
+
+
+class UnreportedA(Analysis):
+  def __init__(self):
+    super(UnreportedA, self).__init__(key='unreported', keep_as_map=True)
+
+  def compute(self, data, current_analyses, prev_fold, parameters):
+    raise AssertionError("Not needed by any report.")
+
+
+def test_execution_plan():
+  plan = ExecutionPlan([SumR()])
+  keys = [a.key for a, _, _ in plan.steps]
+  assert keys == ['a', 'b', 'sum']
+  assert plan.map_keys == ('a', 'b')
+  assert plan.fold_keys == ('sum',)
+  assert plan.fold_inits() == {'sum': 0}
+  sitl = SITL(lambda datum, parameters: None, [1, 2],
+              context_function=Context)
+  sitl.add_reports([SumR()])
+  sitl.add_analysis(UnreportedA())
+  # The plan is reused, over different data.
+  assert sitl.compute()['sum'] == (60, [10, 20])
+  plan = sitl.plan
+  assert sitl.compute([3])['sum'] == (60, [30])
+  assert sitl.compute()['sum'] == (60, [10, 20])
+  assert sitl.plan is plan
+  other = SITL(lambda datum, parameters: None, [4],
+               context_function=Context, plan=plan)
+  assert other.compute()['sum'] == (80, [40])
+
+
+def test_execution_plan_cycle():
+  a, b = DerivedA('a'), DerivedA('b')
+  a.parents = set([b])
+  b.parents = set([a])
+  report = Report('cycle', set([a]))
+  with pytest.raises(AnalysisCycleError) as e:
+    ExecutionPlan([report])
+  assert 'a, b' in str(e.value)
+  sitl = SITL(lambda datum, parameters: None, [1, 2],
+              context_function=Context)
+  sitl.add_reports([report])
+  with pytest.raises(AnalysisCycleError):
+    sitl.compute()
+
+
+def test_declared_map_shape():
+  sitl = SITL(lambda datum, parameters: None, [1, 2, 3],
+              context_function=Context)
+  sitl.add_reports([DoubledR(), SumR()])
+  doubled = sitl.compute()['doubled']
+  assert list(doubled.index) == [0, 1, 2]
+  assert (doubled[2] == [3, 6]).all()
+  assert sitl.all_maps['doubled'].values.dtype == int
+  assert (sitl.all_maps['doubled'].values[:, 1] == [2, 4, 6]).all()
+  assert sitl.plan.map_specs['doubled'] == ((2,), int)
+  assert sitl.plan.map_specs['a'] == (None, None)
+
+
+class Interrupted(Exception):
+  pass
+
+
+def test_checkpoint_resume(tmpdir):
+  path = str(tmpdir.join('run.ckpt'))
+  total = [0]
+  stop_at = [4]
+  def update(datum, parameters):
+    if datum.datum == stop_at[0]:
+      raise Interrupted()
+    total[0] += datum.datum
+  def mk_sitl(data, **kwargs):
+    sitl = SITL(update, data, context_function=Context,
+                checkpoint=Checkpointer(path, every=2),
+                save_state=lambda: total[0], **kwargs)
+    sitl.add_reports([SumR(), DoubledR()])
+    return sitl
+  data = [1, 2, 3, 4, 5]
+  with pytest.raises(Interrupted):
+    mk_sitl(data).compute()
+  saved = Checkpointer(path).load()
+  assert saved['cursor'] == 2
+  assert [segment['index'] for segment in saved['segments']] == [[0, 1]]
+  assert saved['prev_fold'] == {'sum': 60}
+  assert saved['state'] == 3
+  # Resumed in a fresh filter, which is caught up by rerunning the update
+  # function, while the analyses only run after the checkpoint.
+  total[0] = 0
+  stop_at[0] = None
+  Context.made = []
+  reports = mk_sitl(data).compute()
+  assert reports['sum'] == (300, [10, 20, 30, 40, 50])
+  assert (reports['doubled'][4] == [5, 10]).all()
+  assert total[0] == 15
+  assert [c.datum for c in Context.made if c.derived is not None] == [3, 4, 5]
+  assert not os.path.exists(path)
+
+  # With restore_state, the update function isn't rerun.
+  stop_at[0] = 4
+  with pytest.raises(Interrupted):
+    mk_sitl(data).compute()
+  restored = []
+  stop_at[0] = None
+  sitl = mk_sitl(data, restore_state=restored.append)
+  assert sitl.compute()['sum'] == (300, [10, 20, 30, 40, 50])
+  assert restored == [18]
+
+  # A checkpoint of other data isn't resumed from.
+  stop_at[0] = 4
+  with pytest.raises(Interrupted):
+    mk_sitl(data).compute()
+  with pytest.raises(CheckpointError):
+    mk_sitl([1]).compute()
+  other = mk_sitl(data)
+  other.add_reports([Report('count', set([DerivedA('c')]))])
+  with pytest.raises(CheckpointError):
+    other.compute()
+
+
+def test_checkpoint_segments(tmpdir):
+  path = str(tmpdir.join('run.ckpt'))
+  def update(datum, parameters):
+    if datum.datum == 5:
+      raise Interrupted()
+  def mk_sitl(update):
+    sitl = SITL(update, [1, 2, 3, 4, 5], context_function=Context,
+                checkpoint=Checkpointer(path, every=1))
+    sitl.add_reports([SumR(), DoubledR()])
+    return sitl
+  with pytest.raises(Interrupted):
+    mk_sitl(update).compute()
+  # Each checkpoint only appends the epochs since the previous one.
+  checkpointer = Checkpointer(path)
+  saved = checkpointer.load()
+  assert saved['cursor'] == 4
+  assert [s['index'] for s in saved['segments']] == [[0], [1], [2], [3]]
+  assert [s['columns']['a'] for s in saved['segments']] \
+    == [[10], [20], [30], [40]]
+  # What's past the segments of the checkpoint, as from a run killed
+  # before replacing it, is ignored and then overwritten.
+  with open(checkpointer.segments_path, 'ab') as f:
+    f.write(b'partial segment')
+  sitl = mk_sitl(lambda datum, parameters: None)
+  original_clear = sitl.checkpoint.clear
+  sitl.checkpoint.clear = lambda: None
+  reports = sitl.compute()
+  assert reports['sum'] == (300, [10, 20, 30, 40, 50])
+  assert (reports['doubled'][3] == [4, 8]).all()
+  saved = Checkpointer(path).load()
+  assert [s['index'] for s in saved['segments']] \
+    == [[0], [1], [2], [3], [4]]
+  original_clear()
+  assert not os.path.exists(path)
+  assert not os.path.exists(path + SEGMENTS_SUFFIX)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Ian Horn <ian@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+from gnss_analysis.abstract_analysis.map_columns import DenseColumn, \
+  ObjectColumn, RaggedColumn, mk_column
+import numpy as np
+import pytest
+
+
+def test_mk_column():
+  assert isinstance(mk_column(), ObjectColumn)
+  assert isinstance(mk_column((3,)), DenseColumn)
+  assert isinstance(mk_column((None, None), int), RaggedColumn)
+  assert mk_column(()).values.dtype == np.float64
+
+
+def test_dense_column():
+  column = DenseColumn((3,), np.float64, capacity=2)
+  for i in range(5):
+    column.append(None if i == 3 else np.arange(3.) + i)
+  assert len(column) == 5
+  assert column.values.shape == (5, 3)
+  assert column.values[4, 2] == 6
+  assert np.isnan(column.values[3]).all()
+  series = column.to_series(list('abcde'))
+  assert series['d'] is None
+  assert (series['b'] == [1, 2, 3]).all()
+  scalars = DenseColumn((), int, capacity=1)
+  for i in range(3):
+    scalars.append(i)
+  series = scalars.to_series([0, 1, 2])
+  assert series.dtype == int
+  assert list(series) == [0, 1, 2]
+  scalars.append(None)
+  series = scalars.to_series([0, 1, 2, 3])
+  assert series.dtype == np.float64
+  assert list(series[:3]) == [0, 1, 2]
+  assert np.isnan(series[3])
+  assert scalars.values[3] == 0
+
+
+def test_ragged_column():
+  column = RaggedColumn(2, np.float64, capacity=1)
+  column.append(np.ones((2, 2)))
+  column.append(None)
+  column.append(np.arange(9.).reshape(3, 3))
+  assert len(column) == 3
+  assert list(column.offsets[:4]) == [0, 4, 4, 13]
+  assert column.values.shape == (13,)
+  assert column.row(1) is None
+  assert (column.row(2) == np.arange(9.).reshape(3, 3)).all()
+  series = column.to_series([10, 11, 12])
+  assert series[10].shape == (2, 2)
+  with pytest.raises(ValueError):
+    column.append(np.ones(3))
+
+
+def test_segments():
+  """A column rebuilt from its segments should have the same results."""
+  columns = [(ObjectColumn(), ObjectColumn(), ['a', None, 3, 'd', 5]),
+             (DenseColumn((2,), int, capacity=1), DenseColumn((2,), int, 0),
+              [[0, 1], None, [2, 3], [4, 5], None]),
+             (RaggedColumn(1, np.float64, capacity=1),
+              RaggedColumn(1, np.float64, capacity=0),
+              [np.ones(2), None, np.arange(3.), np.ones(0), np.ones(1)])]
+  for column, rebuilt, values in columns:
+    start = 0
+    for stop in [2, 2, 5]:
+      for value in values[len(column):stop]:
+        column.append(value)
+      rebuilt.extend(column.segment(start))
+      start = stop
+    assert len(rebuilt) == len(values)
+    for a, b in zip(column.to_series(range(5)), rebuilt.to_series(range(5))):
+      assert (a is None and b is None) or np.all(a == b)
+  column, rebuilt, _ = columns[2]
+  assert list(rebuilt.offsets[:6]) == list(column.offsets[:6])
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Ian Horn <ian@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+from gnss_analysis.mk_sdiffs import EPH_COLUMNS, SDIFF_COLUMNS, \
+  merge_into_sdiffs, merge_into_sdiffs_loop
+from gnss_analysis.sat_state import EPH_FIELDS
+from gnss_analysis.tools.records2table import hdf5_write
+import datetime
+import numpy as np
+import pandas as pd
+
+
+def mk_inputs(tmpdir):
+  """An ephemeris table, in the format mk_sdiffs reads, of the
+  ephemerides of a log, and random observations of its sats from an hour
+  before the first ephemeris on.
+
+  """
+  log_datafile \
+    = "./data/serial_link_log_20150314-190228_dl_sat_fail_test1.log.json.dat"
+  filename = hdf5_write(log_datafile, str(tmpdir.join('ephs.hdf5')))
+  with pd.HDFStore(filename) as store:
+    ephs = store.ephemerides
+  rows = []
+  for t in ephs.items:
+    for sat in ephs.minor_axis:
+      eph = ephs[t][sat]
+      if np.isnan(eph['af0']):
+        continue
+      row = dict((EPH_COLUMNS.get(f, f), eph[f]) for f in EPH_FIELDS)
+      row.update(time=t, valid=1, healthy=1, prn=int(sat))
+      rows.append(row)
+  eph_table = pd.DataFrame(rows).set_index('time')
+  np.random.seed(0)
+  times = pd.date_range(ephs.items[0] - datetime.timedelta(hours=1),
+                        periods=40, freq='10min')
+  obs = {}
+  for prn in eph_table['prn'].unique():
+    data = np.random.random((len(times), 4)) * 1e3
+    data[np.random.random(data.shape) < 0.1] = np.nan
+    obs['G%02d' % (prn + 1)] = pd.DataFrame(
+      data, index=times, columns=['C1', 'L1', 'S1_1', 'S1_2'])
+  return eph_table, pd.Panel(obs)
+
+
+def test_merge_into_sdiffs(tmpdir):
+  ephs, sd = mk_inputs(tmpdir)
+  sdiffs = merge_into_sdiffs(ephs, sd)
+  assert list(sdiffs.minor_axis) == SDIFF_COLUMNS
+  parallel = merge_into_sdiffs(ephs, sd, workers=3)
+  expected = merge_into_sdiffs_loop(ephs, sd)
+  assert sorted(sdiffs.items) == sorted(expected.items)
+  for sat in expected.items:
+    df = sdiffs[sat].dropna(how='all')
+    exp = expected[sat].dropna(how='all')[SDIFF_COLUMNS]
+    assert (df.index == exp.index).all()
+    assert np.allclose(df.values, exp.values, rtol=0, atol=1e-4,
+                       equal_nan=True)
+    assert np.allclose(parallel[sat].dropna(how='all').values, df.values,
+                       rtol=0, equal_nan=True)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Ian Horn <ian@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+from gnss_analysis.obs_cube import ObsCube, read_cube, write_cube
+from gnss_analysis.table_io import read_table
+import numpy as np
+import pandas as pd
+
+
+def mk_cube():
+  epochs = pd.date_range('2015-03-01', periods=4, freq='S')
+  data = np.arange(24, dtype=float).reshape(2, 4, 3)
+  data[1, 2, 0] = np.nan
+  return ObsCube(data, epochs, [3, 7, 12], ['P', 'L'])
+
+
+def test_obs_cube_access():
+  cube = mk_cube()
+  assert cube.shape == (4, 3, 2)
+  assert len(cube) == 4
+  assert 'P' in cube and 'cn0' not in cube
+  assert cube.values[1, 2, 1] == cube.field('L')[1, 2] == 17
+  frame = cube.frame('P')
+  assert list(frame.index) == list(cube.epochs)
+  assert list(frame.columns) == [3, 7, 12]
+  epoch = cube[1]
+  assert list(epoch.index) == ['P', 'L']
+  assert epoch.ix['L', 12] == 17
+  # Fields and epoch ranges are views.
+  cube.field('P')[0, 0] = -1.
+  assert cube[1:3].epochs[0] == cube.epochs[1]
+  cube[1:3].field('P')[0, 0] = -2.
+  assert cube.data[0, 0, 0] == -1. and cube.data[0, 1, 0] == -2.
+  between = cube.between(cube.epochs[1], cube.epochs[2])
+  assert list(between.epochs) == list(cube.epochs[1:3])
+  assert [t for t, _ in cube.iteritems()] == list(cube.epochs)
+
+
+def test_obs_cube_reindex_join():
+  cube = mk_cube()
+  r = cube.reindex(sats=[12, 5, 3], fields=['L', 'P'])
+  assert list(r.sats) == [12, 5, 3]
+  assert np.isnan(r.field('L')[:, 1]).all()
+  assert (r.field('P')[:, 0] == cube.field('P')[:, 2]).all()
+  assert np.isnan(r.field('L')[2, 2])
+  sel = cube.select_epochs(pd.Series([True, False], cube.epochs[[0, 3]]))
+  assert list(sel.epochs) == [cube.epochs[0]]
+  other = ObsCube(np.ones((2, 2, 2)), cube.epochs[1:3], [7, 9], ['P', 'cn0'])
+  j = cube.join(other, '_base')
+  assert list(j.fields) == ['P', 'L', 'P_base', 'cn0']
+  assert list(j.sats) == [3, 7, 12]
+  assert (j.field('P_base')[1:3, 1] == 1).all()
+  assert np.isnan(j.field('cn0')[0]).all()
+  assert np.isnan(j.field('cn0')[:, 0]).all()
+
+
+def test_obs_cube_store(tmpdir):
+  cube = mk_cube()
+  cube.data[:, 3, 1] = np.nan
+  with pd.HDFStore(str(tmpdir.join('cube.hdf5')), mode='w') as store:
+    write_cube(store, 'obs', cube)
+    back = read_cube(store, 'obs')
+    # Also readable as a Panel, like streamed records2table tables.
+    panel = read_table(store, 'obs')
+    write_cube(store, 'empty', ObsCube.empty([], [], ['P', 'L']))
+    empty = read_cube(store, 'empty')
+  assert list(back.epochs) == list(cube.epochs)
+  assert list(back.sats) == list(cube.sats)
+  assert list(back.fields) == list(cube.fields)
+  assert np.allclose(back.data, cube.data, equal_nan=True)
+  assert np.allclose(ObsCube.from_panel(panel, cube.fields).data, cube.data,
+                     equal_nan=True)
+  assert len(empty) == 0
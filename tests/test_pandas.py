@@ -78,3 +78,16 @@ def test_gaps():
   assert np.allclose(t.find_largest_gaps(td, 1).values, [120.2])
   assert np.allclose(t.find_largest_gaps(td[0:2], 10).values, [0.2])
   assert np.allclose(t.find_largest_gaps(td[0:1], 10).values, [0])
+
+
+def test_process_raw_log_isolates_failures(tmpdir):
+  log_datafile \
+    = "./data/serial_link_log_20150314-190228_dl_sat_fail_test1.log.json.dat"
+  build = tmpdir.mkdir('bucket').mkdir('builds').mkdir('2015-03-14')
+  with open(log_datafile) as f:
+    build.join('serial-link-good.log.json').write(f.read())
+  build.join('serial-link-bad.log.json').write('{"timestamp": 1, "data": {}}\n')
+  new_files = t.process_raw_log('2015-03-14', bucket_name='bucket',
+                                local_dest=str(tmpdir) + '/', workers=2)
+  assert str(build.join('serial-link-good.log.json.hdf5')) in new_files
+  assert new_files == sorted(new_files)
@@ -9,13 +9,18 @@
 # EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
 # WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
 
-from gnss_analysis.tools.records2table import StoreToHDF5, hdf5_write
+from gnss_analysis.table_io import ChunkedTableWriter, FRAME_LAYOUT, \
+  read_table, table_keys
+from gnss_analysis.tools.records2table import StoreToHDF5, hdf5_write, TABLES
 from numpy import nan
 from pandas.tslib import Timestamp
+from pandas.util.testing import assert_frame_equal
 from sbp.client.loggers.json_logger import JSONLogIterator
+import json
 import os
 import pandas as pd
 import pytest
+import sbp.navigation as nav
 
 
 def test_hdf5():
@@ -150,6 +155,119 @@ def test_hdf5():
     store.rover_iar_state.shape == (0, 0)
 
 
+def test_hdf5_streamed():
+  """Streamed output, flushed many times over, should read back the same
+  as the in-memory conversion.
+
+  """
+  log_datafile \
+    = "./data/serial_link_log_20150314-190228_dl_sat_fail_test1.log.json.dat"
+  filename = log_datafile + ".hdf5"
+  streamed_filename = log_datafile + ".streamed.hdf5"
+  hdf5_write(log_datafile, filename)
+  hdf5_write(log_datafile, streamed_filename, chunk_size=100)
+  with pd.HDFStore(filename) as store:
+    with pd.HDFStore(streamed_filename) as streamed:
+      assert sorted(store.keys()) == sorted(table_keys(streamed))
+      assert streamed.get_storer('rover_obs').is_table
+      for tab, _ in TABLES:
+        expected = store[tab]
+        actual = read_table(streamed, tab)
+        assert type(actual) == type(expected)
+        assert actual.shape == expected.shape
+        if isinstance(expected, pd.Panel):
+          expected = expected.to_frame(filter_observations=False)
+          actual = actual.to_frame(filter_observations=False)
+        assert_frame_equal(actual, expected, check_dtype=False)
+  os.unlink(streamed_filename)
+
+
+def test_chunked_writer_new_columns(tmpdir):
+  """Fields first seen in later chunks, longer strings and non-string
+  values should all read back as they were written, without rewriting
+  what's already written.
+
+  """
+  filename = str(tmpdir.join('chunked.hdf5'))
+  writer = ChunkedTableWriter(filename, 1)
+  writer.append('logs', {0: {'a': 1.0, 'text': 'x'}}, FRAME_LAYOUT)
+  writer.append('logs', {1: {'a': 2.0, 'text': 'y' * 300, 'b': [1, 2]}},
+                FRAME_LAYOUT)
+  writer.append('logs', {2: {'a': 3.0}}, FRAME_LAYOUT)
+  writer.close()
+  writer = ChunkedTableWriter(filename, 1, mode='a')
+  writer.append('logs', {3: {'a': 4.0, 'b': (3,), 'c': 5.0}}, FRAME_LAYOUT)
+  writer.close()
+  with pd.HDFStore(filename) as store:
+    logs = read_table(store, 'logs')
+    assert table_keys(store) == ['/logs']
+    assert store.get_storer('logs').nrows == 2
+  assert list(logs.columns) == [0, 1, 2, 3]
+  assert list(logs.loc['a']) == [1.0, 2.0, 3.0, 4.0]
+  assert nan_equal(logs.loc['text'], ['x', 'y' * 300, nan, nan])
+  assert nan_equal(logs.loc['b'], [nan, [1, 2], nan, (3,)])
+  assert nan_equal(logs.loc['c'], [nan, nan, nan, 5.0])
+
+
+def test_chunked_writer_unstreamed(tmpdir):
+  """Streamed tables should read back the same as unstreamed ones, with
+  missing values as NaN, when fields show up partway through.
+
+  """
+  records = {0: {'host_offset': 0.0, 'text': 'a'},
+             1: {'host_offset': 1.0, 'text': 'b', 'level': 6},
+             2: {'host_offset': 2.0},
+             3: {'host_offset': 3.0, 'text': 'c', 'level': 4}}
+  filename = str(tmpdir.join('streamed.hdf5'))
+  writer = ChunkedTableWriter(filename, 1)
+  for t in sorted(records):
+    writer.append('rover_logs', {t: records[t]}, FRAME_LAYOUT)
+  writer.close()
+  with pd.HDFStore(filename) as store:
+    streamed = read_table(store, 'rover_logs')
+  assert nan_equal(streamed.loc['text'], ['a', 'b', nan, 'c'])
+  assert_frame_equal(streamed, pd.DataFrame(records), check_dtype=False)
+
+
+def nan_equal(a, b):
+  return all(x == y or (x != x and y != y) for x, y in zip(a, b))
+
+
+def test_hdf5_selected_tables():
+  log_datafile \
+    = "./data/serial_link_log_20150314-190228_dl_sat_fail_test1.log.json.dat"
+  filename = log_datafile + ".selected.hdf5"
+  hdf5_write(log_datafile, filename, tables=['rover_spp', 'rover_logs'])
+  with pd.HDFStore(filename) as store:
+    assert sorted(store.keys()) == ['/rover_logs', '/rover_spp']
+    assert store.rover_spp.shape == (9, 5)
+  hdf5_write(log_datafile, filename, num_records=20)
+  with pd.HDFStore(filename) as store:
+    assert store.rover_spp.shape == (9, 2)
+  os.unlink(filename)
+
+
+def test_register_handler():
+  log_datafile \
+    = "./data/serial_link_log_20150314-190228_dl_sat_fail_test1.log.json.dat"
+
+  class VelStore(StoreToHDF5):
+    pass
+
+  def process_vel(store, host_offset, host_time, msg):
+    store.n_vel = getattr(store, 'n_vel', 0) + 1
+
+  VelStore.register_handler(nav.MsgVelNED, process_vel)
+  processor = VelStore()
+  with JSONLogIterator(log_datafile) as log:
+    for msg, data in log.next():
+      processor.process_message(data['delta'], data['timestamp'], msg)
+  assert processor.n_vel == 5
+  assert 'MsgVelNED' not in processor.generic_msgs
+  assert 'MsgVelECEF' in processor.generic_msgs
+  assert nav.MsgVelNED not in StoreToHDF5.handlers
+
+
 @pytest.mark.skipif(True, reason="Add approx. equality test later.")
 def test_ephemeris_log():
   """Test ephemeris data output by hdf5 tool. Will currently fail
@@ -189,3 +307,31 @@ def test_ephemeris_log():
            'healthy': 1.0, 'af1': 2.6147972675971687e-12,
            'w': -1.6667971409741453, 'af0': 0.00042601628229022026,
            'omega0': -2.7040169769321869, 'af2': 0.0}}
+
+
+def test_hdf5_lazy(tmpdir):
+  log_datafile \
+    = "./data/serial_link_log_20150314-190228_dl_sat_fail_test1.log.json.dat"
+  expected = hdf5_write(log_datafile, str(tmpdir.join('expected.hdf5')))
+  lazy = hdf5_write(log_datafile, str(tmpdir.join('lazy.hdf5')), lazy=True)
+  with pd.HDFStore(expected) as e, pd.HDFStore(lazy) as l:
+    assert sorted(e.keys()) == sorted(l.keys())
+    for key in e.keys():
+      if isinstance(e[key], pd.Panel):
+        assert_frame_equal(l[key].to_frame(), e[key].to_frame())
+      else:
+        assert_frame_equal(l[key], e[key])
+
+
+def test_hdf5_profile(tmpdir):
+  log_datafile \
+    = "./data/serial_link_log_20150314-190228_dl_sat_fail_test1.log.json.dat"
+  profile = str(tmpdir.join('profile.json'))
+  hdf5_write(log_datafile, str(tmpdir.join('out.hdf5')), profile=profile)
+  with open(profile) as f:
+    summary = json.load(f)
+  assert summary['records'] == 2222
+  assert summary['msg_types']['MsgObsDepA']['count'] == 97
+  assert summary['msg_types']['MsgPosECEF']['handler_sec'] >= 0
+  assert summary['tables']['rover_obs']['bytes'] > 0
+  assert summary['tables']['rover_obs']['save_sec'] > 0
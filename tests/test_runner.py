@@ -10,8 +10,12 @@
 # WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
 
 from collections import defaultdict
+from gnss_analysis.abstract_analysis.manage_tests import same_state
+from gnss_analysis.data_io import load_sdiffs_and_pos
 from itertools import chain
+import cPickle as pickle
 import gnss_analysis.runner as run
+import gnss_analysis.utils as ut
 import numpy as np
 import pandas as pd
 import pytest
@@ -60,3 +64,25 @@ def test_sanity(capsys):
                             'mean': 1.9237216983756946,
                             'min': 1.89227432506871,
                             'std': 0.0072617625261221447})
+
+
+@pytest.mark.long
+def test_save_state():
+  """The filter state of a checkpoint should come out of the bindings, and
+  be picklable.
+
+  """
+  hdf5_filename = "data/serial-link-20150506-175750.log.json.new_fields.hdf5"
+  data, rover_ecef_df, base_ecef_df = load_sdiffs_and_pos(hdf5_filename)
+  parameters = run.DGNSSParameters(np.array([0.112, 1.317, -0.191]),
+                                   rover_ecef_df, base_ecef_df, True)
+  updater = run.DGNSSUpdater(data[1], parameters.rover_ecef)
+  for _, datum in data[2:50].iteritems():
+    updater.update_function(ut.EpochContext(datum), parameters)
+  state = updater.save_state()
+  assert sorted(state) == ['amb_kf_cov', 'amb_kf_mean', 'amb_kf_prns',
+                           'iar_num_hyps', 'iar_num_sats', 'sats']
+  n = len(state['amb_kf_mean'])
+  assert n > 0
+  assert np.shape(state['amb_kf_cov']) == (n, n)
+  assert same_state(pickle.loads(pickle.dumps(state)), updater.save_state())
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Ian Horn <ian@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+from gnss_analysis.data_io import construct_pyobj_eph
+from gnss_analysis.sat_state import EPH_FIELDS, calc_sat_states
+from gnss_analysis.tools.records2table import hdf5_write
+from swiftnav.ephemeris import calc_sat_state
+from swiftnav.gpstime import GpsTime
+import numpy as np
+import pandas as pd
+
+
+def test_calc_sat_states(tmpdir):
+  log_datafile \
+    = "./data/serial_link_log_20150314-190228_dl_sat_fail_test1.log.json.dat"
+  filename = hdf5_write(log_datafile, str(tmpdir.join('ephs.hdf5')))
+  with pd.HDFStore(filename) as store:
+    ephs = store.ephemerides
+  sats = [(t, sat) for t in ephs.items for sat in ephs.minor_axis
+          if not np.isnan(ephs[t][sat]['af0'])]
+  assert len(sats) > 0
+  offsets = np.arange(0., 4 * 3600., 600.)
+  for t, sat in sats:
+    eph = ephs[t][sat]
+    wn = np.repeat(eph.toe_wn, len(offsets))
+    tow = eph.toe_tow + offsets
+    pos, vel, clock_err, clock_rate_err = \
+      calc_sat_states(eph[EPH_FIELDS], wn, tow)
+    for i in range(len(offsets)):
+      expected = calc_sat_state(construct_pyobj_eph(eph),
+                                GpsTime(wn[i], tow[i]))
+      assert np.allclose(pos[i], expected[0], rtol=0, atol=1e-4)
+      assert np.allclose(vel[i], expected[1], rtol=0, atol=1e-7)
+      assert np.allclose(clock_err[i], expected[2], rtol=0, atol=1e-15)
+      assert np.allclose(clock_rate_err[i], expected[3], rtol=0, atol=1e-18)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Ian Horn <ian@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+from gnss_analysis.constants import GPS_C, MIN_SATS
+from gnss_analysis.data_io import _sdiffs_and_pos_inputs, \
+  calc_timed_sat_states, compute_ecef
+from gnss_analysis.ephemeris_index import EphemerisIndex
+from gnss_analysis.spp import DOP_NAMES, _geometry, solve_spp
+import numpy as np
+import pandas as pd
+import pytest
+
+SAMPLE_HDF5 = "data/serial-link-20150506-175750.log.json.new_fields.hdf5"
+
+RX = np.array([-2704369.0, -4263211.0, 3884307.0])
+
+
+def mk_sats(n_epochs, n_sats):
+  """Random satellites at GPS orbit distances, above the horizon of RX.
+
+  """
+  np.random.seed(0)
+  up = RX / np.linalg.norm(RX)
+  los = np.random.randn(n_epochs, n_sats, 3)
+  los /= np.sqrt((los ** 2).sum(axis=-1))[..., None]
+  below = (los * up).sum(axis=-1) < 0.2
+  los[below] += up
+  los /= np.sqrt((los ** 2).sum(axis=-1))[..., None]
+  return RX + 2.2e7 * los
+
+
+def test_solve_spp():
+  n_epochs, n_sats = 20, 9
+  sat_pos = mk_sats(n_epochs, n_sats)
+  clock_bias = np.linspace(-1e4, 1e4, n_epochs)
+  state = np.column_stack([np.tile(RX, (n_epochs, 1)), clock_bias])
+  ranges, _ = _geometry(state, sat_pos)
+  pseudoranges = ranges + clock_bias[:, None]
+  mask = np.ones((n_epochs, n_sats), dtype=bool)
+  # Too few sats at epoch 0, a NaN pseudorange at epoch 2 and a masked out
+  # outlier at epoch 5.
+  mask[0, 3:] = False
+  pseudoranges[2, 4] = np.nan
+  pseudoranges[5, 2] += 1e5
+  mask[5, 2] = False
+  pos, bias, dops, residuals = solve_spp(pseudoranges, sat_pos, mask)
+  assert np.isnan(pos[0]).all() and np.isnan(bias[0])
+  assert all(np.isnan(dops[d][0]) for d in DOP_NAMES)
+  assert np.isnan(residuals[0]).all()
+  assert np.allclose(pos[1:], RX, rtol=0, atol=1e-4)
+  assert np.allclose(bias[1:], clock_bias[1:], rtol=0, atol=1e-4)
+  assert np.isnan(residuals[2, 4]) and np.isnan(residuals[5, 2])
+  assert np.nanmax(np.abs(residuals)) < 1e-4
+  for i in range(1, n_epochs):
+    assert dops['pdop'][i] <= dops['gdop'][i]
+    assert np.isclose(dops['pdop'][i] ** 2,
+                      dops['hdop'][i] ** 2 + dops['vdop'][i] ** 2)
+    assert np.isclose(dops['gdop'][i] ** 2,
+                      dops['pdop'][i] ** 2 + dops['tdop'][i] ** 2)
+  # Starting from the center of the earth, one iteration doesn't converge.
+  pos, bias, _, _ = solve_spp(pseudoranges, sat_pos, mask, max_iters=1)
+  assert np.isnan(pos).all() and np.isnan(bias).all()
+
+
+def test_solve_spp_dops():
+  sat_pos = mk_sats(1, 6)
+  ranges, los = _geometry(np.append(RX, 0)[None], sat_pos)
+  _, _, dops, _ = solve_spp(ranges, sat_pos)
+  G = np.column_stack([-los[0], np.ones(6)])
+  H = np.linalg.inv(G.T.dot(G))
+  assert np.isclose(dops['gdop'][0], np.sqrt(np.trace(H)))
+  assert np.isclose(dops['tdop'][0], np.sqrt(H[3, 3]))
+
+
+@pytest.mark.long
+def test_solve_spp_calc_PVT():
+  """solve_spp should agree with libswiftnav's calc_PVT on a real log."""
+  with pd.HDFStore(SAMPLE_HDF5, mode='r') as s:
+    ephs, rover_obs, _ = _sdiffs_and_pos_inputs(
+      s, 'ephemerides', 'rover_obs', 'base_obs', 'base_obs_integrity',
+      'rover_obs_integrity')
+  ephs = ephs.ix[:, [f for f in ephs.major_axis if f != 'payload'], :]
+  eph_index = EphemerisIndex(ephs)
+  rover_obs = rover_obs[:50].reindex(sats=eph_index.sats)
+  times, sats = rover_obs.epochs, list(rover_obs.sats)
+  sat_pos, sat_vel, clock_err = calc_timed_sat_states(eph_index, times, sats)
+  pseudoranges = rover_obs.field('P') + clock_err * GPS_C
+  pos, _, _, _ = solve_spp(pseudoranges, sat_pos)
+  n_solved = 0
+  for i, t in enumerate(times):
+    used = ~(np.isnan(pseudoranges[i]) | np.isnan(sat_pos[i]).any(axis=1))
+    if used.sum() < MIN_SATS:
+      assert np.isnan(pos[i]).all()
+      continue
+    # calc_PVT also solves for velocity, which doesn't affect the position.
+    dops = dict((sats[k], 0.) for k in np.flatnonzero(used))
+    expected = compute_ecef(pd.Series(pseudoranges[i], sats), dops,
+                            dict(zip(sats, sat_pos[i])),
+                            dict(zip(sats, sat_vel[i])), t)
+    assert np.allclose(pos[i], expected, rtol=0, atol=1e-3)
+    n_solved += 1
+  assert n_solved > 0
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Ian Horn <ian@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+import gnss_analysis.sweep as sw
+import numpy as np
+import os
+import pytest
+
+
+def test_grid_and_sample():
+  combos = sw.grid({'snr_mask': [30., 40.], 'baseline_offset_x': [0., .1, .2]})
+  assert len(combos) == 6
+  assert combos[1] == {'baseline_offset_x': 0., 'snr_mask': 40.}
+  assert sw.grid({}) == [{}]
+  with pytest.raises(Exception):
+    sw.grid({'not_a_param': [1]})
+  space = {'snr_mask': [30., 40.], 'amb_drift_var': (1e-9, 1e-7)}
+  combos = sw.random_sample(space, 20, seed=1)
+  assert combos == sw.random_sample(space, 20, seed=1)
+  assert len(combos) == 20
+  assert all(c['snr_mask'] in (30., 40.) for c in combos)
+  assert all(1e-9 <= c['amb_drift_var'] < 1e-7 for c in combos)
+  assert sw.parse_param('snr_mask=30,40') == ('snr_mask', [30., 40.])
+  assert sw.parse_param('new_int_var=1:2') == ('new_int_var', (1., 2.))
+
+
+def test_sweep(monkeypatch, tmpdir):
+  def fake_run(filename, baseline, reports=None, baseline_is_NED=False,
+               snr_mask=None, filter_settings=None, cache_dir=None):
+    assert tmpdir.join(filename).check()
+    if snr_mask > 35:
+      raise ValueError("Too few sats.")
+    return {'x': baseline[0], 'settings': sorted(filter_settings)}
+  def fake_load(filename, cache_dir):
+    if filename == 'c.hdf5':
+      raise IOError("Bad file.")
+    tmpdir.join(filename).write(str(os.getpid()))
+  # The workers are forked, so they see the fakes.
+  monkeypatch.setattr(sw, 'single_run', fake_run)
+  monkeypatch.setattr(sw, 'has_filter_settings', lambda: True)
+  monkeypatch.setattr(sw, 'load_sdiffs_and_pos', fake_load)
+  entries = [{'file': f, 'row': f, 'baseline': np.ones(3) * i, 'ned': False}
+             for i, f in enumerate(['a.hdf5', 'b.hdf5', 'c.hdf5'])]
+  combos = sw.grid({'baseline_offset_x': [0., .5], 'snr_mask': [30., 40.],
+                    'amb_init_var': [1e8]})
+  with pytest.warns(UserWarning):
+    table = sw.sweep(entries, combos, workers=2)
+  # The sdiffs are computed once per dataset, in the workers.
+  assert sorted(os.listdir(str(tmpdir))) == ['a.hdf5', 'b.hdf5']
+  assert int(tmpdir.join('a.hdf5').read()) != os.getpid()
+  assert list(table.index.names) == ['dataset', 'amb_init_var',
+                                     'baseline_offset_x', 'snr_mask']
+  assert len(table) == 12
+  assert table.loc[('b.hdf5', 1e8, .5, 30.), 'x'] == 1.5
+  assert table.loc[('a.hdf5', 1e8, 0., 30.), 'settings'] == ['amb_init_var']
+  assert table.loc[('a.hdf5', 1e8, .5, 40.), 'failure'] == 'error'
+  assert (table.loc['c.hdf5', 'failure'] == 'error').all()
+  assert 'Bad file.' in table.loc[('c.hdf5', 1e8, 0., 30.), 'failure_detail']
+  assert table['failure'].notnull().sum() == 8
+
+
+def test_sweep_filter_settings(monkeypatch):
+  """Sweeping filter settings should fail up front, rather than in every
+  run, when the bindings can't set them.
+
+  """
+  def fake_run(*args, **kwargs):
+    assert False
+  monkeypatch.setattr(sw, 'single_run', fake_run)
+  monkeypatch.setattr(sw, 'load_sdiffs_and_pos', fake_run)
+  monkeypatch.setattr(sw, 'has_filter_settings', lambda: False)
+  entries = [{'file': 'a.hdf5', 'row': 0, 'baseline': np.zeros(3),
+              'ned': False}]
+  with pytest.raises(Exception) as e:
+    sw.sweep(entries, sw.grid({'amb_init_var': [1e8, 1e9]}), workers=1)
+  assert 'amb_init_var' in str(e.value)
+  monkeypatch.setattr(sw, 'single_run',
+                      lambda *args, **kwargs: {'x': 1.})
+  monkeypatch.setattr(sw, 'load_sdiffs_and_pos',
+                      lambda filename, cache_dir: None)
+  table = sw.sweep(entries, sw.grid({'snr_mask': [30.]}), workers=1)
+  assert list(table['x']) == [1.]
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Ian Horn <ian@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+from gnss_analysis.data_io import _sdiffs_and_pos_inputs, \
+  mk_sdiffs_and_abs_pos
+from gnss_analysis.utils import mk_swiftnav_sdiff, mk_swiftnav_sdiffs
+import numpy as np
+import pandas as pd
+import pytest
+
+SAMPLE_HDF5 = "data/serial-link-20150506-175750.log.json.new_fields.hdf5"
+
+
+def assert_same_sdiffs(actual, expected):
+  assert list(actual.index) == list(expected.index)
+  for a, e in zip(actual, expected):
+    assert a.prn == e.prn
+    assert a.snr == e.snr
+    assert np.allclose([a.pseudorange, a.carrier_phase, a.doppler],
+                       [e.pseudorange, e.carrier_phase, e.doppler],
+                       equal_nan=True)
+    assert np.allclose(a.sat_pos, e.sat_pos)
+    assert np.allclose(a.sat_vel, e.sat_vel)
+
+
+@pytest.mark.long
+def test_mk_swiftnav_sdiffs():
+  """mk_swiftnav_sdiffs should make the same SingleDiffs as applying
+  mk_swiftnav_sdiff to each satellite of the epoch.
+
+  """
+  with pd.HDFStore(SAMPLE_HDF5, mode='r') as s:
+    ephs, rover_obs, base_obs = _sdiffs_and_pos_inputs(
+      s, 'ephemerides', 'rover_obs', 'base_obs', 'base_obs_integrity',
+      'rover_obs_integrity')
+  sdiffs, _, _ = mk_sdiffs_and_abs_pos(ephs, rover_obs[:50], base_obs[:50])
+  counts = [sdiffs[i].ix['P'].notnull().sum() for i in range(len(sdiffs))]
+  datum = sdiffs[int(np.argmax(counts))]
+  expected = datum.apply(mk_swiftnav_sdiff, axis=0).dropna()
+  assert len(expected) > 0
+  assert_same_sdiffs(mk_swiftnav_sdiffs(datum), expected)
+  snr = datum.ix['snr', expected.index]
+  min_snr = snr.median()
+  filtered = mk_swiftnav_sdiffs(datum, min_snr=min_snr)
+  assert len(filtered) > 0
+  assert_same_sdiffs(filtered, expected[snr >= min_snr])
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Swift Navigation Inc.
+# Contact: Ian Horn <ian@swiftnav.com>
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+from gnss_analysis.worker_pool import WorkerPool
+import os
+import signal
+import time
+
+
+def job(kind, flag=None):
+  """Returns the pid of the worker, after failing as kind says. With
+  flag, it only fails if the file flag doesn't exist yet, creating it.
+
+  """
+  if flag is not None:
+    if os.path.exists(flag):
+      return os.getpid()
+    open(flag, 'w').close()
+  if kind == 'raise':
+    raise ValueError("Job failed.")
+  if kind == 'segfault':
+    os.kill(os.getpid(), signal.SIGSEGV)
+  if kind == 'exit':
+    os._exit(3)
+  if kind == 'sleep':
+    time.sleep(60)
+  if kind == 'memory':
+    return len(' ' * (1 << 30))
+  return os.getpid()
+
+
+def test_worker_pool(tmpdir, monkeypatch):
+  replaced = []
+  replace = WorkerPool._replace
+
+  def _replace(pool, worker):
+    replaced.append(worker)
+    replace(pool, worker)
+  monkeypatch.setattr(WorkerPool, '_replace', _replace)
+  kinds = ['ok', 'raise', 'segfault', 'exit', 'sleep', 'memory', 'ok', 'ok']
+  jobs = [(kind,) for kind in kinds]
+  # Crashes only the first time.
+  jobs.append(('segfault', str(tmpdir.join('flag'))))
+  with WorkerPool(workers=3, timeout=2, max_bytes=512 << 20,
+                  retries=1) as pool:
+    results = dict((i, (result, failure))
+                   for i, result, failure in pool.imap_unordered(job, jobs))
+    assert sorted(results) == range(len(jobs))
+    failures = dict((kinds[i], f) for i, (_, f) in results.iteritems()
+                    if f is not None)
+    assert sorted(failures) == ['exit', 'memory', 'raise', 'segfault',
+                                'sleep']
+    assert 'Job failed.' in failures['raise'].detail
+    assert failures['raise'].attempts == 1
+    assert 'MemoryError' in failures['memory'].detail
+    assert (failures['segfault'].kind, failures['segfault'].detail) \
+      == ('signal', 'SIGSEGV')
+    assert failures['segfault'].attempts == 2
+    assert (failures['exit'].kind, failures['exit'].detail) == ('exit', '3')
+    assert failures['sleep'].kind == 'timeout'
+    assert results[len(jobs) - 1][1] is None
+    assert len(pool.workers) == 3
+    assert replaced and all(w.conn.closed for w in replaced)
+
+
+def test_worker_pool_warm():
+  with WorkerPool(workers=2) as pool:
+    first = set(pid for _, pid, _ in pool.imap_unordered(job, [('ok',)] * 10))
+    second = set(pid for _, pid, _ in pool.imap_unordered(job, [('ok',)] * 10))
+    assert len(first) <= 2
+    assert second <= set(w.process.pid for w in pool.workers)
+    assert first <= set(w.process.pid for w in pool.workers)